@@ -0,0 +1,268 @@
+"""Records outbound HTTP responses to a local fixture store and replays them offline.
+Covers requests (and so the open-meteo client, which is given a requests session) and aiohttp,
+with configurable latency and error injection for benchmarking the pipelines deterministically."""
+import argparse
+import asyncio
+import base64
+from contextlib import contextmanager
+import hashlib
+import io
+import json
+import logging
+import os
+import random
+import runpy
+import sys
+import time
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+import aiohttp
+from multidict import CIMultiDict, CIMultiDictProxy
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+from urllib3 import HTTPResponse
+from yarl import URL
+
+# Fields that change with the run date, left out of fixture keys so a recording keeps matching.
+IGNORED_FIELDS = ("start_date", "end_date", "date")
+
+
+class MissingFixtureError(Exception):
+    """Raised when replaying a request that was never recorded."""
+
+
+def strip_fields(value, ignored: tuple):
+    """Returns a JSON value with the ignored keys removed at every level."""
+    if isinstance(value, dict):
+        return {key: strip_fields(item, ignored) for key, item in value.items()
+                if key not in ignored}
+    if isinstance(value, list):
+        return [strip_fields(item, ignored) for item in value]
+    return value
+
+
+def normalise_url(url: str, ignored: tuple = IGNORED_FIELDS) -> str:
+    """Returns the url with its query sorted and ignored parameters removed."""
+    parts = urlsplit(url)
+    query = sorted((key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+                   if key not in ignored)
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, urlencode(query), ""))
+
+
+def normalise_body(body, ignored: tuple = IGNORED_FIELDS) -> str:
+    """Returns the request body as text, with JSON bodies sorted and ignored keys removed."""
+    if body is None:
+        return ""
+    if isinstance(body, bytes):
+        body = body.decode("utf-8", errors="replace")
+    if not isinstance(body, str):
+        return json.dumps(strip_fields(body, ignored), sort_keys=True)
+    try:
+        return json.dumps(strip_fields(json.loads(body), ignored), sort_keys=True)
+    except ValueError:
+        return body
+
+
+def get_fixture_key(method: str, url: str, body=None, ignored: tuple = IGNORED_FIELDS) -> str:
+    """Returns the fixture file name for a request."""
+    request = "\n".join([method.upper(), normalise_url(url, ignored),
+                         normalise_body(body, ignored)])
+    return hashlib.sha256(request.encode("utf-8")).hexdigest()[:32]
+
+
+def save_fixture(store: str, key: str, method: str, url: str, status: int,
+                 headers: dict, content: bytes) -> None:
+    """Writes a response to the fixture store."""
+    os.makedirs(store, exist_ok=True)
+    fixture = {"method": method.upper(), "url": url, "status": status,
+               "headers": dict(headers),
+               "body": base64.b64encode(content).decode("ascii")}
+    with open(os.path.join(store, f"{key}.json"), "w", encoding="utf-8") as file:
+        json.dump(fixture, file, indent=2)
+
+
+def load_fixture(store: str, key: str, method: str, url: str) -> dict:
+    """Returns a recorded response from the fixture store."""
+    path = os.path.join(store, f"{key}.json")
+    if not os.path.exists(path):
+        raise MissingFixtureError(f"No recording of {method.upper()} {url} in {store}")
+    with open(path, encoding="utf-8") as file:
+        fixture = json.load(file)
+    fixture["content"] = base64.b64decode(fixture["body"])
+    return fixture
+
+
+def get_fault(config: dict) -> tuple[float, bool]:
+    """Returns the latency to add to a replayed response and whether it should fail."""
+    rng = config["random"]
+    latency = max(config["latency"] + rng.uniform(-config["jitter"], config["jitter"]), 0)
+    return latency, rng.random() < config["error_rate"]
+
+
+def build_requests_response(request, fixture: dict) -> requests.Response:
+    """Returns a requests response holding a recorded fixture."""
+    response = requests.Response()
+    response.status_code = fixture["status"]
+    response.headers = CaseInsensitiveDict(fixture["headers"])
+    response.raw = HTTPResponse(body=io.BytesIO(fixture["content"]),
+                                headers=fixture["headers"], status=fixture["status"],
+                                preload_content=False)
+    response._content = fixture["content"]
+    response.encoding = get_encoding_from_headers(response.headers)
+    response.url = request.url
+    response.request = request
+    response.reason = "Replayed"
+    return response
+
+
+def requests_sender(config: dict, original_send):
+    """Returns a replacement for HTTPAdapter.send that records or replays."""
+    def send(adapter, request, **kwargs):
+        key = get_fixture_key(request.method, request.url, request.body, config["ignored"])
+        if config["mode"] == "record":
+            response = original_send(adapter, request, **kwargs)
+            save_fixture(config["store"], key, request.method, request.url,
+                         response.status_code, response.headers, response.content)
+            return response
+
+        fixture = load_fixture(config["store"], key, request.method, request.url)
+        latency, failed = get_fault(config)
+        time.sleep(latency)
+        if failed:
+            fixture = {**fixture, "status": config["error_status"], "content": b""}
+        return build_requests_response(request, fixture)
+    return send
+
+
+class ReplayedClientResponse:
+    """Stands in for aiohttp.ClientResponse with a recorded body."""
+
+    def __init__(self, method: str, url: URL, fixture: dict):
+        self.method = method
+        self.url = url
+        self.status = fixture["status"]
+        self.reason = "Replayed"
+        self.headers = CIMultiDictProxy(CIMultiDict(fixture["headers"]))
+        self.content_length = len(fixture["content"])
+        self._body = fixture["content"]
+
+    @property
+    def ok(self) -> bool:
+        return self.status < 400
+
+    async def read(self) -> bytes:
+        return self._body
+
+    async def text(self, encoding: str = "utf-8") -> str:
+        return self._body.decode(encoding)
+
+    async def json(self, **_):
+        return json.loads(self._body)
+
+    def raise_for_status(self) -> None:
+        if not self.ok:
+            raise aiohttp.ClientResponseError(None, (), status=self.status,
+                                              message=self.reason)
+
+    def release(self) -> None:
+        """Nothing to release, the body is already in memory."""
+
+    def close(self) -> None:
+        """Nothing to close, no connection was opened."""
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *_):
+        return None
+
+
+def get_aiohttp_body(kwargs: dict):
+    """Returns the body an aiohttp request would send."""
+    if kwargs.get("json") is not None:
+        return kwargs["json"]
+    return kwargs.get("data")
+
+
+def aiohttp_requester(config: dict, original_request):
+    """Returns a replacement for ClientSession._request that records or replays."""
+    async def request(session, method: str, str_or_url, **kwargs):
+        url = URL(str_or_url)
+        if kwargs.get("params"):
+            url = url.extend_query(kwargs["params"])
+        body = get_aiohttp_body(kwargs)
+        key = get_fixture_key(method, str(url), body, config["ignored"])
+        if config["mode"] == "record":
+            response = await original_request(session, method, str_or_url, **kwargs)
+            content = await response.read()
+            save_fixture(config["store"], key, method, str(url), response.status,
+                         response.headers, content)
+            return response
+
+        fixture = load_fixture(config["store"], key, method, str(url))
+        latency, failed = get_fault(config)
+        await asyncio.sleep(latency)
+        if failed:
+            fixture = {**fixture, "status": config["error_status"], "content": b""}
+        return ReplayedClientResponse(method, url, fixture)
+    return request
+
+
+@contextmanager
+def http_replay(store: str, mode: str = "replay", latency: float = 0.0, jitter: float = 0.0,
+                error_rate: float = 0.0, error_status: int = 503, seed: int = 0,
+                ignored: tuple = IGNORED_FIELDS):
+    """Records every outbound request to the store, or replays them from it.
+    Replayed responses are delayed by latency (+/- jitter) seconds, and a seeded
+    error_rate fraction of them are replaced with error_status responses."""
+    if mode not in ("record", "replay"):
+        raise ValueError(f"Unknown mode {mode}")
+    config = {"store": store, "mode": mode, "latency": latency, "jitter": jitter,
+              "error_rate": error_rate, "error_status": error_status,
+              "random": random.Random(seed), "ignored": tuple(ignored)}
+
+    original_send = HTTPAdapter.send
+    original_request = aiohttp.ClientSession._request
+    HTTPAdapter.send = requests_sender(config, original_send)
+    aiohttp.ClientSession._request = aiohttp_requester(config, original_request)
+    try:
+        yield config
+    finally:
+        HTTPAdapter.send = original_send
+        aiohttp.ClientSession._request = original_request
+
+
+def run_script(path: str, store: str, mode: str, **options) -> float:
+    """Runs a pipeline script as __main__ under record or replay, returning its wall time."""
+    sys.path.insert(0, os.path.dirname(os.path.abspath(path)))
+    start = time.perf_counter()
+    with http_replay(store, mode, **options):
+        runpy.run_path(path, run_name="__main__")
+    seconds = time.perf_counter() - start
+    logging.info("Ran %s in %s mode in %.2fs", path, mode, seconds)
+    return seconds
+
+
+def get_arguments(args: list = None) -> argparse.Namespace:
+    """Returns the command line arguments."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("script", help="pipeline script to run as __main__")
+    parser.add_argument("--mode", choices=["record", "replay"], default="replay")
+    parser.add_argument("--store", default="benchmarks/fixtures")
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args(args)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    arguments = get_arguments()
+    run_script(arguments.script, arguments.store, arguments.mode,
+               latency=arguments.latency, jitter=arguments.jitter,
+               error_rate=arguments.error_rate, error_status=arguments.error_status,
+               seed=arguments.seed)
@@ -0,0 +1,303 @@
+"""Runs hourly_etl.lambda_handler end to end against a local PostgreSQL and a synthetic
+open-meteo server, at increasing numbers of locations, and gates on regressions.
+Each scale runs in its own process so peak memory is measured separately."""
+import argparse
+from datetime import date, datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlsplit, parse_qs
+import zlib
+
+import flatbuffers
+import numpy as np
+
+HOURLY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          "..", "hourly_pipeline", "hourly_etl_scripts")
+sys.path.insert(0, HOURLY_DIR)
+
+import async_extract  # pylint: disable=wrong-import-position
+import aurora_status  # pylint: disable=wrong-import-position
+import hourly_etl  # pylint: disable=wrong-import-position
+from bulk_load import bulk_load  # pylint: disable=wrong-import-position
+from instrumentation import RECORDS  # pylint: disable=wrong-import-position
+
+SCALES = [71, 1000, 10000]
+REPEATS = 5
+VARIANTS = 4
+TOLERANCE = 0.2
+# open-meteo enum values for temperature_2m, cloud_cover and visibility.
+VARIABLE_IDS = [59, 3, 64]
+# Roughly the United Kingdom.
+LATITUDES = (49.9, 58.7)
+LONGITUDES = (-8.2, 1.8)
+
+AURORA_XML = """<?xml version='1.0' encoding='UTF-8' standalone='yes'?>
+<current_status api_version="0.2.5"><updated><datetime>{updated}</datetime></updated><site_status project_id="" site_id="" site_url="" status_id="{status}"/></current_status>
+"""
+
+
+class FakeContext:
+    """Stands in for the lambda context, with the full 600 second timeout remaining."""
+
+    def get_remaining_time_in_millis(self) -> int:
+        return 600000
+
+
+def make_cities(count: int, seed: int = 0) -> list[tuple]:
+    """Returns synthetic city rows spread over the four countries."""
+    rng = random.Random(seed)
+    return [(f"Synthetic {i}", i % 4 + 1,
+             round(rng.uniform(*LATITUDES), 4), round(rng.uniform(*LONGITUDES), 4),
+             round(rng.uniform(0, 400), 1))
+            for i in range(count)]
+
+
+def build_weather_message(start: int, hours: int, values: list[np.ndarray],
+                          latitude: float = 0.0, longitude: float = 0.0) -> bytes:
+    """Returns one size-prefixed flatbuffer WeatherApiResponse with hourly variables."""
+    builder = flatbuffers.Builder(1024 + hours * 16)
+    variables = []
+    for variable_id, series in zip(VARIABLE_IDS, values):
+        vector = builder.CreateNumpyVector(np.asarray(series, dtype=np.float32))
+        builder.StartObject(14)
+        builder.PrependUint8Slot(0, variable_id, 0)
+        builder.PrependUOffsetTRelativeSlot(3, vector, 0)
+        variables.append(builder.EndObject())
+
+    builder.StartVector(4, len(variables), 4)
+    for variable in reversed(variables):
+        builder.PrependUOffsetTRelative(variable)
+    variable_vector = builder.EndVector()
+
+    builder.StartObject(4)
+    builder.PrependInt64Slot(0, start, 0)
+    builder.PrependInt64Slot(1, start + hours * 3600, 0)
+    builder.PrependInt32Slot(2, 3600, 0)
+    builder.PrependUOffsetTRelativeSlot(3, variable_vector, 0)
+    hourly = builder.EndObject()
+
+    builder.StartObject(15)
+    builder.PrependFloat32Slot(0, latitude, 0.0)
+    builder.PrependFloat32Slot(1, longitude, 0.0)
+    builder.PrependUOffsetTRelativeSlot(11, hourly, 0)
+    builder.FinishSizePrefixed(builder.EndObject())
+    return bytes(builder.Output())
+
+
+def get_forecast_window(params: dict) -> tuple[int, int]:
+    """Returns the start time and number of hours asked for in an open-meteo query."""
+    start = date.fromisoformat(params["start_date"][0])
+    end = date.fromisoformat(params["end_date"][0])
+    start_time = int(datetime(start.year, start.month, start.day,
+                              tzinfo=timezone.utc).timestamp())
+    return start_time, ((end - start).days + 1) * 24
+
+
+def make_variants(start: int, hours: int, variants: int = VARIANTS, seed: int = 0) -> list[bytes]:
+    """Returns a few different forecasts, so repeated runs update some rows."""
+    rng = np.random.default_rng(seed)
+    return [build_weather_message(start, hours,
+                                  [rng.uniform(-5, 20, hours), rng.uniform(0, 100, hours),
+                                   rng.uniform(0, 50000, hours)])
+            for _ in range(variants)]
+
+
+def make_handler(state: dict):
+    """Returns a request handler serving synthetic open-meteo and AuroraWatch responses."""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            parts = urlsplit(self.path)
+            if parts.path.endswith(".xml"):
+                body = AURORA_XML.format(**state["aurora"]).encode("utf-8")
+                content_type = "application/xml"
+            else:
+                body = self.weather_body(parse_qs(parts.query))
+                content_type = "application/octet-stream"
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def weather_body(self, params: dict) -> bytes:
+            window = get_forecast_window(params)
+            with state["lock"]:
+                if window not in state["variants"]:
+                    state["variants"][window] = make_variants(*window)
+            variants = state["variants"][window]
+            latitudes = params["latitude"][0].split(",")
+            return b"".join(variants[(zlib.crc32(latitude.encode()) + state["run"]) % len(variants)]
+                            for latitude in latitudes)
+
+        def log_message(self, *_):
+            pass
+    return Handler
+
+
+def start_server(state: dict) -> ThreadingHTTPServer:
+    """Starts the synthetic API server on a free local port."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def seed_database(conn, cities: list[tuple]) -> None:
+    """Replaces every city with the synthetic ones, adding the four countries if missing."""
+    curs = conn.cursor()
+    curs.execute("""
+        INSERT INTO country (country_id, country_name)
+        VALUES (1, 'England'), (2, 'Scotland'), (3, 'Wales'), (4, 'Northern Ireland')
+        ON CONFLICT DO NOTHING;
+        """)
+    curs.execute("TRUNCATE weather_status, weather_forecast_history, city RESTART IDENTITY CASCADE;")
+    curs.execute("DELETE FROM aurora_fetch_state;")
+    conn.commit()
+    curs.close()
+    bulk_load(conn, "city",
+              ["city_name", "country_id", "latitude", "longitude", "elevation"], cities)
+
+
+def percentile(values: list[float], q: float) -> float:
+    """Returns the q-th percentile of the values."""
+    if not values:
+        return 0.0
+    return float(np.percentile(values, q))
+
+
+def summarise(count: int, runs: list[dict], records: list[dict]) -> dict:
+    """Returns throughput, p50/p95 latency per stage and peak memory for one scale."""
+    stages = {}
+    for record in records:
+        stages.setdefault(record["stage"], []).append(record["seconds"])
+    totals = [run["seconds"] for run in runs]
+    rows = [run["rows"] for run in runs]
+    return {
+        "locations": count,
+        "runs": len(runs),
+        "p50_seconds": percentile(totals, 50),
+        "p95_seconds": percentile(totals, 95),
+        "rows_per_second": sum(rows) / sum(totals) if sum(totals) else 0.0,
+        "locations_per_second": count * len(runs) / sum(totals) if sum(totals) else 0.0,
+        "peak_rss_mb": max((record["peak_rss_mb"] for record in records), default=0.0),
+        "stages": {name: {"p50": percentile(seconds, 50), "p95": percentile(seconds, 95),
+                          "count": len(seconds)}
+                   for name, seconds in sorted(stages.items())}
+    }
+
+
+def run_scale(count: int, repeats: int = REPEATS) -> dict:
+    """Seeds count cities and runs the hourly handler repeats times, returning a summary."""
+    state = {"lock": threading.Lock(), "variants": {}, "run": 0,
+             "aurora": {"updated": "", "status": "green"}}
+    server = start_server(state)
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    async_extract.URL = f"{base_url}/v1/forecast"
+    aurora_status.AURORA_URL = f"{base_url}/current-status.xml"
+    os.environ.pop("WEATHER_CACHE", None)
+
+    conn = hourly_etl.get_connection()
+    seed_database(conn, make_cities(count))
+    conn.close()
+
+    runs, records = [], []
+    for run in range(repeats):
+        state["run"] = run
+        state["aurora"]["updated"] = f"2025-02-12T10:{run:02d}:00+0000"
+        start = time.perf_counter()
+        result = hourly_etl.lambda_handler(None, FakeContext())
+        seconds = time.perf_counter() - start
+        if result["statusCode"] != 200:
+            raise RuntimeError(f"Hourly handler failed at {count} locations: {result}")
+        weather = result["stages"]["weather"]["result"]
+        runs.append({"seconds": seconds,
+                     "rows": weather["inserted"] + weather["updated"] + weather["unchanged"]})
+        records.extend(RECORDS)
+    server.shutdown()
+    return summarise(count, runs, records)
+
+
+def run_in_subprocess(count: int, repeats: int) -> dict:
+    """Runs one scale in a fresh interpreter and returns its summary."""
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), "--run-one", str(count),
+                             "--repeats", str(repeats)],
+                            check=True, capture_output=True, text=True)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def compare_to_baseline(results: list[dict], baseline: list[dict],
+                        tolerance: float = TOLERANCE) -> list[str]:
+    """Returns a description of every scale that is slower or hungrier than the baseline allows."""
+    previous = {result["locations"]: result for result in baseline}
+    regressions = []
+    for result in results:
+        before = previous.get(result["locations"])
+        if before is None:
+            continue
+        checks = [("p95_seconds", result["p95_seconds"] > before["p95_seconds"] * (1 + tolerance)),
+                  ("rows_per_second",
+                   result["rows_per_second"] < before["rows_per_second"] * (1 - tolerance)),
+                  ("peak_rss_mb", result["peak_rss_mb"] > before["peak_rss_mb"] * (1 + tolerance))]
+        for metric, regressed in checks:
+            if regressed:
+                regressions.append(f"{result['locations']} locations: {metric} went from "
+                                   f"{before[metric]:.2f} to {result[metric]:.2f}")
+    return regressions
+
+
+def format_results(results: list[dict]) -> str:
+    """Returns the results as a plain text table."""
+    lines = [f"{'locations':>10} {'p50 s':>8} {'p95 s':>8} {'rows/s':>10} {'peak MB':>8}"]
+    for result in results:
+        lines.append(f"{result['locations']:>10} {result['p50_seconds']:>8.2f} "
+                     f"{result['p95_seconds']:>8.2f} {result['rows_per_second']:>10.0f} "
+                     f"{result['peak_rss_mb']:>8.1f}")
+        for name, stage in result["stages"].items():
+            lines.append(f"{'':>10}   {name:<28} p50 {stage['p50']:.3f}s  "
+                         f"p95 {stage['p95']:.3f}s  n={stage['count']}")
+    return "\n".join(lines)
+
+
+def get_arguments(args: list = None) -> argparse.Namespace:
+    """Returns the command line arguments."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--scales", type=int, nargs="+", default=SCALES)
+    parser.add_argument("--repeats", type=int, default=REPEATS)
+    parser.add_argument("--baseline", help="results file to gate against")
+    parser.add_argument("--save", help="file to write these results to")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    parser.add_argument("--run-one", type=int, help=argparse.SUPPRESS)
+    return parser.parse_args(args)
+
+
+def main(args: list = None) -> int:
+    """Runs every scale, prints the table and returns 1 if the baseline regressed."""
+    arguments = get_arguments(args)
+    if arguments.run_one:
+        logging.disable(logging.INFO)
+        print(json.dumps(run_scale(arguments.run_one, arguments.repeats)))
+        return 0
+
+    results = [run_in_subprocess(count, arguments.repeats) for count in arguments.scales]
+    print(format_results(results))
+    if arguments.save:
+        with open(arguments.save, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+    if arguments.baseline:
+        with open(arguments.baseline, encoding="utf-8") as file:
+            regressions = compare_to_baseline(results, json.load(file), arguments.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,112 @@
+# pylint: skip-file
+import asyncio
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import tempfile
+import threading
+import unittest
+
+import aiohttp
+import requests
+
+from http_replay import http_replay, get_fixture_key, MissingFixtureError
+
+
+class Handler(BaseHTTPRequestHandler):
+    calls = []
+
+    def respond(self):
+        Handler.calls.append(self.path)
+        body = b'{"answer": 42}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = respond
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self.respond()
+
+    def log_message(self, *_):
+        pass
+
+
+class TestHttpReplay(unittest.TestCase):
+    def setUp(self):
+        Handler.calls = []
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}/forecast"
+        self.store = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def record(self):
+        with http_replay(self.store, "record"):
+            requests.get(self.url, params={"latitude": 1, "start_date": "2025-02-10"},
+                         timeout=5)
+        self.server.shutdown()
+
+    def test_requests_replayed_without_network(self):
+        self.record()
+        with http_replay(self.store):
+            response = requests.get(self.url, params={"latitude": 1,
+                                                      "start_date": "2025-03-01"}, timeout=5)
+        self.assertEqual(response.json(), {"answer": 42})
+        self.assertEqual(len(Handler.calls), 1)
+
+    def test_session_replayed(self):
+        self.record()
+        with http_replay(self.store):
+            with requests.Session() as session:
+                self.assertEqual(session.get(f"{self.url}?latitude=1").status_code, 200)
+
+    def test_aiohttp_record_and_replay(self):
+        async def post():
+            async with aiohttp.ClientSession() as session:
+                async with session.post(self.url, json={"observer": {"date": "x"}}) as response:
+                    response.raise_for_status()
+                    return await response.json()
+
+        with http_replay(self.store, "record"):
+            self.assertEqual(asyncio.run(post()), {"answer": 42})
+        self.server.shutdown()
+        with http_replay(self.store):
+            self.assertEqual(asyncio.run(post()), {"answer": 42})
+
+    def test_missing_fixture(self):
+        with http_replay(self.store):
+            with self.assertRaises(MissingFixtureError):
+                requests.get(self.url, timeout=5)
+
+    def test_injected_errors(self):
+        self.record()
+        with http_replay(self.store, error_rate=1.0, error_status=429):
+            response = requests.get(f"{self.url}?latitude=1", timeout=5)
+        self.assertEqual(response.status_code, 429)
+
+    def test_patches_restored(self):
+        original = requests.adapters.HTTPAdapter.send
+        with http_replay(self.store):
+            pass
+        self.assertIs(requests.adapters.HTTPAdapter.send, original)
+
+
+class TestFixtureKey(unittest.TestCase):
+    def test_query_order_and_dates_ignored(self):
+        self.assertEqual(get_fixture_key("get", "https://a.b/c?y=2&x=1&date=1"),
+                         get_fixture_key("GET", "https://a.b/c?x=1&y=2&date=2"))
+
+    def test_json_body_dates_ignored(self):
+        self.assertEqual(get_fixture_key("POST", "https://a.b", '{"date": 1, "a": 2}'),
+                         get_fixture_key("POST", "https://a.b", {"a": 2, "date": 3}))
+        self.assertNotEqual(get_fixture_key("POST", "https://a.b", {"a": 2}),
+                            get_fixture_key("POST", "https://a.b", {"a": 3}))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+# pylint: skip-file
+import threading
+import unittest
+import urllib.request
+
+from scale_benchmark import make_cities, make_variants, get_forecast_window, start_server, summarise, compare_to_baseline
+from async_extract import decode_responses
+from weather_extract import get_weather_columns
+
+
+class TestSyntheticData(unittest.TestCase):
+    def test_cities(self):
+        cities = make_cities(10)
+        self.assertEqual(len(cities), 10)
+        self.assertEqual({city[1] for city in cities}, {1, 2, 3, 4})
+        self.assertEqual(cities, make_cities(10))
+
+    def test_responses_decode_like_open_meteo(self):
+        message = make_variants(1739145600, 192, variants=1)[0]
+        responses = decode_responses(message * 2)
+        columns = get_weather_columns(responses[1].Hourly())
+
+        self.assertEqual(len(responses), 2)
+        self.assertEqual(len(columns["status_at"]), 192)
+        self.assertEqual(str(columns["status_at"][0]), "2025-02-10T00:00:00")
+
+    def test_forecast_window(self):
+        self.assertEqual(get_forecast_window({"start_date": ["2025-02-10"],
+                                              "end_date": ["2025-02-17"]}),
+                         (1739145600, 192))
+
+    def test_server_returns_one_response_per_location(self):
+        state = {"lock": threading.Lock(), "variants": {}, "run": 0,
+                 "aurora": {"updated": "2025-02-12T10:00:00+0000", "status": "red"}}
+        server = start_server(state)
+        base = f"http://127.0.0.1:{server.server_port}"
+        try:
+            with urllib.request.urlopen(f"{base}/v1/forecast?latitude=1,2,3&longitude=1,2,3"
+                                        "&start_date=2025-02-10&end_date=2025-02-10") as response:
+                self.assertEqual(len(decode_responses(response.read())), 3)
+            with urllib.request.urlopen(f"{base}/current-status.xml") as response:
+                self.assertIn(b'status_id="red"', response.read())
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+class TestGate(unittest.TestCase):
+    def result(self, p95, rows_per_second, peak):
+        return {"locations": 71, "p95_seconds": p95, "rows_per_second": rows_per_second,
+                "peak_rss_mb": peak}
+
+    def test_summarise(self):
+        summary = summarise(71, [{"seconds": 1.0, "rows": 100}, {"seconds": 3.0, "rows": 100}],
+                            [{"stage": "load_weather", "seconds": 0.5, "peak_rss_mb": 80.0},
+                             {"stage": "load_weather", "seconds": 1.5, "peak_rss_mb": 90.0}])
+        self.assertEqual(summary["p50_seconds"], 2.0)
+        self.assertEqual(summary["rows_per_second"], 50.0)
+        self.assertEqual(summary["peak_rss_mb"], 90.0)
+        self.assertEqual(summary["stages"]["load_weather"]["p50"], 1.0)
+
+    def test_within_tolerance(self):
+        self.assertEqual(compare_to_baseline([self.result(1.1, 950, 105)],
+                                             [self.result(1.0, 1000, 100)]), [])
+
+    def test_regressions(self):
+        regressions = compare_to_baseline([self.result(1.5, 500, 200)],
+                                          [self.result(1.0, 1000, 100)])
+        self.assertEqual(len(regressions), 3)
+
+    def test_new_scale_ignored(self):
+        self.assertEqual(compare_to_baseline([self.result(9, 1, 999)], []), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
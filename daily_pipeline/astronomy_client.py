@@ -0,0 +1,264 @@
+"""Asynchronous client for the Astronomy API studio endpoints.
+Requests share a token bucket sized to our Astronomy API plan and a concurrency cap,
+time out individually and are only retried on statuses worth retrying."""
+import asyncio
+from os import environ as ENV
+import logging
+import random
+import time
+
+import aiohttp
+
+from instrumentation import add_metric, timed
+from solar import get_city_sun_times
+from lunar import get_city_moon_data
+from chart_planner import plan_star_charts
+from image_store import get_store
+from work_queue import run_work_queue
+
+STUDIO_URL = "https://api.astronomyapi.com/api/v2/studio"
+
+# Our Astronomy API plan allows a short burst, then a steady rate per second.
+RATE = 5.0
+BURST = 10
+CONCURRENCY = 10
+RETRIES = 3
+BACKOFF = 0.5
+REQUEST_TIMEOUT = 30
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+
+
+class RetryableStatusError(Exception):
+    """Raised when an API responds with a status worth retrying."""
+
+    def __init__(self, message: str, status: int = None):
+        super().__init__(message)
+        self.status = status
+
+
+class TokenBucket:
+    """Allows rate requests per second on average, with bursts of up to capacity."""
+
+    def __init__(self, rate: float = RATE, capacity: int = BURST):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def refill(self) -> None:
+        """Adds the tokens earned since the last refill."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self) -> None:
+        """Waits until a token is free, then takes it. Waiters are served in turn."""
+        async with self.lock:
+            self.refill()
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self.refill()
+            self.tokens -= 1
+
+
+def get_limits() -> dict:
+    """Returns the rate, burst and concurrency limits, which the environment can override."""
+    return {"rate": float(ENV.get("ASTRONOMY_RATE", RATE)),
+            "burst": int(ENV.get("ASTRONOMY_BURST", BURST)),
+            "concurrency": int(ENV.get("ASTRONOMY_CONCURRENCY", CONCURRENCY))}
+
+
+def create_session(concurrency: int = CONCURRENCY) -> aiohttp.ClientSession:
+    """Returns a session with a connection pool sized to the concurrency limit."""
+    connector = aiohttp.TCPConnector(limit=concurrency, ttl_dns_cache=300)
+    return aiohttp.ClientSession(connector=connector,
+                                 timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT))
+
+
+def get_star_chart_body(lat: float, long: float, date_to_query: str) -> dict:
+    """Returns the request body for a star chart of the sky above a location."""
+    return {
+        "observer": {
+            "latitude": lat,
+            "longitude": long,
+            "date": date_to_query
+        },
+        "view": {
+            "type": "area",
+            "parameters": {
+                "position": {
+                    "equatorial": {
+                        "rightAscension": 0.0,
+                        "declination": lat
+                    }
+                }
+            }
+        }
+    }
+
+
+def get_constellation_body(lat: float, long: float, date_to_query: str, code: str) -> dict:
+    """Returns the request body for a chart of one constellation."""
+    return {
+        "style": "default",
+        "observer": {
+            "latitude": lat,
+            "longitude": long,
+            "date": date_to_query
+        },
+        "view": {
+            "type": "constellation",
+            "parameters": {
+                "constellation": code
+            }
+        }
+    }
+
+
+async def request_json(session: aiohttp.ClientSession, method: str, url: str,
+                       semaphore: asyncio.Semaphore, bucket: TokenBucket = None,
+                       retries: int = RETRIES, backoff: float = BACKOFF,
+                       read_bytes: bool = False, **kwargs) -> dict:
+    """Sends a request under the concurrency cap, taking a token first when given a bucket.
+    Timeouts, connection errors and retryable statuses are retried with jittered backoff,
+    any other error status is raised straight away. Returns the parsed JSON, or the raw
+    body when read_bytes is set."""
+    for attempt in range(retries + 1):
+        if bucket is not None:
+            await bucket.acquire()
+        async with semaphore:
+            try:
+                async with session.request(method, url, **kwargs) as response:
+                    if response.status in RETRYABLE_STATUSES:
+                        raise RetryableStatusError(f"{url} responded with {response.status}",
+                                                   response.status)
+                    response.raise_for_status()
+                    data = await response.read()
+                    add_metric("bytes_fetched", len(data))
+                    return data if read_bytes else await response.json()
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError,
+                    RetryableStatusError) as err:
+                if attempt == retries:
+                    raise
+                add_metric("retries")
+                logging.warning("Request to %s failed (%s), retrying", url, err)
+        await asyncio.sleep(backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+    return {}
+
+
+async def fetch_studio_image(session, endpoint: str, body: dict, header: str,
+                             semaphore, bucket: TokenBucket) -> str:
+    """Returns the image url the Astronomy API studio renders for the body."""
+    result = await request_json(session, "POST", f"{STUDIO_URL}/{endpoint}", semaphore, bucket,
+                                headers={"Authorization": header}, json=body)
+    return result["data"]["imageUrl"]
+
+
+async def store_image(session, url: str, store, semaphore) -> str:
+    """Downloads an image into the blob store, returning its key."""
+    data = await request_json(session, "GET", url, semaphore, read_bytes=True)
+    key = await asyncio.to_thread(store.put, data)
+    add_metric("images_stored")
+    return key
+
+
+async def store_images(session, urls: list[str], store, semaphore) -> dict:
+    """Downloads each distinct image once into the blob store, returning keys by url."""
+    urls = list(dict.fromkeys(urls))
+    keys = await asyncio.gather(*[store_image(session, url, store, semaphore) for url in urls])
+    return dict(zip(urls, keys))
+
+
+async def fetch_star_charts(session, charts: list[tuple], header: str,
+                            semaphore, bucket: TokenBucket) -> dict:
+    """Returns the image url of each planned (lat, long, date) star chart."""
+    urls = await asyncio.gather(*[
+        fetch_studio_image(session, "star-chart", get_star_chart_body(lat, long, day),
+                           header, semaphore, bucket) for lat, long, day in charts])
+    return dict(zip(charts, urls))
+
+
+async def fetch_star_chart_keys(session, charts: list[tuple], header: str, store,
+                                semaphore, bucket: TokenBucket) -> dict:
+    """Requests each planned (lat, long, date) star chart and keeps its image in the blob
+    store, returning the blob key of each chart."""
+    urls = await fetch_star_charts(session, charts, header, semaphore, bucket)
+    keys = await store_images(session, list(urls.values()), store, semaphore)
+    return {chart: keys[url] for chart, url in urls.items()}
+
+
+async def fetch_future_data(cities: list[dict], new_date: str, header: str,
+                            session: aiohttp.ClientSession = None, rate: float = RATE,
+                            burst: int = BURST, concurrency: int = CONCURRENCY,
+                            grid: tuple[float, float] = None, store=None) -> list[tuple]:
+    """Returns every city's stargazing_status row for the date, in the order of cities.
+    Only star charts are requested, one per occupied grid cell, the sun times and the
+    moon's image, illumination, moonrise and moonset are computed locally. Images are
+    kept in the blob store and rows hold their keys."""
+    semaphore = asyncio.Semaphore(concurrency)
+    bucket = TokenBucket(rate, burst)
+    store = store or get_store()
+    sun_times = get_city_sun_times(cities, [new_date])
+    moon = get_city_moon_data(cities, [new_date], store=store)
+    plan = plan_star_charts(cities, [new_date], grid)
+
+    if session is not None:
+        charts = await fetch_star_chart_keys(session, plan["charts"], header, store,
+                                             semaphore, bucket)
+    else:
+        async with create_session(concurrency) as new_session:
+            charts = await fetch_star_chart_keys(new_session, plan["charts"], header, store,
+                                                 semaphore, bucket)
+
+    rows = []
+    for city in cities:
+        key = (city.get("city_id"), new_date)
+        rows.append((city.get("city_id"), *sun_times[key], new_date,
+                     charts[plan["lookup"][key]], *moon[key]))
+    return rows
+
+
+@timed("extract_daily_data", rows=len)
+def get_future_data_async(cities: list[dict], new_date: str, header: str,
+                          **limits) -> list[tuple]:
+    """Runs fetch_future_data from synchronous code."""
+    return asyncio.run(fetch_future_data(cities, new_date, header, **limits))
+
+
+async def fetch_constellations(codes: list[str], header: str, lat: float, long: float,
+                               date_to_query: str, session: aiohttp.ClientSession = None,
+                               rate: float = RATE, burst: int = BURST,
+                               concurrency: int = CONCURRENCY, store=None,
+                               **queue_options) -> dict:
+    """Fetches each constellation's chart through the work queue, on one session, and
+    downloads it into the blob store. The queue does the retrying, so each attempt is a
+    single request. Returns the blob keys by code and the dead letters of codes that
+    kept failing."""
+    semaphore = asyncio.Semaphore(concurrency)
+    bucket = TokenBucket(rate, burst)
+    store = store or get_store()
+
+    async def run(active_session):
+        async def fetch(code: str) -> str:
+            result = await request_json(
+                active_session, "POST", f"{STUDIO_URL}/star-chart", semaphore, bucket,
+                retries=0, headers={"Authorization": header},
+                json=get_constellation_body(lat, long, date_to_query, code))
+            if "data" not in result:
+                raise ValueError(f"No chart for {code}: {result}")
+            return await store_image(active_session, result["data"]["imageUrl"], store,
+                                     semaphore)
+        return await run_work_queue(codes, fetch, **queue_options)
+
+    if session is not None:
+        return await run(session)
+    async with create_session(concurrency) as new_session:
+        return await run(new_session)
+
+
+@timed("extract_constellations", rows=lambda outcome: len(outcome["results"]))
+def get_constellations_async(codes: list[str], header: str, lat: float, long: float,
+                             date_to_query: str, **options) -> dict:
+    """Runs fetch_constellations from synchronous code."""
+    return asyncio.run(fetch_constellations(codes, header, lat, long, date_to_query, **options))
@@ -0,0 +1,310 @@
+"""Bulk loads rows into postgreSQL by streaming them through COPY into a staging table,
+then merging the staging table into the target in a single statement.
+Table and column names are interpolated into the SQL, so they must never come from user input."""
+from datetime import datetime, date, timezone
+import io
+import logging
+import struct
+import time
+
+import numpy as np
+import psycopg2.extensions
+
+PG_EPOCH = datetime(2000, 1, 1)
+PG_EPOCH_DAYS = 10957
+PG_EPOCH_MICROSECONDS = PG_EPOCH_DAYS * 86400 * 1000000
+BINARY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+BINARY_TRAILER = struct.pack(">h", -1)
+CHUNK_ROWS = 1000
+
+
+class RowStream(io.RawIOBase):
+    """File-like object that COPY reads from, encoding rows lazily as it goes."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = b""
+        self.bytes_read = 0
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        self.bytes_read += len(data)
+        return data
+
+
+def to_naive_utc(value: datetime) -> datetime:
+    """Returns timezone aware datetimes as naive UTC, as stored in TIMESTAMP columns."""
+    if value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def format_text_value(value) -> str:
+    """Returns a value in COPY's text format."""
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, datetime):
+        value = to_naive_utc(value).isoformat(sep=" ")
+    return (str(value).replace("\\", "\\\\").replace("\t", "\\t")
+            .replace("\n", "\\n").replace("\r", "\\r"))
+
+
+def encode_text_rows(rows, counter: list):
+    """Yields chunks of rows encoded in COPY's text format."""
+    lines = []
+    for row in rows:
+        lines.append("\t".join(format_text_value(value) for value in row))
+        counter[0] += 1
+        if len(lines) == CHUNK_ROWS:
+            yield ("\n".join(lines) + "\n").encode("utf-8")
+            lines = []
+    if lines:
+        yield ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def encode_timestamp(value) -> bytes:
+    """Encodes a timestamp as microseconds since 2000-01-01."""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    delta = to_naive_utc(value) - PG_EPOCH
+    return struct.pack(">q", (delta.days * 86400 + delta.seconds) * 1000000
+                       + delta.microseconds)
+
+
+def encode_date(value) -> bytes:
+    """Encodes a date as days since 2000-01-01."""
+    if isinstance(value, str):
+        value = date.fromisoformat(value)
+    if isinstance(value, datetime):
+        value = value.date()
+    return struct.pack(">i", (value - PG_EPOCH.date()).days)
+
+
+BINARY_ENCODERS = {
+    "smallint": lambda value: struct.pack(">h", value),
+    "integer": lambda value: struct.pack(">i", value),
+    "bigint": lambda value: struct.pack(">q", value),
+    "real": lambda value: struct.pack(">f", value),
+    "double precision": lambda value: struct.pack(">d", value),
+    "boolean": lambda value: struct.pack(">?", bool(value)),
+    "timestamp without time zone": encode_timestamp,
+    "timestamp with time zone": encode_timestamp,
+    "date": encode_date,
+    "text": lambda value: str(value).encode("utf-8"),
+    "character varying": lambda value: str(value).encode("utf-8"),
+}
+
+
+def get_binary_encoders(column_types: list[str]) -> list:
+    """Returns an encoder for each column type, in order."""
+    encoders = []
+    for column_type in column_types:
+        base_type = column_type.split("(")[0]
+        if base_type not in BINARY_ENCODERS:
+            raise ValueError(
+                f"Binary COPY does not support {column_type} columns, use text format")
+        encoders.append(BINARY_ENCODERS[base_type])
+    return encoders
+
+
+def encode_binary_rows(rows, column_types: list[str], counter: list):
+    """Yields chunks of rows encoded in COPY's binary format."""
+    encoders = get_binary_encoders(column_types)
+    field_count = struct.pack(">h", len(encoders))
+    chunk = [BINARY_HEADER]
+    for row in rows:
+        chunk.append(field_count)
+        for encoder, value in zip(encoders, row):
+            if value is None:
+                chunk.append(struct.pack(">i", -1))
+            else:
+                data = encoder(value)
+                chunk.append(struct.pack(">i", len(data)) + data)
+        counter[0] += 1
+        if counter[0] % CHUNK_ROWS == 0:
+            yield b"".join(chunk)
+            chunk = []
+    chunk.append(BINARY_TRAILER)
+    yield b"".join(chunk)
+
+
+NUMPY_TYPES = {
+    "smallint": ">i2",
+    "integer": ">i4",
+    "bigint": ">i8",
+    "real": ">f4",
+    "double precision": ">f8",
+    "boolean": "?",
+    "timestamp without time zone": ">i8",
+    "timestamp with time zone": ">i8",
+    "date": ">i4",
+}
+
+
+def to_binary_array(values, column_type: str) -> np.ndarray:
+    """Converts an array to the values postgreSQL expects for the column type.
+    Timestamps and dates are given as datetime64 arrays."""
+    values = np.asarray(values)
+    if column_type.startswith("timestamp"):
+        return values.astype("datetime64[us]").astype(np.int64) - PG_EPOCH_MICROSECONDS
+    if column_type == "date":
+        return values.astype("datetime64[D]").astype(np.int64) - PG_EPOCH_DAYS
+    return values
+
+
+def encode_binary_columns(columns: dict, names: list[str], column_types: list[str],
+                          counter: list):
+    """Yields chunks of COPY's binary format built from whole numpy columns.
+    Only fixed width types are supported, and no Python object is made per row."""
+    for column_type in column_types:
+        if column_type not in NUMPY_TYPES:
+            raise ValueError(
+                f"Columnar COPY does not support {column_type} columns, use rows")
+    arrays = [to_binary_array(columns[name], column_type)
+              for name, column_type in zip(names, column_types)]
+    dtype = np.dtype([("fields", ">i2")] + [
+        field for i, column_type in enumerate(column_types)
+        for field in ((f"length_{i}", ">i4"), (f"value_{i}", NUMPY_TYPES[column_type]))])
+    total = len(arrays[0]) if arrays else 0
+
+    yield BINARY_HEADER
+    for start in range(0, total, CHUNK_ROWS * 10):
+        end = min(start + CHUNK_ROWS * 10, total)
+        block = np.empty(end - start, dtype=dtype)
+        block["fields"] = len(arrays)
+        for i, array in enumerate(arrays):
+            block[f"length_{i}"] = np.dtype(NUMPY_TYPES[column_types[i]]).itemsize
+            block[f"value_{i}"] = array[start:end]
+        counter[0] += end - start
+        yield block.tobytes()
+    yield BINARY_TRAILER
+
+
+def get_column_types(curs, table: str, columns: list[str]) -> list[str]:
+    """Returns the postgreSQL type of each column, in order."""
+    curs.execute("""
+        SELECT attname, format_type(atttypid, atttypmod)
+        FROM pg_attribute
+        WHERE attrelid = %s::regclass
+        AND attnum > 0
+        AND NOT attisdropped;
+        """, (table,))
+    types = dict(curs.fetchall())
+    return [types[column] for column in columns]
+
+
+def create_staging_table(curs, target: str, staging: str, columns: list[str]) -> None:
+    """Creates an empty temporary table with the target's columns, dropped on commit."""
+    curs.execute(f"""
+        CREATE TEMPORARY TABLE {staging} ON COMMIT DROP AS
+        SELECT {", ".join(columns)}
+        FROM {target}
+        WITH NO DATA;
+        """)
+
+
+def copy_rows(curs, staging: str, columns: list[str], rows, binary: bool = False) -> tuple:
+    """Streams rows into the staging table with COPY FROM STDIN.
+    Rows may also be given as a dict of numpy arrays keyed by column, which is sent
+    in binary format. Returns the number of rows and bytes sent."""
+    counter = [0]
+    if isinstance(rows, dict):
+        chunks = encode_binary_columns(
+            rows, columns, get_column_types(curs, staging, columns), counter)
+        copy_format = "binary"
+    elif binary:
+        chunks = encode_binary_rows(
+            rows, get_column_types(curs, staging, columns), counter)
+        copy_format = "binary"
+    else:
+        chunks = encode_text_rows(rows, counter)
+        copy_format = "text"
+    stream = RowStream(chunks)
+    curs.copy_expert(
+        f"COPY {staging} ({', '.join(columns)}) FROM STDIN WITH (FORMAT {copy_format})",
+        stream)
+    return counter[0], stream.bytes_read
+
+
+def merge_query(target: str, staging: str, columns: list[str],
+                conflict: list[str] = None, update: list[str] = None,
+                returning: list[str] = None) -> str:
+    """Returns a statement inserting the staged rows into the target.
+    Conflicting rows are skipped, or updated only when one of the update columns changed.
+    The returning columns of every row written are returned after the inserted flag."""
+    query = f"""
+        INSERT INTO {target} ({", ".join(columns)})
+        SELECT {", ".join(columns)}
+        FROM {staging}
+        """
+    if conflict and update:
+        query += f"""
+        ON CONFLICT ({", ".join(conflict)})
+        DO UPDATE SET {", ".join(f"{column} = EXCLUDED.{column}" for column in update)}
+        WHERE ({", ".join(f"{target}.{column}" for column in update)})
+        IS DISTINCT FROM ({", ".join(f"EXCLUDED.{column}" for column in update)})
+        """
+    elif conflict:
+        query += f"""
+        ON CONFLICT ({", ".join(conflict)})
+        DO NOTHING
+        """
+    return query + f"RETURNING {', '.join(['(xmax = 0) AS inserted'] + (returning or []))};"
+
+
+def copy_merge(curs, target: str, columns: list[str], rows, conflict: list[str] = None,
+               update: list[str] = None, binary: bool = False,
+               returning: list[str] = None) -> dict:
+    """Stages rows with COPY and merges them into the target without committing.
+    Expects a cursor returning tuples. Returns row counts and throughput, and the
+    returning columns of the rows written when any are asked for."""
+    start = time.perf_counter()
+    staging = f"{target}_staging"
+    create_staging_table(curs, target, staging, columns)
+    staged, bytes_sent = copy_rows(curs, staging, columns, rows, binary)
+    curs.execute(merge_query(target, staging, columns, conflict, update, returning))
+    results = curs.fetchall()
+    written = [row[0] for row in results]
+    seconds = time.perf_counter() - start
+
+    inserted = sum(written)
+    stats = {"rows": staged,
+             "inserted": inserted,
+             "updated": len(written) - inserted,
+             "unchanged": staged - len(written),
+             "bytes": bytes_sent,
+             "seconds": seconds,
+             "rows_per_second": staged / seconds if seconds else 0.0}
+    if returning:
+        stats["written"] = [tuple(row[1:]) for row in results]
+    logging.info("Loaded %s rows into %s in %.3fs (%.0f rows/s, %.2f MB/s)",
+                 staged, target, seconds, stats["rows_per_second"],
+                 bytes_sent / seconds / 1e6 if seconds else 0.0)
+    return stats
+
+
+def bulk_load(connection, target: str, columns: list[str], rows, conflict: list[str] = None,
+              update: list[str] = None, binary: bool = False) -> dict:
+    """Stages rows with COPY and merges them into the target in one transaction."""
+    curs = connection.cursor(cursor_factory=psycopg2.extensions.cursor)
+    try:
+        stats = copy_merge(curs, target, columns, rows, conflict, update, binary)
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        curs.close()
+    return stats
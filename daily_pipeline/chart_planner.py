@@ -0,0 +1,44 @@
+"""Plans which star charts to request so nearby cities share one.
+The area view points the chart at a declination equal to the observer's latitude, so
+cities a few km apart get the same chart. Observers are snapped to the centre of a
+lat/lon grid cell, and one chart is requested per occupied cell per date."""
+from os import environ as ENV
+import logging
+import math
+
+from instrumentation import add_metric
+
+# A degree of longitude only turns the sky by four minutes, so cells are wider than tall.
+LAT_GRID = 1.0
+LONG_GRID = 2.0
+
+
+def get_grid() -> tuple[float, float]:
+    """Returns the cell height and width in degrees, which the environment can override."""
+    return (float(ENV.get("STAR_CHART_LAT_GRID", LAT_GRID)),
+            float(ENV.get("STAR_CHART_LONG_GRID", LONG_GRID)))
+
+
+def get_cell(lat: float, long: float, grid: tuple[float, float]) -> tuple[float, float]:
+    """Returns the centre of the grid cell a location falls in."""
+    lat_step, long_step = grid
+    return (round((math.floor(lat / lat_step) + 0.5) * lat_step, 4),
+            round((math.floor(long / long_step) + 0.5) * long_step, 4))
+
+
+def plan_star_charts(cities: list[dict], dates: list[str],
+                     grid: tuple[float, float] = None) -> dict:
+    """Returns the (lat, long, date) charts to request, in the order first needed,
+    and a lookup from (city_id, date) to the chart that city shares."""
+    grid = grid or get_grid()
+    charts, lookup = {}, {}
+    for city in cities:
+        cell = get_cell(city.get("latitude"), city.get("longitude"), grid)
+        for day in dates:
+            chart = (*cell, day)
+            charts.setdefault(chart, None)
+            lookup[(city.get("city_id"), day)] = chart
+    logging.info("Planned %s star charts for %s city days", len(charts), len(lookup))
+    add_metric("star_charts_planned", len(charts))
+    add_metric("star_charts_shared", len(lookup) - len(charts))
+    return {"charts": list(charts), "lookup": lookup}
@@ -4,18 +4,14 @@ from datetime import datetime, date, timedelta
 import logging
 
 import asyncio
-import aiohttp
 from dotenv import load_dotenv
-from daily_etl import configure_logs, get_connection, get_locations
-
-
-async def get_sunrise_and_set_times(session, lat: float, long: float, date_to_query: str):
-    """Call from the open meteo API to get the daily sunrise and sunset times"""
-    url = f"https://api.open-meteo.com/v1/forecast?latitude={lat}&longitude={long}&daily=sunrise,sunset&timezone=auto&start_date={date_to_query}&end_date={date_to_query}"
-    response = await session.get(url)
-    data = await response.json()
-
-    return data
+from daily_etl import configure_logs, get_connection, get_locations, STARGAZING_COLUMNS
+from bulk_load import bulk_load
+from solar import get_city_sun_times
+from lunar import get_city_moon_data
+from chart_planner import plan_star_charts
+from image_store import get_store
+from astronomy_client import fetch_star_chart_keys, create_session, get_limits, TokenBucket
 
 
 def get_constellations(connection):
@@ -27,104 +23,39 @@ def get_constellations(connection):
     return rows
 
 
-async def post_location_get_starchart(session, header: str, lat: float, long: float, date_to_query: str):
-    """returns the url of a star chart for specific coordinates"""
-    body = {
-        "observer": {
-            "latitude": lat,
-            "longitude": long,
-            "date": date_to_query
-        },
-        "view": {
-            "type": "area",
-            "parameters": {
-                "position": {
-                    "equatorial": {
-                        "rightAscension": 0.0,
-                        "declination": lat
-                    }
-                }
-            }
-        }
-    }
-
-    response = await session.post(
-        "https://api.astronomyapi.com/api/v2/studio/star-chart",
-        headers={'Authorization': header},
-        json=body,
-        timeout=600
-    )
-
-    return response
-
-
-async def post_location_get_moonphase(session, header: str, lat: float, long: float, date_to_query: str):
-    """returns the url of a star chart for specific coordinates"""
-    body = {
-        "format": "png",
-        "style": {
-            "moonStyle": "default",
-            "backgroundStyle": "stars",
-            "backgroundColor": "red",
-            "headingColor": "white",
-            "textColor": "white"
-        },
-        "observer": {
-            "latitude": lat,
-            "longitude": long,
-            "date": date_to_query
-        },
-        "view": {
-            "type": "portrait-simple",
-            "orientation": "north-up"
-        }
-    }
-
-    response = await session.post(
-        "https://api.astronomyapi.com/api/v2/studio/moon-phase",
-        headers={'Authorization': header},
-        json=body,
-        timeout=600
-    )
-
-    return response
-
-
-async def format_tasks(city: dict, day: str, header: str, lat: float, long: float, session) -> asyncio.coroutines:
+def format_row(city: dict, day: str, star_chart: str, sun_times: tuple[str, str],
+               moon: tuple) -> dict:
     """Returns all data, for a city on a given day"""
-    sun_data = await get_sunrise_and_set_times(session, lat, long, day)
-    star_chart = await post_location_get_starchart(session, header, lat, long, day)
-    moon_phase = await post_location_get_moonphase(session, header, lat, long, day)
-
-    star_json = await star_chart.json()
-    moon_json = await moon_phase.json()
-
     return {"city_id": city.get("city_id"),
-            "sunrise_and_sunset": sun_data,
+            "sunrise": sun_times[0],
+            "sunset": sun_times[1],
             "date": day,
-            "star_chart": star_json,
-            "moon_phase": moon_json
+            "star_chart": star_chart,
+            "moon": moon
             }
 
 
 async def collate_data(header: str, city_list: list, dates: list) -> dict:
-    """Formats into list of tuples in format 
-    (city_id, sunrise, sunset, date, star_chart, moon_phase)"""
+    """Formats into list of tuples in format (city_id, sunrise, sunset, date, star_chart,
+    moon_phase, moon_illumination, moonrise, moonset)"""
     logging.info("Assembling tasks...")
-    async with aiohttp.ClientSession() as session:
-        city_data = []
-        for city in city_list:
-            tasks = []
-            for day in dates:
-                lat = city.get("latitude")
-                long = city.get("longitude")
-                tasks.append(format_tasks(
-                    city, day, header, lat, long, session))
-
-            logging.info(f"Queued for all dates in city {city['city_id']}")
-
-            results = await asyncio.gather(*tasks)
-            city_data.extend(results)
+    store = get_store()
+    sun_times = get_city_sun_times(city_list, dates)
+    moon = get_city_moon_data(city_list, dates, store=store)
+    plan = plan_star_charts(city_list, dates)
+    limits = get_limits()
+    async with create_session(limits["concurrency"]) as session:
+        charts = await fetch_star_chart_keys(session, plan["charts"], header, store,
+                                             asyncio.Semaphore(limits["concurrency"]),
+                                             TokenBucket(limits["rate"], limits["burst"]))
+    logging.info("Stored %s star charts", len(charts))
+
+    city_data = []
+    for city in city_list:
+        for day in dates:
+            key = (city.get("city_id"), day)
+            city_data.append(format_row(city, day, charts[plan["lookup"][key]],
+                                        sun_times[key], moon[key]))
     return city_data
 
 
@@ -134,23 +65,19 @@ def format_for_insert(data: list[dict]) -> list[tuple]:
     for row in data:
         data_as_tuple.append((row["city_id"],
                               datetime.strptime(' '.join(
-                                  row["sunrise_and_sunset"]["daily"]["sunrise"][0].split('T')), "%Y-%m-%d %H:%M"),
+                                  row["sunrise"].split('T')), "%Y-%m-%d %H:%M"),
                               datetime.strptime(' '.join(
-                                  row["sunrise_and_sunset"]["daily"]["sunset"][0].split('T')), "%Y-%m-%d %H:%M"),
+                                  row["sunset"].split('T')), "%Y-%m-%d %H:%M"),
                               row["date"],
-                              row["star_chart"]["data"]["imageUrl"],
-                              row["moon_phase"]["data"]["imageUrl"]
+                              row["star_chart"],
+                              *row["moon"]
                               ))
     return data_as_tuple
 
 
 def seed_next_week(connection, data: list[tuple]):
     """Seed the next week of data"""
-    cursor = connection.cursor()
-    q = """INSERT INTO stargazing_status (city_id, sunrise, sunset, status_date, star_chart_url, moon_phase_url)
-            VALUES (%s,%s,%s,%s,%s,%s)"""
-    cursor.executemany(q, data)
-    connection.commit()
+    bulk_load(connection, "stargazing_status", STARGAZING_COLUMNS, data)
 
 
 if __name__ == "__main__":
@@ -162,7 +89,8 @@ if __name__ == "__main__":
     HEADER = f'Basic {ENV["ASTRONOMY_BASIC_AUTH_KEY"]}'
 
     useful_cities = [{"city_id": city.get("city_id"), "longitude": city.get(
-        "longitude"), "latitude": city.get("latitude")} for city in cities]
+        "longitude"), "latitude": city.get("latitude"), "elevation": city.get("elevation")}
+        for city in cities]
 
     next_week = [datetime.strftime(
         date.today()+timedelta(days=n), "%Y-%m-%d") for n in range(8)]
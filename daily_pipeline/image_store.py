@@ -0,0 +1,130 @@
+"""Keeps images in a content-addressed blob store, named by the hash of their bytes, so
+each image is stored once however often it is fetched and can be cached forever.
+The store is a local directory in development and an S3 bucket in production."""
+from os import environ as ENV, makedirs, path, replace
+import hashlib
+import tempfile
+
+import boto3
+from botocore.exceptions import ClientError
+
+STORE_DIR = "image_store"
+STORE_PREFIX = "images"
+# Keys never change content, so browsers and CDNs may keep them for a year.
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+URL_EXPIRY = 7 * 24 * 60 * 60
+SIGNATURES = [(b"\x89PNG\r\n\x1a\n", "png"), (b"\xff\xd8\xff", "jpg"), (b"GIF8", "gif"),
+              (b"RIFF", "webp"), (b"<svg", "svg"), (b"<?xml", "svg")]
+CONTENT_TYPES = {"png": "image/png", "jpg": "image/jpeg", "gif": "image/gif",
+                 "webp": "image/webp", "svg": "image/svg+xml", "bin": "application/octet-stream"}
+
+
+def get_extension(data: bytes) -> str:
+    """Returns the file extension for the image format the bytes start with."""
+    for signature, extension in SIGNATURES:
+        if data.lstrip()[:len(signature)] == signature:
+            return extension
+    return "bin"
+
+
+def get_key(data: bytes) -> str:
+    """Returns the key an image is stored under, from the SHA-256 of its bytes."""
+    digest = hashlib.sha256(data).hexdigest()
+    return f"{digest[:2]}/{digest}.{get_extension(data)}"
+
+
+def is_key(value: str) -> bool:
+    """Returns whether a stored value is a blob key rather than an older remote url."""
+    return bool(value) and not value.startswith(("http://", "https://"))
+
+
+class LocalStore:
+    """Stores blobs as files under a directory."""
+
+    def __init__(self, root: str = STORE_DIR):
+        self.root = root
+
+    def get_path(self, key: str) -> str:
+        """Returns the file a key is stored in."""
+        return path.join(self.root, *key.split("/"))
+
+    def exists(self, key: str) -> bool:
+        """Returns whether a key has been stored."""
+        return path.exists(self.get_path(key))
+
+    def put(self, data: bytes) -> str:
+        """Stores the bytes unless they already are, returning their key.
+        Files are written to a temporary name first so readers never see half an image."""
+        key = get_key(data)
+        if not self.exists(key):
+            file_path = self.get_path(key)
+            makedirs(path.dirname(file_path), exist_ok=True)
+            with tempfile.NamedTemporaryFile(dir=path.dirname(file_path), delete=False) as temp:
+                temp.write(data)
+            replace(temp.name, file_path)
+        return key
+
+    def get(self, key: str) -> bytes:
+        """Returns the bytes stored under a key."""
+        with open(self.get_path(key), "rb") as blob:
+            return blob.read()
+
+    def get_url(self, key: str) -> None:
+        """Local blobs have no url, so callers serve the bytes themselves."""
+        return None
+
+
+class S3Store:
+    """Stores blobs as objects in an S3 compatible bucket, with long cache headers."""
+
+    def __init__(self, bucket: str, prefix: str = STORE_PREFIX, public_url: str = None,
+                 client=None):
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.public_url = public_url.rstrip("/") if public_url else None
+        self.client = client or boto3.client("s3", endpoint_url=ENV.get("IMAGE_STORE_ENDPOINT"))
+
+    def get_object_key(self, key: str) -> str:
+        """Returns the object a key is stored in."""
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def exists(self, key: str) -> bool:
+        """Returns whether a key has been stored."""
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.get_object_key(key))
+            return True
+        except ClientError as err:
+            if err.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+
+    def put(self, data: bytes) -> str:
+        """Uploads the bytes unless they already are, returning their key."""
+        key = get_key(data)
+        if not self.exists(key):
+            self.client.put_object(Bucket=self.bucket, Key=self.get_object_key(key), Body=data,
+                                   ContentType=CONTENT_TYPES[get_extension(data)],
+                                   CacheControl=CACHE_CONTROL)
+        return key
+
+    def get(self, key: str) -> bytes:
+        """Returns the bytes stored under a key."""
+        response = self.client.get_object(Bucket=self.bucket, Key=self.get_object_key(key))
+        return response["Body"].read()
+
+    def get_url(self, key: str) -> str:
+        """Returns a url browsers can fetch the blob from, through the public url if the
+        bucket has one and otherwise presigned."""
+        if self.public_url:
+            return f"{self.public_url}/{self.get_object_key(key)}"
+        return self.client.generate_presigned_url(
+            "get_object", Params={"Bucket": self.bucket, "Key": self.get_object_key(key)},
+            ExpiresIn=URL_EXPIRY)
+
+
+def get_store():
+    """Returns the S3 store when IMAGE_STORE_BUCKET is set, otherwise the local one."""
+    if ENV.get("IMAGE_STORE_BUCKET"):
+        return S3Store(ENV["IMAGE_STORE_BUCKET"], ENV.get("IMAGE_STORE_PREFIX", STORE_PREFIX),
+                       ENV.get("IMAGE_STORE_URL"))
+    return LocalStore(ENV.get("IMAGE_STORE_DIR", STORE_DIR))
@@ -0,0 +1,199 @@
+"""Computes the moon's phase, illumination, moonrise and moonset locally with numpy,
+and renders one image per phase bucket for every city to share, instead of asking the
+Astronomy API for a moon phase image per city per day."""
+from functools import lru_cache
+from os import environ as ENV
+import struct
+import zlib
+
+import numpy as np
+
+from image_store import get_store
+from solar import J2000, UNIX_EPOCH_JULIAN_DAY, TIMEZONE, format_time, to_local, to_utc
+
+OBLIQUITY = np.radians(23.4397)
+EARTH_RADIUS = 6378.14
+SUN_DISTANCE = 149598000
+# One bucket is about a day of the synodic month, too little change to see in an image.
+PHASE_BUCKETS = 30
+# Moonrise and moonset are found by sampling the moon's altitude this often.
+STEP_MINUTES = 10
+IMAGE_SIZE = 256
+LIT = (236, 234, 222)
+UNLIT = (38, 38, 46)
+
+
+def get_sun_position(days: np.ndarray) -> tuple:
+    """Returns the sun's right ascension and declination in radians, for days since J2000."""
+    anomaly = np.radians(357.5291 + 0.98560028 * days)
+    centre = np.radians(1.9148 * np.sin(anomaly) + 0.02 * np.sin(2 * anomaly)
+                        + 0.0003 * np.sin(3 * anomaly))
+    longitude = anomaly + centre + np.radians(102.9372) + np.pi
+    return (np.arctan2(np.sin(longitude) * np.cos(OBLIQUITY), np.cos(longitude)),
+            np.arcsin(np.sin(longitude) * np.sin(OBLIQUITY)))
+
+
+def get_moon_position(days: np.ndarray) -> tuple:
+    """Returns the moon's right ascension and declination in radians and its distance
+    in km, for days since J2000, from the largest terms of Meeus' lunar theory."""
+    mean_longitude = np.radians(218.3165 + 13.17639648 * days)
+    elongation = np.radians(297.8502 + 12.19074912 * days)
+    sun_anomaly = np.radians(357.5291 + 0.98560028 * days)
+    anomaly = np.radians(134.9634 + 13.06499295 * days)
+    latitude_argument = np.radians(93.2721 + 13.22935024 * days)
+
+    longitude = mean_longitude + np.radians(
+        6.289 * np.sin(anomaly) + 1.274 * np.sin(2 * elongation - anomaly)
+        + 0.658 * np.sin(2 * elongation) + 0.214 * np.sin(2 * anomaly)
+        - 0.186 * np.sin(sun_anomaly) - 0.114 * np.sin(2 * latitude_argument))
+    latitude = np.radians(
+        5.128 * np.sin(latitude_argument) + 0.2806 * np.sin(anomaly + latitude_argument)
+        + 0.2777 * np.sin(anomaly - latitude_argument)
+        + 0.1732 * np.sin(2 * elongation - latitude_argument))
+    distance = (385001 - 20905 * np.cos(anomaly) - 3699 * np.cos(2 * elongation - anomaly)
+                - 2956 * np.cos(2 * elongation))
+
+    right_ascension = np.arctan2(np.sin(longitude) * np.cos(OBLIQUITY)
+                                 - np.tan(latitude) * np.sin(OBLIQUITY), np.cos(longitude))
+    declination = np.arcsin(np.sin(latitude) * np.cos(OBLIQUITY)
+                            + np.cos(latitude) * np.sin(OBLIQUITY) * np.sin(longitude))
+    return right_ascension, declination, distance
+
+
+def get_illumination(julian_days: np.ndarray) -> tuple:
+    """Returns the lit fraction of the moon, its phase and its phase angle in degrees.
+    The phase runs from 0 at new moon through 0.5 at full moon and back towards 1."""
+    days = julian_days - J2000
+    sun_ra, sun_dec = get_sun_position(days)
+    moon_ra, moon_dec, distance = get_moon_position(days)
+    elongation = np.arccos(np.clip(
+        np.sin(sun_dec) * np.sin(moon_dec)
+        + np.cos(sun_dec) * np.cos(moon_dec) * np.cos(sun_ra - moon_ra), -1, 1))
+    phase_angle = np.arctan2(SUN_DISTANCE * np.sin(elongation),
+                             distance - SUN_DISTANCE * np.cos(elongation))
+    waning = np.arctan2(np.cos(sun_dec) * np.sin(sun_ra - moon_ra),
+                        np.sin(sun_dec) * np.cos(moon_dec)
+                        - np.cos(sun_dec) * np.sin(moon_dec) * np.cos(sun_ra - moon_ra)) < 0
+    phase = 0.5 + 0.5 * phase_angle * np.where(waning, -1, 1) / np.pi
+    return (1 + np.cos(phase_angle)) / 2, phase, np.degrees(phase_angle)
+
+
+def get_phase_bucket(phase: np.ndarray, buckets: int = PHASE_BUCKETS) -> np.ndarray:
+    """Returns which of the buckets a phase falls in, with new moon in bucket 0."""
+    return np.round(np.asarray(phase) * buckets).astype(np.int64) % buckets
+
+
+def get_altitude(julian_days: np.ndarray, latitude: np.ndarray,
+                 longitude: np.ndarray) -> tuple:
+    """Returns the moon's geocentric altitude and the altitude at which it rises or sets,
+    both in degrees. The second allows for refraction, its radius and its parallax."""
+    days = julian_days - J2000
+    right_ascension, declination, distance = get_moon_position(days)
+    sidereal = np.radians(280.16 + 360.9856235 * days) + np.radians(longitude)
+    phi = np.radians(latitude)
+    altitude = np.arcsin(np.sin(phi) * np.sin(declination) + np.cos(phi)
+                         * np.cos(declination) * np.cos(sidereal - right_ascension))
+    parallax = np.degrees(np.arcsin(EARTH_RADIUS / distance))
+    return np.degrees(altitude), 0.7275 * parallax - 0.5667
+
+
+def get_crossing(height: np.ndarray, rising: bool) -> np.ndarray:
+    """Returns how many steps into the samples the height first crosses zero, in the
+    given direction, interpolating between samples. It is NaN when it never does."""
+    before, after = height[..., :-1], height[..., 1:]
+    crossed = (before < 0) & (after >= 0) if rising else (before >= 0) & (after < 0)
+    step = np.argmax(crossed, axis=-1)
+    first = np.take_along_axis(before, step[..., None], -1)[..., 0]
+    second = np.take_along_axis(after, step[..., None], -1)[..., 0]
+    return np.where(crossed.any(axis=-1), step + first / (first - second), np.nan)
+
+
+def get_moon_times(latitude, longitude, dates, timezone: str = None) -> dict:
+    """Returns the moon's illumination, phase, phase angle and phase bucket on the night
+    of each date, with that day's moonrise and moonset as naive local datetime64 arrays.
+    Inputs are broadcast against each other like solar.get_sun_times. The phase is taken
+    at the local midnight that ends the date, and days without a moonrise or moonset are NaT."""
+    timezone = timezone or ENV.get("SUN_TIMEZONE", TIMEZONE)
+    latitude = np.asarray(latitude, dtype=np.float64)
+    longitude = np.asarray(longitude, dtype=np.float64)
+    dates = np.asarray(dates, dtype="datetime64[D]")
+    shape = np.broadcast_shapes(latitude.shape, longitude.shape, dates.shape)
+    # The moon's position only depends on the time, so it is worked out per date and
+    # sample before being broadcast against the locations.
+    offset = ((to_local(dates.astype("datetime64[s]"), dates, timezone)
+               - dates.astype("datetime64[s]")) / np.timedelta64(1, "D"))
+    midnight = dates.astype(np.float64) + UNIX_EPOCH_JULIAN_DAY - offset
+
+    illumination, phase, phase_angle = get_illumination(midnight + 1)
+    samples = midnight[..., None] + np.arange(0, 24 * 60 + STEP_MINUTES, STEP_MINUTES) / 1440
+    altitude, horizon = get_altitude(samples, latitude[..., None], longitude[..., None])
+    times = {"illumination": illumination, "phase": phase, "phase_angle": phase_angle,
+             "bucket": get_phase_bucket(phase)}
+    times = {name: np.broadcast_to(value, shape) for name, value in times.items()}
+    for name, rising in (("moonrise", True), ("moonset", False)):
+        event = midnight + get_crossing(altitude - horizon, rising) * STEP_MINUTES / 1440
+        times[name] = to_local(to_utc(event), np.broadcast_to(dates, shape), timezone)
+    return times
+
+
+def encode_png(pixels: np.ndarray) -> bytes:
+    """Returns an RGB image array as PNG bytes."""
+    height, width, _ = pixels.shape
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return (struct.pack(">I", len(data)) + kind + data
+                + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF))
+
+    rows = np.concatenate([np.zeros((height, 1), np.uint8),
+                           pixels.astype(np.uint8).reshape(height, width * 3)], axis=1)
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(rows.tobytes(), 9)) + chunk(b"IEND", b""))
+
+
+@lru_cache(maxsize=PHASE_BUCKETS)
+def render_moon(bucket: int, buckets: int = PHASE_BUCKETS, size: int = IMAGE_SIZE) -> bytes:
+    """Returns a PNG of the moon as seen from the northern hemisphere in a phase bucket."""
+    phase = bucket / buckets
+    lit_fraction = (1 - np.cos(2 * np.pi * phase)) / 2
+    y, x = (np.mgrid[0:size, 0:size] + 0.5) / size * 2 - 1
+    disc = x ** 2 + y ** 2 <= 1
+    terminator = (1 - 2 * lit_fraction) * np.sqrt(np.clip(1 - y ** 2, 0, 1))
+    # The right hand side is lit while waxing and the left while waning.
+    lit = disc & (x > terminator if phase <= 0.5 else x < -terminator)
+
+    pixels = np.zeros((size, size, 3), dtype=np.uint8)
+    pixels[disc] = UNLIT
+    pixels[lit] = LIT
+    return encode_png(pixels)
+
+
+def get_moon_image_keys(keys: set, store=None) -> dict:
+    """Stores an image for every (date, bucket) and returns their blob keys by key.
+    Each bucket is rendered once, and dates in the same bucket share its blob."""
+    store = store or get_store()
+    blobs = {bucket: store.put(render_moon(bucket)) for bucket in {bucket for _, bucket in keys}}
+    return {(day, bucket): blobs[bucket] for day, bucket in keys}
+
+
+def get_city_moon_data(cities: list[dict], dates: list[str], timezone: str = None,
+                       store=None) -> dict:
+    """Returns each city's (moon image key, illumination, moonrise, moonset) keyed by
+    (city_id, date). Moonrise and moonset are None on days without one."""
+    if not cities or not dates:
+        return {}
+    times = get_moon_times(np.array([[city.get("latitude")] for city in cities], dtype=np.float64),
+                           np.array([[city.get("longitude")] for city in cities], dtype=np.float64),
+                           np.array([dates], dtype="datetime64[D]"), timezone)
+    keys = {(day, int(times["bucket"][i, j]))
+            for i in range(len(cities)) for j, day in enumerate(dates)}
+    images = get_moon_image_keys(keys, store)
+
+    def as_text(time: np.datetime64):
+        return None if np.isnat(time) else format_time(time)
+
+    return {(city.get("city_id"), day): (images[(day, int(times["bucket"][i, j]))],
+                                         round(float(times["illumination"][i, j]), 4),
+                                         as_text(times["moonrise"][i, j]),
+                                         as_text(times["moonset"][i, j]))
+            for i, city in enumerate(cities) for j, day in enumerate(dates)}
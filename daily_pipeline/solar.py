@@ -0,0 +1,131 @@
+"""Computes sunrise, sunset and twilight locally with numpy instead of asking open-meteo.
+Uses NOAA's solar position formulas, which agree with open-meteo to within a minute
+outside the polar circles, evaluated over whole arrays of locations and dates at once."""
+from datetime import datetime
+from os import environ as ENV
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+# Every city is in the UK, and open-meteo is asked for times in the city's own timezone.
+TIMEZONE = "Europe/London"
+J2000 = 2451545.0
+UNIX_EPOCH_JULIAN_DAY = 2440587.5
+# The sun's centre is this far below the horizon at sunrise, allowing for refraction
+# and the sun's radius, before correcting for the observer's elevation.
+HORIZON = -0.833
+TWILIGHTS = {"civil": -6.0, "nautical": -12.0, "astronomical": -18.0}
+
+
+def get_solar_position(julian_days: np.ndarray) -> tuple:
+    """Returns the sun's declination in radians and the equation of time in minutes,
+    using NOAA's low precision formulas."""
+    centuries = (julian_days - J2000) / 36525
+    mean_longitude = np.radians((280.46646 + centuries * (36000.76983 + centuries * 0.0003032))
+                                % 360)
+    anomaly = np.radians(357.52911 + centuries * (35999.05029 - 0.0001537 * centuries))
+    eccentricity = 0.016708634 - centuries * (0.000042037 + 0.0000001267 * centuries)
+    centre = (np.sin(anomaly) * (1.914602 - centuries * (0.004817 + 0.000014 * centuries))
+              + np.sin(2 * anomaly) * (0.019993 - 0.000101 * centuries)
+              + np.sin(3 * anomaly) * 0.000289)
+    node = np.radians(125.04 - 1934.136 * centuries)
+    longitude = np.radians(np.degrees(mean_longitude) + centre - 0.00569 - 0.00478 * np.sin(node))
+    seconds = 21.448 - centuries * (46.815 + centuries * (0.00059 - centuries * 0.001813))
+    obliquity = np.radians(23 + (26 + seconds / 60) / 60 + 0.00256 * np.cos(node))
+    declination = np.arcsin(np.sin(obliquity) * np.sin(longitude))
+
+    y = np.tan(obliquity / 2) ** 2
+    equation_of_time = 4 * np.degrees(
+        y * np.sin(2 * mean_longitude) - 2 * eccentricity * np.sin(anomaly)
+        + 4 * eccentricity * y * np.sin(anomaly) * np.cos(2 * mean_longitude)
+        - 0.5 * y ** 2 * np.sin(4 * mean_longitude)
+        - 1.25 * eccentricity ** 2 * np.sin(2 * anomaly))
+    return declination, equation_of_time
+
+
+def get_hour_angle(latitude: np.ndarray, declination: np.ndarray,
+                   altitude: np.ndarray) -> np.ndarray:
+    """Returns the hour angle, in degrees, at which the sun is at the given altitude.
+    It is NaN where the sun never reaches that altitude on that day."""
+    phi = np.radians(latitude)
+    cos_angle = ((np.sin(np.radians(altitude)) - np.sin(phi) * np.sin(declination))
+                 / (np.cos(phi) * np.cos(declination)))
+    with np.errstate(invalid="ignore"):
+        return np.degrees(np.arccos(np.where(np.abs(cos_angle) <= 1, cos_angle, np.nan)))
+
+
+def to_utc(julian_days: np.ndarray) -> np.ndarray:
+    """Returns julian days as UTC datetimes rounded to the minute, with NaT for NaN."""
+    seconds = np.round((julian_days - UNIX_EPOCH_JULIAN_DAY) * 86400 / 60) * 60
+    times = np.full(seconds.shape, np.datetime64("NaT"), dtype="datetime64[s]")
+    valid = ~np.isnan(seconds)
+    times[valid] = seconds[valid].astype(np.int64).astype("datetime64[s]")
+    return times
+
+
+def to_local(times: np.ndarray, dates: np.ndarray, timezone: str = TIMEZONE) -> np.ndarray:
+    """Shifts UTC times to naive local times, using each date's offset at noon."""
+    zone = ZoneInfo(timezone)
+    days = dates.astype("datetime64[D]")
+    offsets = {day: int(zone.utcoffset(datetime.fromisoformat(f"{day}T12:00")).total_seconds())
+               for day in np.unique(days)}
+    shift = np.array([offsets[day] for day in days.ravel()], dtype=np.int64)
+    return times + shift.reshape(days.shape).astype("timedelta64[s]")
+
+
+def get_event(midnight: np.ndarray, latitude: np.ndarray, longitude: np.ndarray,
+              altitude, direction: int) -> np.ndarray:
+    """Returns the julian day the sun passes the altitude, rising for direction -1 and
+    setting for 1. The sun's position is worked out at noon, then again at that estimate."""
+    estimate = midnight + 0.5 - longitude / 360
+    for _ in range(2):
+        declination, equation_of_time = get_solar_position(estimate)
+        angle = get_hour_angle(latitude, declination, altitude)
+        minutes = 720 - 4 * longitude - equation_of_time + direction * 4 * angle
+        estimate = midnight + minutes / 1440
+    return estimate
+
+
+def get_sun_times(latitude, longitude, elevation, dates, timezone: str = None) -> dict:
+    """Returns sunrise, sunset and the start and end of each twilight for every
+    (latitude, longitude, elevation, date), as naive local datetime64 arrays.
+    Inputs are broadcast against each other, so a column of cities and a row of
+    dates gives every city on every date. Times that never happen are NaT."""
+    timezone = timezone or ENV.get("SUN_TIMEZONE", TIMEZONE)
+    latitude, longitude, elevation, dates = np.broadcast_arrays(
+        np.asarray(latitude, dtype=np.float64), np.asarray(longitude, dtype=np.float64),
+        np.asarray(elevation, dtype=np.float64), np.asarray(dates, dtype="datetime64[D]"))
+    midnight = dates.astype(np.float64) + UNIX_EPOCH_JULIAN_DAY
+
+    # Higher observers see the sun over a horizon that dips below them.
+    dip = 2.076 * np.sqrt(np.maximum(elevation, 0)) / 60
+    altitudes = {"sun": HORIZON - dip, **TWILIGHTS}
+    times = {}
+    for name, altitude in altitudes.items():
+        start, end = [to_local(to_utc(get_event(midnight, latitude, longitude, altitude,
+                                                direction)), dates, timezone)
+                      for direction in (-1, 1)]
+        if name == "sun":
+            times["sunrise"], times["sunset"] = start, end
+        else:
+            times[f"{name}_dawn"], times[f"{name}_dusk"] = start, end
+    return times
+
+
+def format_time(time: np.datetime64) -> str:
+    """Returns a time as open-meteo writes it, for example 2025-02-21T07:35."""
+    return str(time.astype("datetime64[m]"))
+
+
+def get_city_sun_times(cities: list[dict], dates: list[str], timezone: str = None) -> dict:
+    """Returns each city's (sunrise, sunset) in open-meteo's format, keyed by (city_id, date)."""
+    if not cities or not dates:
+        return {}
+    times = get_sun_times(
+        np.array([[city.get("latitude")] for city in cities], dtype=np.float64),
+        np.array([[city.get("longitude")] for city in cities], dtype=np.float64),
+        np.array([[city.get("elevation") or 0] for city in cities], dtype=np.float64),
+        np.array([dates], dtype="datetime64[D]"), timezone)
+    return {(city.get("city_id"), day): (format_time(times["sunrise"][i, j]),
+                                         format_time(times["sunset"][i, j]))
+            for i, city in enumerate(cities) for j, day in enumerate(dates)}
@@ -34,6 +34,22 @@ data "aws_iam_policy_document" "lambda-role-permissions-policy-doc" {
     ]
     resources = [ "arn:aws:logs:eu-west-2:129033205317:*" ]
   }
+  statement {
+    effect = "Allow"
+    actions = [ 
+        "s3:GetObject",
+        "s3:PutObject"
+    ]
+    resources = [ "arn:aws:s3:::${var.IMAGE_STORE_BUCKET}/images/*" ]
+  }
+  # Without ListBucket, S3 answers 403 rather than 404 for images not stored yet.
+  statement {
+    effect = "Allow"
+    actions = [ 
+        "s3:ListBucket"
+    ]
+    resources = [ "arn:aws:s3:::${var.IMAGE_STORE_BUCKET}" ]
+  }
 }
 
 # Role
@@ -69,6 +85,7 @@ resource "aws_lambda_function" "pipeline-lambda" {
         DB_PASSWORD = var.DB_PASSWORD
         DB_PORT = var.DB_PORT
         ASTRONOMY_BASIC_AUTH_KEY = var.ASTRONOMY_BASIC_AUTH_KEY
+        IMAGE_STORE_BUCKET = var.IMAGE_STORE_BUCKET
         }
     }
 }
\ No newline at end of file
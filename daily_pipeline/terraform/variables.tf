@@ -31,4 +31,8 @@ variable "AWS_REGION" {
 
 variable "ASTRONOMY_BASIC_AUTH_KEY" {
  type = string 
-}
\ No newline at end of file
+}
+
+variable "IMAGE_STORE_BUCKET" {
+  type = string
+}
@@ -0,0 +1,135 @@
+# pylint: skip-file
+import asyncio
+import json
+import time
+
+import aiohttp
+import pytest
+
+from astronomy_client import TokenBucket, request_json, fetch_future_data, fetch_constellations, RetryableStatusError
+from image_store import LocalStore, get_key
+from lunar import render_moon
+
+PNG = b"\x89PNG\r\n\x1a\nchart"
+
+
+class FakeResponse:
+    def __init__(self, status, payload):
+        self.status = status
+        self.payload = payload
+
+    async def read(self):
+        if isinstance(self.payload, bytes):
+            return self.payload
+        return json.dumps(self.payload).encode()
+
+    async def json(self):
+        return self.payload
+
+    def raise_for_status(self):
+        if self.status >= 400:
+            raise aiohttp.ClientResponseError(None, (), status=self.status)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *_):
+        return None
+
+
+class FakeSession:
+    """Answers each url with the next of its queued (status, payload) responses."""
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.calls = []
+
+    def request(self, method, url, **kwargs):
+        self.calls.append((method, url, kwargs))
+        queued = self.responses[url]
+        status, payload = queued.pop(0) if len(queued) > 1 else queued[0]
+        return FakeResponse(status, payload)
+
+
+def run_request(session, url, **options):
+    return asyncio.run(request_json(session, "GET", url, asyncio.Semaphore(2),
+                                    backoff=0, **options))
+
+
+def test_token_bucket_allows_burst_then_waits():
+    async def take(count):
+        bucket = TokenBucket(rate=50, capacity=2)
+        start = time.monotonic()
+        for _ in range(count):
+            await bucket.acquire()
+        return time.monotonic() - start
+
+    assert asyncio.run(take(2)) < 0.01
+    assert asyncio.run(take(4)) >= 0.035
+
+
+def test_request_retries_retryable_status():
+    session = FakeSession({"url": [(503, {}), (200, {"ok": True})]})
+    assert run_request(session, "url") == {"ok": True}
+    assert len(session.calls) == 2
+
+
+def test_request_does_not_retry_client_errors():
+    session = FakeSession({"url": [(404, {})]})
+    with pytest.raises(aiohttp.ClientResponseError):
+        run_request(session, "url")
+    assert len(session.calls) == 1
+
+
+def test_request_gives_up_after_retries():
+    session = FakeSession({"url": [(429, {})]})
+    with pytest.raises(RetryableStatusError):
+        run_request(session, "url", retries=2)
+    assert len(session.calls) == 3
+
+
+def test_fetch_future_data_keeps_city_order(tmp_path):
+    store = LocalStore(str(tmp_path))
+    session = FakeSession({
+        "https://api.astronomyapi.com/api/v2/studio/star-chart":
+            [(200, {"data": {"imageUrl": "https://cdn/chart.png"}})],
+        "https://cdn/chart.png": [(200, PNG)]})
+    cities = [{"city_id": 1, "latitude": 51.5074, "longitude": -0.1278, "elevation": 0},
+              {"city_id": 2, "latitude": 55.9533, "longitude": -3.1883, "elevation": 0},
+              {"city_id": 3, "latitude": 51.4975, "longitude": -0.1357, "elevation": 0}]
+
+    rows = asyncio.run(fetch_future_data(cities, "2025-02-21", "Basic key", session,
+                                         store=store))
+
+    chart, moon = get_key(PNG), get_key(render_moon(24))
+    assert [row[:6] for row in rows] == [
+        (1, "2025-02-21T07:02", "2025-02-21T17:27", "2025-02-21", chart, moon),
+        (2, "2025-02-21T07:23", "2025-02-21T17:30", "2025-02-21", chart, moon),
+        (3, "2025-02-21T07:02", "2025-02-21T17:27", "2025-02-21", chart, moon)]
+    assert all(0.3 < row[6] < 0.6 for row in rows)
+    assert store.exists(chart) and store.exists(moon)
+    # London and Westminster share a chart, and the chart is only downloaded once.
+    studio = [call for call in session.calls if "studio" in call[1]]
+    assert [call[2]["json"]["observer"]["latitude"] for call in studio] == [51.5, 55.5]
+    assert all(call[2]["headers"] == {"Authorization": "Basic key"} for call in studio)
+    assert [call[1] for call in session.calls].count("https://cdn/chart.png") == 1
+
+
+def test_fetch_constellations_sets_aside_failures(tmp_path):
+    store = LocalStore(str(tmp_path))
+    url = "https://api.astronomyapi.com/api/v2/studio/star-chart"
+    session = FakeSession({url: [(200, {"data": {"imageUrl": "https://cdn/ori.png"}})],
+                           "https://cdn/ori.png": [(200, PNG)]})
+    outcome = asyncio.run(fetch_constellations(["ori"], "Basic key", 0.1, 51.5,
+                                               "2025-02-21", session, backoff=0, store=store))
+    assert outcome["results"] == {"ori": get_key(PNG)}
+    assert store.get(get_key(PNG)) == PNG
+    assert session.calls[0][2]["json"]["view"]["parameters"] == {"constellation": "ori"}
+
+    session = FakeSession({url: [(200, {"error": "quota"})]})
+    outcome = asyncio.run(fetch_constellations(["ori"], "Basic key", 0.1, 51.5,
+                                               "2025-02-21", session, backoff=0,
+                                               max_attempts=2, store=store))
+    assert outcome["results"] == {}
+    assert [code for code, _ in outcome["dead_letters"]] == ["ori"]
+    assert len(session.calls) == 2
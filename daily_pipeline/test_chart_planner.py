@@ -0,0 +1,36 @@
+# pylint: skip-file
+import pytest
+
+from chart_planner import get_cell, plan_star_charts, get_grid
+
+CITIES = [{"city_id": 1, "latitude": 53.4808, "longitude": -2.2426},
+          {"city_id": 2, "latitude": 53.4875, "longitude": -2.2901},
+          {"city_id": 3, "latitude": 57.1497, "longitude": -2.0943}]
+
+
+@pytest.mark.parametrize("lat, long, grid, cell", [
+    (53.4808, -2.2426, (1.0, 2.0), (53.5, -3.0)),
+    (53.4808, -2.2426, (0.1, 0.1), (53.45, -2.25)),
+    (-33.9, 151.2, (1.0, 1.0), (-33.5, 151.5))])
+def test_get_cell(lat, long, grid, cell):
+    assert get_cell(lat, long, grid) == cell
+
+
+def test_nearby_cities_share_a_chart_per_date():
+    plan = plan_star_charts(CITIES, ["2025-02-21", "2025-02-22"], (1.0, 2.0))
+    assert plan["charts"] == [(53.5, -3.0, "2025-02-21"), (53.5, -3.0, "2025-02-22"),
+                              (57.5, -3.0, "2025-02-21"), (57.5, -3.0, "2025-02-22")]
+    assert plan["lookup"][(1, "2025-02-21")] == plan["lookup"][(2, "2025-02-21")]
+    assert plan["lookup"][(3, "2025-02-22")] == (57.5, -3.0, "2025-02-22")
+
+
+def test_a_fine_grid_keeps_cities_apart():
+    plan = plan_star_charts(CITIES, ["2025-02-21"], (0.01, 0.01))
+    assert len(plan["charts"]) == 3
+
+
+def test_grid_from_environment(monkeypatch):
+    assert get_grid() == (1.0, 2.0)
+    monkeypatch.setenv("STAR_CHART_LAT_GRID", "0.5")
+    monkeypatch.setenv("STAR_CHART_LONG_GRID", "0.25")
+    assert get_grid() == (0.5, 0.25)
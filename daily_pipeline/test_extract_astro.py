@@ -2,10 +2,13 @@
 from os import environ
 
 from unittest.mock import patch, MagicMock
+import asyncio
+
 import pytest
 from dotenv import load_dotenv
 
-from first_week import get_connection, get_locations, post_location_get_moonphase, post_location_get_starchart, collate_data
+from astronomy_client import TokenBucket
+from first_week import get_connection, get_locations, collate_data
 
 # load_dotenv()
 
@@ -36,3 +39,24 @@ def test_cursor_closes(mock_connect):
     get_locations(mock_conn)
 
     mock_cursor.close.assert_called_once()
+
+
+@patch("first_week.get_store")
+@patch("first_week.get_city_moon_data")
+@patch("first_week.fetch_star_chart_keys")
+def test_collate_data_uses_rate_limited_client(mock_fetch, mock_moon, mock_store):
+    """Planned charts go through the astronomy client, which applies the rate limit"""
+    cities = [{"city_id": 1, "latitude": 51.5, "longitude": -0.1, "elevation": 0},
+              {"city_id": 2, "latitude": 51.6, "longitude": -0.2, "elevation": 0}]
+    mock_moon.return_value = {(1, "2025-02-21"): ("moon", 0.5, None, None),
+                              (2, "2025-02-21"): ("moon", 0.5, None, None)}
+
+    async def fetch(session, charts, header, store, semaphore, bucket):
+        return {chart: "chart-key" for chart in charts}
+    mock_fetch.side_effect = fetch
+
+    rows = asyncio.run(collate_data("Basic key", cities, ["2025-02-21"]))
+
+    assert len(mock_fetch.call_args.args[1]) == 1
+    assert isinstance(mock_fetch.call_args.args[5], TokenBucket)
+    assert [row["star_chart"] for row in rows] == ["chart-key", "chart-key"]
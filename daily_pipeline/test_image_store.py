@@ -0,0 +1,77 @@
+# pylint: skip-file
+from pathlib import Path
+
+from boto3 import client
+from moto import mock_aws
+import pytest
+
+from image_store import (get_key, get_extension, is_key, LocalStore, S3Store, get_store,
+                         CACHE_CONTROL)
+
+PNG = b"\x89PNG\r\n\x1a\nimage"
+
+
+@pytest.mark.parametrize("data, extension", [
+    (PNG, "png"), (b"\xff\xd8\xff\xe0jpeg", "jpg"), (b"  <svg></svg>", "svg"), (b"text", "bin")])
+def test_get_extension(data, extension):
+    assert get_extension(data) == extension
+
+
+def test_key_is_the_hash_of_the_bytes():
+    key = get_key(PNG)
+    assert key == get_key(bytes(PNG))
+    assert key != get_key(PNG + b"!")
+    assert key.startswith(key[3:5] + "/") and key.endswith(".png") and len(key) == 71
+
+
+def test_is_key():
+    assert is_key(get_key(PNG))
+    assert not is_key("https://widgets.astronomyapi.com/chart.png")
+    assert not is_key(None)
+
+
+def test_local_store_deduplicates(tmp_path):
+    store = LocalStore(str(tmp_path))
+    key = store.put(PNG)
+    assert store.put(PNG) == key
+    assert store.exists(key) and store.get(key) == PNG
+    assert len(list(tmp_path.rglob("*"))) == 2
+    assert store.get_url(key) is None
+
+
+@mock_aws
+def test_s3_store_uploads_once_with_cache_headers():
+    s3 = client("s3", region_name="us-east-1")
+    s3.create_bucket(Bucket="images")
+    store = S3Store("images", "blobs", client=s3)
+
+    key = store.put(PNG)
+    first = s3.head_object(Bucket="images", Key=f"blobs/{key}")
+    assert store.put(PNG) == key
+    assert s3.head_object(Bucket="images", Key=f"blobs/{key}")["ETag"] == first["ETag"]
+    assert first["CacheControl"] == CACHE_CONTROL
+    assert first["ContentType"] == "image/png"
+    assert store.get(key) == PNG
+    assert not store.exists(get_key(b"missing"))
+    assert f"blobs/{key}" in store.get_url(key)
+
+
+def test_s3_store_public_url():
+    store = S3Store("images", "blobs", "https://cdn.example.com/", client=object())
+    assert store.get_url("ab/abc.png") == "https://cdn.example.com/blobs/ab/abc.png"
+
+
+def test_get_store_from_environment(monkeypatch, tmp_path):
+    monkeypatch.delenv("IMAGE_STORE_BUCKET", raising=False)
+    monkeypatch.setenv("IMAGE_STORE_DIR", str(tmp_path))
+    assert isinstance(get_store(), LocalStore)
+    assert get_store().root == str(tmp_path)
+    monkeypatch.setenv("IMAGE_STORE_BUCKET", "images")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "eu-west-2")
+    assert isinstance(get_store(), S3Store)
+
+
+def test_dashboard_copy_is_identical():
+    source = Path(__file__).with_name("image_store.py")
+    copy = Path(__file__).resolve().parents[1] / "dashboard" / "image_store.py"
+    assert copy.read_bytes() == source.read_bytes()
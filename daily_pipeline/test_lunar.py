@@ -0,0 +1,83 @@
+# pylint: skip-file
+import zlib
+
+import numpy as np
+import pytest
+
+from lunar import (get_illumination, get_phase_bucket, get_moon_times, render_moon,
+                   get_moon_image_keys, get_city_moon_data)
+from image_store import LocalStore
+from solar import get_sun_times
+
+LONDON = (51.5074, -0.1278)
+
+
+def julian_day(time):
+    return np.datetime64(time, "s").astype(np.int64) / 86400 + 2440587.5
+
+
+@pytest.mark.parametrize("time, illumination, phase", [
+    ("2025-03-14T06:55", 1.0, 0.5), ("2025-03-29T10:58", 0.0, 0.0),
+    ("2025-03-06T16:32", 0.5, 0.25), ("2025-03-22T11:29", 0.5, 0.75)])
+def test_illumination_at_known_phases(time, illumination, phase):
+    lit, result, _ = get_illumination(np.array(julian_day(time)))
+    assert lit == pytest.approx(illumination, abs=0.01)
+    assert min(abs(result - phase), 1 - abs(result - phase)) < 0.01
+
+
+def test_phase_buckets_wrap_around():
+    assert get_phase_bucket(np.array([0, 0.5, 0.99, 0.25])).tolist() == [0, 15, 0, 8]
+
+
+def test_full_moon_rises_around_sunset():
+    moon = get_moon_times(*LONDON, "2025-03-14")
+    sun = get_sun_times(*LONDON, 0, "2025-03-14")
+    assert abs((moon["moonrise"] - sun["sunset"]) / np.timedelta64(1, "m")) < 45
+    assert abs((moon["moonset"] - sun["sunrise"]) / np.timedelta64(1, "m")) < 45
+
+
+def test_days_without_moonrise_are_nat():
+    dates = np.arange("2025-03-01", "2025-04-01", dtype="datetime64[D]")
+    moon = get_moon_times(*LONDON, dates)
+    # Moonrise is about 50 minutes later each day, so once a month it slips past midnight.
+    assert np.isnat(moon["moonrise"]).sum() == 1
+    assert np.isnat(moon["moonset"]).sum() == 1
+
+
+def test_broadcasts_cities_against_dates():
+    dates = np.arange("2025-01-01", "2026-01-01", dtype="datetime64[D]")
+    moon = get_moon_times(np.linspace(50, 58, 20)[:, None], -2.0, dates[None, :])
+    assert moon["moonrise"].shape == moon["bucket"].shape == (20, 365)
+    # The phase does not depend on where you are.
+    assert (moon["bucket"] == moon["bucket"][0]).all()
+
+
+def test_render_moon_is_a_png_lit_by_phase():
+    new, full = render_moon(0), render_moon(15)
+    assert new.startswith(b"\x89PNG") and full.startswith(b"\x89PNG")
+    lit = bytes([236, 234, 222])
+    assert zlib.decompress(new[41:new.index(b"IEND") - 8]).count(lit) == 0
+    assert zlib.decompress(full[41:full.index(b"IEND") - 8]).count(lit) > 40000
+
+
+def test_images_are_stored_once_per_bucket(tmp_path):
+    store = LocalStore(str(tmp_path))
+    keys = get_moon_image_keys({("2025-03-14", 15), ("2025-04-13", 15), ("2025-03-15", 16)},
+                               store)
+    assert keys[("2025-03-14", 15)] == keys[("2025-04-13", 15)] != keys[("2025-03-15", 16)]
+    assert store.get(keys[("2025-03-14", 15)]) == render_moon(15)
+    assert len(list(tmp_path.rglob("*.png"))) == 2
+
+
+def test_city_moon_data_keyed_by_city_and_date(tmp_path):
+    store = LocalStore(str(tmp_path))
+    cities = [{"city_id": 1, "latitude": 51.5, "longitude": -0.1},
+              {"city_id": 2, "latitude": 53.5, "longitude": -2.2}]
+    result = get_city_moon_data(cities, ["2025-03-14", "2025-03-19"], store=store)
+    key, illumination, moonrise, moonset = result[(1, "2025-03-14")]
+    assert key == result[(2, "2025-03-14")][0]
+    assert store.get(key) == render_moon(16)
+    assert illumination > 0.99
+    assert moonrise.startswith("2025-03-14T18:") and moonset.startswith("2025-03-14T06:")
+    assert result[(1, "2025-03-19")][2] is None
+    assert get_city_moon_data([], ["2025-03-14"]) == {}
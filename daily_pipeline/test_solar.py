@@ -0,0 +1,64 @@
+# pylint: skip-file
+import time
+
+import numpy as np
+import pytest
+
+from solar import get_sun_times, get_city_sun_times
+
+LONDON = (51.5074, -0.1278)
+
+
+def minutes_apart(value, expected):
+    return abs((value - np.datetime64(expected)) / np.timedelta64(1, "m"))
+
+
+@pytest.mark.parametrize("day, sunrise, sunset", [
+    ("2025-06-21", "2025-06-21T04:43", "2025-06-21T21:21"),
+    ("2024-12-21", "2024-12-21T08:03", "2024-12-21T15:53"),
+    ("2025-03-20", "2025-03-20T06:03", "2025-03-20T18:14")])
+def test_matches_open_meteo_within_a_minute(day, sunrise, sunset):
+    times = get_sun_times(*LONDON, 0, day)
+    assert minutes_apart(times["sunrise"], sunrise) <= 1
+    assert minutes_apart(times["sunset"], sunset) <= 1
+
+
+def test_twilights_are_ordered():
+    times = get_sun_times(*LONDON, 0, "2025-03-20")
+    order = ["astronomical_dawn", "nautical_dawn", "civil_dawn", "sunrise",
+             "sunset", "civil_dusk", "nautical_dusk", "astronomical_dusk"]
+    assert all(times[a] < times[b] for a, b in zip(order, order[1:]))
+
+
+def test_midsummer_never_gets_astronomically_dark():
+    times = get_sun_times(*LONDON, 0, "2025-06-21")
+    assert np.isnat(times["astronomical_dawn"])
+    assert np.isnat(times["astronomical_dusk"])
+    assert not np.isnat(times["nautical_dusk"])
+
+
+def test_elevation_widens_the_day():
+    low = get_sun_times(*LONDON, 0, "2025-03-20")
+    high = get_sun_times(*LONDON, 1000, "2025-03-20")
+    assert high["sunrise"] < low["sunrise"]
+    assert high["sunset"] > low["sunset"]
+    assert high["civil_dawn"] == low["civil_dawn"]
+
+
+def test_broadcasts_cities_against_dates():
+    dates = np.arange("2025-01-01", "2026-01-01", dtype="datetime64[D]")
+    lat = np.linspace(50, 58, 100)[:, None]
+    start = time.perf_counter()
+    times = get_sun_times(lat, -2.0, 50, dates[None, :])
+    assert times["sunrise"].shape == (100, 365)
+    assert time.perf_counter() - start < 2
+
+
+def test_city_sun_times_keyed_by_city_and_date():
+    cities = [{"city_id": 1, "latitude": 51.5074, "longitude": -0.1278, "elevation": 11}]
+    result = get_city_sun_times(cities, ["2025-02-21", "2025-02-22"])
+    assert set(result) == {(1, "2025-02-21"), (1, "2025-02-22")}
+    sunrise, sunset = result[(1, "2025-02-21")]
+    assert sunrise.startswith("2025-02-21T07:0") and len(sunrise) == 16
+    assert sunset.startswith("2025-02-21T17:2")
+    assert get_city_sun_times([], ["2025-02-21"]) == {}
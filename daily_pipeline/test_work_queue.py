@@ -0,0 +1,93 @@
+# pylint: skip-file
+import asyncio
+
+import pytest
+
+from work_queue import next_batch_size, run_work_queue, is_throttled
+
+
+class StatusError(Exception):
+    def __init__(self, status):
+        super().__init__(f"status {status}")
+        self.status = status
+
+
+def run(items, worker, **options):
+    return asyncio.run(run_work_queue(items, worker, backoff=0, **options))
+
+
+@pytest.mark.parametrize("size, throttled, latency, out", [
+    (8, True, 0.1, 4), (1, True, 0.1, 1), (8, False, 0.1, 9), (32, False, 0.1, 32),
+    (8, False, 5.0, 8)])
+def test_next_batch_size(size, throttled, latency, out):
+    assert next_batch_size(size, throttled, latency) == out
+
+
+def test_is_throttled():
+    assert is_throttled(StatusError(429))
+    assert not is_throttled(StatusError(503))
+    assert not is_throttled(ValueError())
+
+
+def test_all_succeed():
+    async def worker(item):
+        return item * 2
+
+    outcome = run([1, 2, 3], worker, batch_size=2)
+
+    assert outcome["results"] == {1: 2, 2: 4, 3: 6}
+    assert outcome["dead_letters"] == []
+    assert outcome["batches"] == 2
+
+
+def test_only_failed_items_are_retried():
+    calls = []
+
+    async def worker(item):
+        calls.append(item)
+        if item == "b" and calls.count("b") < 3:
+            raise ValueError("no data")
+        return item.upper()
+
+    outcome = run(["a", "b", "c"], worker, batch_size=3)
+
+    assert outcome["results"] == {"a": "A", "b": "B", "c": "C"}
+    assert calls.count("a") == 1
+    assert calls.count("b") == 3
+
+
+def test_permanent_failures_become_dead_letters():
+    async def worker(item):
+        if item == "bad":
+            raise ValueError("always fails")
+        return item
+
+    outcome = run(["good", "bad"], worker, max_attempts=3)
+
+    assert outcome["results"] == {"good": "good"}
+    assert [item for item, _ in outcome["dead_letters"]] == ["bad"]
+    assert str(outcome["dead_letters"][0][1]) == "always fails"
+
+
+def test_throttling_shrinks_batches():
+    calls = []
+
+    async def worker(item):
+        calls.append(item)
+        if len(calls) <= 8:
+            raise StatusError(429)
+        return item
+
+    outcome = run(list(range(8)), worker, batch_size=8)
+
+    # 8 throttled, then the retries go out as 4 and then the remaining 4.
+    assert len(outcome["results"]) == 8
+    assert outcome["batches"] == 3
+
+
+def test_key_names_results():
+    async def worker(item):
+        return item["value"]
+
+    outcome = run([{"code": "ori", "value": 1}], worker, key=lambda item: item["code"])
+    assert outcome["results"] == {"ori": 1}
@@ -0,0 +1,85 @@
+"""Runs async jobs through a queue in adaptive batches on one event loop.
+Batches shrink when the API throttles and grow while responses stay fast. Only failed
+items are retried, with exponential backoff, and items that keep failing are set aside
+as dead letters instead of being retried forever."""
+import asyncio
+import logging
+import random
+import time
+
+from instrumentation import add_metric
+
+INITIAL_BATCH = 8
+MIN_BATCH = 1
+MAX_BATCH = 32
+MAX_ATTEMPTS = 4
+BACKOFF = 1.0
+# Batches answered faster than this, on average per item, are allowed to grow.
+TARGET_LATENCY = 2.0
+THROTTLED_STATUSES = (429,)
+
+
+def is_throttled(err: Exception) -> bool:
+    """Returns whether an error means the API asked us to slow down."""
+    return getattr(err, "status", None) in THROTTLED_STATUSES
+
+
+def next_batch_size(size: int, throttled: bool, latency: float,
+                    min_batch: int = MIN_BATCH, max_batch: int = MAX_BATCH,
+                    target_latency: float = TARGET_LATENCY) -> int:
+    """Halves the batch after a throttled batch, grows it by one after a fast one,
+    and otherwise keeps it the same."""
+    if throttled:
+        return max(min_batch, size // 2)
+    if latency < target_latency:
+        return min(max_batch, size + 1)
+    return size
+
+
+async def run_item(worker, item) -> tuple:
+    """Runs the worker on one item, returning its result or error and how long it took."""
+    start = time.monotonic()
+    try:
+        return await worker(item), None, time.monotonic() - start
+    except Exception as err:
+        return None, err, time.monotonic() - start
+
+
+async def run_work_queue(items: list, worker, key=lambda item: item,
+                         batch_size: int = INITIAL_BATCH, min_batch: int = MIN_BATCH,
+                         max_batch: int = MAX_BATCH, max_attempts: int = MAX_ATTEMPTS,
+                         backoff: float = BACKOFF,
+                         target_latency: float = TARGET_LATENCY) -> dict:
+    """Runs the worker coroutine on every item, returning results keyed by key(item)
+    and the (item, error) dead letters of items that failed max_attempts times."""
+    queue = [(item, 1) for item in items]
+    results, dead_letters, batches = {}, [], 0
+    while queue:
+        batch, queue = queue[:batch_size], queue[batch_size:]
+        outcomes = await asyncio.gather(*[run_item(worker, item) for item, _ in batch])
+        batches += 1
+
+        failed, throttled = [], False
+        for (item, attempt), (result, err, _) in zip(batch, outcomes):
+            if err is None:
+                results[key(item)] = result
+                continue
+            throttled = throttled or is_throttled(err)
+            if attempt >= max_attempts:
+                logging.error("Giving up on %s after %s attempts: %s", key(item), attempt, err)
+                dead_letters.append((item, err))
+                add_metric("dead_letters")
+            else:
+                logging.warning("%s failed (%s), retrying", key(item), err)
+                failed.append((item, attempt + 1))
+                add_metric("retries")
+
+        latency = sum(outcome[2] for outcome in outcomes) / len(outcomes)
+        batch_size = next_batch_size(batch_size, throttled, latency,
+                                     min_batch, max_batch, target_latency)
+        if failed:
+            queue.extend(failed)
+            retry = max(attempt for _, attempt in failed) - 1
+            await asyncio.sleep(backoff * 2 ** (retry - 1) * random.uniform(0.5, 1.5))
+    logging.info("Work queue finished in %s batches, %s dead letters", batches, len(dead_letters))
+    return {"results": results, "dead_letters": dead_letters, "batches": batches}
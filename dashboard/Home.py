@@ -5,7 +5,7 @@ import requests
 from dotenv import load_dotenv
 import streamlit as st
 
-from Page1 import get_constellations, create_scroll_image, get_connection
+from Page1 import get_constellations, create_scroll_image, get_connection, get_image_url
 
 
 @st.cache_data
@@ -31,10 +31,10 @@ def display_apod(apod: dict) -> None:
         st.write(apod['explanation'])
 
 
-def get_constellation_url(constellation: str) -> str:
-    """Fetches url for corresponding constellation from the database."""
+def get_constellation_key(constellation: str) -> str:
+    """Fetches the image key for corresponding constellation from the database."""
     connection = get_connection()
-    query = """SELECT constellation_url
+    query = """SELECT constellation_key
                 FROM constellation
                 WHERE constellation_name = %s;"""
     with connection.cursor() as curs:
@@ -51,7 +51,7 @@ def display_constellation() -> None:
     st.markdown("""Here, you can select any constellation you are curious about. 
                     Keep in mind, this is the chart from London's perspective.""")
     constellation = st.selectbox('Select constellation:', get_constellations())
-    create_scroll_image(get_constellation_url(constellation), 617)
+    create_scroll_image(get_image_url(get_constellation_key(constellation)), 617)
 
 
 def app():
@@ -1,5 +1,6 @@
 """Page 1 of the dashboard."""
 from os import environ as ENV
+from base64 import b64encode
 from datetime import date, timedelta
 import logging
 import sys
@@ -10,6 +11,8 @@ import pandas as pd
 import psycopg2
 from dotenv import load_dotenv
 
+from image_store import get_store, is_key, get_extension, CONTENT_TYPES
+
 
 def configure_logs():
     """Configure the logs for the whole project to refer to"""
@@ -124,15 +127,16 @@ def get_weather_for_day(day: date, city: str) -> pd.DataFrame:
         weather_data = [(str(weather[5]).split(" ")[1][:2],
                          round(weather[2], 1),
                          str(weather[3]).split('.', maxsplit=1)[0],
-                         str(weather[4]).split('.', maxsplit=1)[0])
+                         str(weather[4]).split('.', maxsplit=1)[0],
+                         round(weather[6]))
                         for weather in curs.fetchall()]
 
     data = pd.DataFrame(weather_data)
     logging.info("Fetched!")
-    data.columns = ['Time', 'Temperature', 'Coverage', 'Visibility']
+    data.columns = ['Time', 'Temperature', 'Coverage', 'Visibility', 'Score']
     data = data[data['Time'].isin(['00', '06', '12', '18', '23'])]
     data = data.T
-    data.index = ['Time', 'Temperature', 'Coverage', 'Visibility']
+    data.index = ['Time', 'Temperature', 'Coverage', 'Visibility', 'Score']
     return data
 
 
@@ -152,11 +156,12 @@ def get_weather_for_week(city: str) -> pd.DataFrame:
         weather_data = [(weather[5],
                          round(weather[2], 1),
                          float(str(weather[3]).split('.', maxsplit=1)[0]),
-                         float(str(weather[4]).split('.', maxsplit=1)[0]))
+                         float(str(weather[4]).split('.', maxsplit=1)[0]),
+                         weather[6])
                         for weather in curs.fetchall()]
 
     weather_data = pd.DataFrame(weather_data)
-    weather_data.columns = ['Time', 'Temperature', 'Coverage', 'Visibility']
+    weather_data.columns = ['Time', 'Temperature', 'Coverage', 'Visibility', 'Score']
     return weather_data
 
 
@@ -222,7 +227,9 @@ def get_meteor_showers_for_day(day) -> pd.DataFrame:
 
 
 def get_emoji_for_weather(weather: pd.DataFrame) -> str:
-    """Uses the weather DF to return an appropriate emoji."""
+    """Uses the weather DF to return an appropriate emoji.
+    The emoji pictures the cloud cover through the day, so it reads Coverage rather
+    than the stored stargazing score, which is zero in daylight whatever the sky."""
     weather = weather.T
     weather['Coverage'] = pd.to_numeric(weather['Coverage'])
     average = weather['Coverage'].mean()
@@ -276,7 +283,7 @@ def column_three(star_status: list) -> None:
     if star_status is None:
         st.write("No data for this date/location.")
     else:
-        st.image(star_status[6])
+        st.image(get_image_url(star_status[6]))
 
 
 def column_four(showers: pd.DataFrame) -> None:
@@ -302,6 +309,9 @@ def weather_charts(weather: pd.DataFrame) -> None:
     with st.container(border=True):
         st.markdown("<h3>Cloud Coverage</h3>", unsafe_allow_html=True)
         st.line_chart(weather.set_index('Time'), y=['Coverage'])
+    with st.container(border=True):
+        st.markdown("<h3>Stargazing Score</h3>", unsafe_allow_html=True)
+        st.line_chart(weather.set_index('Time'), y=['Score'])
 
 
 def post_location_get_starchart(header: str,
@@ -350,6 +360,23 @@ def get_lat_and_long(city: str) -> tuple:
     return results[0][0], results[0][1]
 
 
+@st.cache_data(ttl=86400)
+def get_image_url(value: str) -> str:
+    """Returns a url the browser can load a stored image from.
+    S3 objects carry the immutable cache headers they were uploaded with. Local blobs
+    are a development fallback and are inlined with no cache headers, since Streamlit
+    has no route that could serve them with any. Older rows holding remote urls are
+    returned as they are."""
+    if not is_key(value):
+        return value
+    store = get_store()
+    url = store.get_url(value)
+    if url is None:
+        data = store.get(value)
+        url = f"data:{CONTENT_TYPES[get_extension(data)]};base64,{b64encode(data).decode()}"
+    return url
+
+
 def create_scroll_image(url: str, height: int) -> None:
     """Uses the link to make a pan/zoom image."""
     st.components.v1.html(
@@ -422,7 +449,7 @@ def app():
                 st.write("No Data for this date/location.")
                 logging.debug("No data found in star status")
             else:
-                create_scroll_image(star_status[5], 617)
+                create_scroll_image(get_image_url(star_status[5]), 617)
 
         if day == date.today():
             with st.container(border=True):
@@ -439,7 +466,7 @@ def app():
                 data.append((str(status[2]).split(" ", maxsplit=1)[0], str(status[2]).split(" ")[1],
                             str(status[3]).split(" ")[1]))
                 with columns[i]:
-                    st.image(status[6])
+                    st.image(get_image_url(status[6]))
 
         sun_times = pd.DataFrame(data)
         sun_times.columns = ["Day", "Sun Rise", "Sun Set"]
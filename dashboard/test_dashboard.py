@@ -6,7 +6,7 @@ import os
 
 import pandas as pd
 
-from Page1 import get_weather_for_day, get_aurora_info, get_country, get_cities, get_days, get_emoji_for_weather, get_meteor_showers_for_day, get_stargazing_status_for_day, get_weather_for_week, get_lat_and_long, get_constellation_code, get_constellations, get_stargazing_status_for_week, post_location_get_starchart
+from Page1 import get_weather_for_day, get_aurora_info, get_country, get_cities, get_days, get_emoji_for_weather, get_meteor_showers_for_day, get_stargazing_status_for_day, get_weather_for_week, get_lat_and_long, get_constellation_code, get_constellations, get_stargazing_status_for_week, post_location_get_starchart, get_image_url
 from Home import get_nasa_apod
 
 
@@ -47,14 +47,14 @@ class TestGetWeatherForDay(unittest.TestCase):
         mock_get_connection.return_value = mock_conn
         mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
         mock_cursor.fetchall.return_value = [
-            (1, 2, 14.65, 86.0, 12345, '2025-02-14 06:00:00')]
+            (1, 2, 14.65, 86.0, 12345, '2025-02-14 06:00:00', 4.6)]
 
         result = get_weather_for_day(date(2025, 2, 14), 'TestCity')
 
         expected_result = pd.DataFrame([['06'], [14.7],
-                                        ['86'], ['12345']],
+                                        ['86'], ['12345'], [5]],
                                        index=['Time', 'Temperature',
-                                              'Coverage', 'Visibility'],
+                                              'Coverage', 'Visibility', 'Score'],
                                        columns=[0])
         pd.testing.assert_frame_equal(result, expected_result)
         mock_conn.cursor.assert_called_once()
@@ -69,14 +69,14 @@ class TestGetWeatherForWeek(unittest.TestCase):
         mock_get_connection.return_value = mock_conn
         mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
         mock_cursor.fetchall.return_value = [
-            (1, 2, 14.65, 86.0, 12345, '2025-02-14 06:00:00')]
+            (1, 2, 14.65, 86.0, 12345, '2025-02-14 06:00:00', 4.6)]
 
         result = get_weather_for_week('TestCity')
 
         expected_result = pd.DataFrame([('2025-02-14 06:00:00', 14.7,
-                                        float(86), float(12345))],
+                                        float(86), float(12345), 4.6)],
                                        columns=['Time', 'Temperature',
-                                                'Coverage', 'Visibility'])
+                                                'Coverage', 'Visibility', 'Score'])
         pd.testing.assert_frame_equal(result, expected_result)
         mock_conn.cursor.assert_called_once()
 
@@ -320,5 +320,22 @@ class TestGetStargazingStatusForDay(unittest.TestCase):
         mock_conn.cursor.assert_called_once()
 
 
+class TestGetImageUrl(unittest.TestCase):
+    def test_remote_urls_are_unchanged(self):
+        self.assertEqual("https://widgets.astronomyapi.com/chart.png",
+                         get_image_url("https://widgets.astronomyapi.com/chart.png"))
+
+    @patch('Page1.get_store')
+    def test_store_url_is_used(self, mock_get_store):
+        mock_get_store.return_value.get_url.return_value = "https://cdn/images/ab/abc.png"
+        self.assertEqual("https://cdn/images/ab/abc.png", get_image_url("ab/abc.png"))
+
+    @patch('Page1.get_store')
+    def test_local_images_are_inlined(self, mock_get_store):
+        mock_get_store.return_value.get_url.return_value = None
+        mock_get_store.return_value.get.return_value = b"\x89PNG\r\n\x1a\n"
+        self.assertEqual("data:image/png;base64,iVBORw0KGgo=", get_image_url("cd/cde.png"))
+
+
 if __name__ == "__main__":
     unittest.main()
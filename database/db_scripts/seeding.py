@@ -11,6 +11,8 @@ import psycopg2
 from psycopg2.extras import execute_values
 from dotenv import load_dotenv
 
+from bulk_load import bulk_load
+
 
 CITIES = [
     "Aberdeen", "Armagh", "Bangor", "Bath", "Belfast", "Birmingham", "Bradford",
@@ -171,18 +173,34 @@ def insert_countries(connection) -> None:
     curs.close()
 
 
-def insert_cities(locations_list, connection) -> None:
-    """Inserts cities into the database."""
+def insert_visibility_rules(connection) -> None:
+    """Inserts which aurora status colours are visible from each country."""
     curs = connection.cursor()
     query = """
-            INSERT INTO city (city_name, country_id, latitude, longitude, elevation)
-            VALUES %s
+            INSERT INTO aurora_visibility_rule (
+                status_colour, country_id, camera_visibility, naked_eye_visibility)
+            VALUES
+                ('green', 1, FALSE, FALSE), ('green', 2, FALSE, FALSE),
+                ('green', 3, FALSE, FALSE), ('green', 4, FALSE, FALSE),
+                ('yellow', 1, TRUE, FALSE), ('yellow', 2, TRUE, TRUE),
+                ('yellow', 3, FALSE, FALSE), ('yellow', 4, TRUE, FALSE),
+                ('amber', 1, TRUE, TRUE), ('amber', 2, TRUE, TRUE),
+                ('amber', 3, TRUE, FALSE), ('amber', 4, TRUE, TRUE),
+                ('red', 1, TRUE, TRUE), ('red', 2, TRUE, TRUE),
+                ('red', 3, TRUE, TRUE), ('red', 4, TRUE, TRUE);
             """
-    execute_values(curs, query, locations_list)
+    curs.execute(query)
     connection.commit()
     curs.close()
 
 
+def insert_cities(locations_list, connection) -> None:
+    """Inserts cities into the database."""
+    bulk_load(connection, "city",
+              ["city_name", "country_id", "latitude", "longitude", "elevation"],
+              locations_list)
+
+
 def insert_meteor_showers(showers_list, connection) -> None:
     """Inserts meteor showers in the database."""
     curs = connection.cursor()
@@ -196,10 +214,11 @@ def insert_meteor_showers(showers_list, connection) -> None:
 
 
 def clear_tables(connection):
-    """Empties city, country and meteor shower."""
+    """Empties city, aurora visibility rules, country and meteor shower."""
     curs = connection.cursor()
     query = """
             DELETE FROM city;
+            DELETE FROM aurora_visibility_rule;
             DELETE FROM country;
             DELETE FROM meteor_shower;
             """
@@ -223,6 +242,9 @@ if __name__ == "__main__":
     insert_countries(conn)
     logging.info("Country data uploaded")
 
+    insert_visibility_rules(conn)
+    logging.info("Aurora visibility rules uploaded")
+
     insert_cities(locations, conn)
     logging.info("City data uploaded")
 
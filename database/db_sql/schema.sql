@@ -4,6 +4,8 @@ CREATE DATABASE starwatch;
 
 \c starwatch;
 
+CREATE EXTENSION IF NOT EXISTS btree_gist;
+
 CREATE TABLE meteor_shower (
     meteor_shower_id SMALLINT PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
     meteor_shower_name VARCHAR(50) NOT NULL,
@@ -28,6 +30,23 @@ CREATE TABLE aurora_status (
     UNIQUE (aurora_status_at, camera_visibility, naked_eye_visibility, country_id)
 );
 
+CREATE TABLE aurora_visibility_rule (
+    status_colour VARCHAR(10) NOT NULL,
+    country_id SMALLINT NOT NULL,
+    camera_visibility BOOLEAN NOT NULL,
+    naked_eye_visibility BOOLEAN NOT NULL,
+    FOREIGN KEY (country_id) REFERENCES country(country_id),
+    PRIMARY KEY (status_colour, country_id)
+);
+
+CREATE TABLE aurora_fetch_state (
+    source_url VARCHAR(200) PRIMARY KEY,
+    etag VARCHAR(200),
+    last_modified VARCHAR(50),
+    last_updated TIMESTAMPTZ NOT NULL,
+    checked_at TIMESTAMPTZ NOT NULL
+);
+
 CREATE TABLE city (
     city_id SMALLINT PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
     city_name VARCHAR(50) NOT NULL,
@@ -51,10 +70,61 @@ CREATE TABLE weather_status (
     coverage FLOAT NOT NULL,
     visibility FLOAT NOT NULL,
     status_at TIMESTAMP NOT NULL,
+    stargazing_score FLOAT NOT NULL DEFAULT 0,
     FOREIGN KEY (city_id) REFERENCES city(city_id),
     UNIQUE (city_id, status_at)
 );
 
+CREATE INDEX weather_status_score_idx ON weather_status (city_id, stargazing_score DESC);
+
+CREATE TABLE weather_forecast_history (
+    city_id SMALLINT NOT NULL,
+    issued_at TIMESTAMP NOT NULL,
+    valid_at TIMESTAMP NOT NULL,
+    temperature FLOAT NOT NULL,
+    coverage FLOAT NOT NULL,
+    visibility FLOAT NOT NULL,
+    FOREIGN KEY (city_id) REFERENCES city(city_id),
+    PRIMARY KEY (city_id, issued_at, valid_at)
+) PARTITION BY RANGE (issued_at);
+
+CREATE INDEX weather_forecast_history_valid_at_idx
+ON weather_forecast_history (city_id, valid_at);
+
+CREATE TABLE weather_shard_run (
+    issued_at TIMESTAMP NOT NULL,
+    shard_index SMALLINT NOT NULL,
+    shard_count SMALLINT NOT NULL,
+    strategy VARCHAR(10) NOT NULL,
+    first_id SMALLINT,
+    last_id SMALLINT,
+    status VARCHAR(10) NOT NULL,
+    attempts SMALLINT NOT NULL,
+    error TEXT,
+    updated_at TIMESTAMP NOT NULL,
+    PRIMARY KEY (issued_at, shard_index)
+);
+
+CREATE TABLE night_summary (
+    city_id SMALLINT NOT NULL,
+    night_date DATE NOT NULL,
+    dusk TIMESTAMP NOT NULL,
+    dawn TIMESTAMP NOT NULL,
+    hours SMALLINT NOT NULL,
+    min_coverage FLOAT NOT NULL,
+    avg_coverage FLOAT NOT NULL,
+    max_coverage FLOAT NOT NULL,
+    min_visibility FLOAT NOT NULL,
+    avg_visibility FLOAT NOT NULL,
+    max_visibility FLOAT NOT NULL,
+    min_temperature FLOAT NOT NULL,
+    avg_temperature FLOAT NOT NULL,
+    max_temperature FLOAT NOT NULL,
+    updated_at TIMESTAMP NOT NULL,
+    FOREIGN KEY (city_id) REFERENCES city(city_id),
+    PRIMARY KEY (city_id, night_date)
+);
+
 -- CREATE TABLE nasa_apod (
 --     nasa_apod_id SMALLINT PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
 --     nasa_apod_url VARCHAR(100),
@@ -68,10 +138,22 @@ CREATE TABLE stargazing_status (
     sunrise TIMESTAMP NOT NULL,
     sunset TIMESTAMP NOT NULL,
     status_date DATE NOT NULL,
-    star_chart_url VARCHAR(100) NOT NULL,
-    moon_phase_url VARCHAR(100) NOT NULL,
+    star_chart_key VARCHAR(100) NOT NULL,
+    moon_phase_key VARCHAR(100) NOT NULL,
+    moon_illumination FLOAT,
+    moonrise TIMESTAMP,
+    moonset TIMESTAMP,
+    FOREIGN KEY (city_id) REFERENCES city(city_id),
+    UNIQUE(city_id, sunrise, sunset, status_date, star_chart_key, moon_phase_key)
+);
+
+CREATE TABLE night_window (
+    city_id SMALLINT NOT NULL,
+    night_date DATE NOT NULL,
+    dark TSRANGE NOT NULL,
     FOREIGN KEY (city_id) REFERENCES city(city_id),
-    UNIQUE(city_id, sunrise, sunset, status_date, star_chart_url, moon_phase_url)
+    PRIMARY KEY (city_id, night_date),
+    EXCLUDE USING gist (city_id WITH =, dark WITH &&)
 );
 
 CREATE TABLE meteor_shower_assignment (
@@ -85,5 +167,6 @@ CREATE TABLE meteor_shower_assignment (
 CREATE TABLE constellation (
     constellation_id SMALLINT PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
     constellation_name VARCHAR(50) NOT NULL,
-    constellation_code VARCHAR(3) NOT NULL
+    constellation_code VARCHAR(3) NOT NULL,
+    constellation_key VARCHAR(100)
 );
\ No newline at end of file
@@ -17,3 +17,11 @@ JOIN country AS co
 ON co.country_id = a.country_id
 JOIN city AS c
 ON c.country_id = co.country_id;
+
+CREATE VIEW dark_hours
+AS
+SELECT w.*, nw.night_date
+FROM weather_status AS w
+JOIN night_window AS nw
+ON nw.city_id = w.city_id
+AND nw.dark @> w.status_at;
@@ -0,0 +1,211 @@
+"""Asynchronous, bounded-concurrency extraction of weather data from open-meteo."""
+import asyncio
+import logging
+import random
+import time
+
+import aiohttp
+import pandas as pd
+from openmeteo_sdk.WeatherApiResponse import WeatherApiResponse
+
+from instrumentation import add_metric
+from weather_extract import (BATCH_SIZE, chunk_locations, get_dataframe, get_weather_columns,
+                             combine_weather_columns)
+
+URL = "https://api.open-meteo.com/v1/forecast"
+HOURLY_VARIABLES = ["temperature_2m", "cloud_cover", "visibility"]
+
+CONCURRENCY = 8
+RETRIES = 3
+BACKOFF = 0.5
+REQUEST_TIMEOUT = 30
+# Leaves time for the load inside the 600 second lambda timeout.
+DEADLINE = 480
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+
+
+class RetryableStatusError(Exception):
+    """Raised when open-meteo responds with a status worth retrying."""
+
+
+def get_params(today: str, week_away: str, batch: list) -> dict:
+    """Returns query parameters for a multi-location request."""
+    return {
+        "latitude": ",".join(str(location[3]) for location in batch),
+        "longitude": ",".join(str(location[4]) for location in batch),
+        "hourly": ",".join(HOURLY_VARIABLES),
+        "start_date": today,
+        "end_date": week_away,
+        "format": "flatbuffers"
+    }
+
+
+def decode_responses(data: bytes) -> list:
+    """Decodes the length-prefixed flatbuffer messages returned by open-meteo."""
+    responses = []
+    pos = 0
+    while pos < len(data):
+        length = int.from_bytes(data[pos:pos + 4], byteorder="little")
+        # Errors part way through a stream start with "Unexpected".
+        if length == 0x78656E55:
+            raise ValueError(data[pos:].decode("utf-8"))
+        responses.append(WeatherApiResponse.GetRootAs(data, pos + 4))
+        pos += length + 4
+    return responses
+
+
+def create_session(concurrency: int = CONCURRENCY) -> aiohttp.ClientSession:
+    """Returns a session with a connection pool sized to the concurrency limit."""
+    connector = aiohttp.TCPConnector(limit=concurrency,
+                                     limit_per_host=concurrency,
+                                     ttl_dns_cache=300)
+    return aiohttp.ClientSession(connector=connector,
+                                 timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT))
+
+
+def aiohttp_fetcher(session: aiohttp.ClientSession):
+    """Returns a fetch coroutine that requests open-meteo through aiohttp."""
+    async def fetch(params: dict) -> list:
+        async with session.get(URL, params=params) as response:
+            if response.status in RETRYABLE_STATUSES:
+                raise RetryableStatusError(
+                    f"open-meteo responded with {response.status}")
+            response.raise_for_status()
+            data = await response.read()
+            add_metric("bytes_fetched", len(data))
+            return decode_responses(data)
+    return fetch
+
+
+def openmeteo_fetcher(openmeteo):
+    """Returns a fetch coroutine that uses the cached, retrying client from get_openmeteo.
+    The blocking client is run in a worker thread so requests still overlap."""
+    async def fetch(params: dict) -> list:
+        return await asyncio.to_thread(openmeteo.weather_api, URL, params=dict(params))
+    return fetch
+
+
+async def fetch_with_retries(fetch, params: dict, semaphore: asyncio.Semaphore,
+                             retries: int = RETRIES, backoff: float = BACKOFF) -> list:
+    """Fetches under the concurrency limit, retrying with jittered exponential backoff."""
+    for attempt in range(retries + 1):
+        async with semaphore:
+            try:
+                return await fetch(params)
+            except (aiohttp.ClientError, asyncio.TimeoutError, RetryableStatusError) as err:
+                if attempt == retries:
+                    raise
+                add_metric("retries")
+                logging.warning("Weather request failed (%s), retrying", err)
+        await asyncio.sleep(backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+    return []
+
+
+async def fetch_batch(fetch, batch: list, today: str, week_away: str,
+                      semaphore: asyncio.Semaphore, retries: int, backoff: float) -> tuple:
+    """Returns the batch alongside its responses, one per location."""
+    responses = await fetch_with_retries(fetch, get_params(today, week_away, batch),
+                                         semaphore, retries, backoff)
+    if len(responses) != len(batch):
+        raise ValueError(
+            f"Expected {len(batch)} responses from open-meteo, got {len(responses)}")
+    return batch, responses
+
+
+async def stream_weather(locations: list, fetch, today: str, week_away: str,
+                         batch_size: int = BATCH_SIZE, concurrency: int = CONCURRENCY,
+                         retries: int = RETRIES, backoff: float = BACKOFF,
+                         deadline: float = DEADLINE):
+    """Yields (city_id, hourly) for each location as soon as its request completes.
+    At most concurrency batches are in flight or waiting to be consumed, and a new one
+    is only started as another is consumed, so memory stays flat however many
+    locations there are. Raises TimeoutError if every location has not arrived within
+    the deadline."""
+    semaphore = asyncio.Semaphore(concurrency)
+    batches = iter(chunk_locations(locations, batch_size))
+    loop = asyncio.get_running_loop()
+    end = loop.time() + deadline
+    pending = set()
+
+    def refill():
+        for batch in batches:
+            pending.add(asyncio.create_task(fetch_batch(fetch, batch, today, week_away,
+                                                        semaphore, retries, backoff)))
+            if len(pending) >= concurrency:
+                return
+
+    try:
+        refill()
+        while pending:
+            done, _ = await asyncio.wait(pending, timeout=max(end - loop.time(), 0),
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                raise TimeoutError(f"Weather for {len(locations)} locations did not "
+                                   f"arrive within {deadline} seconds")
+            for task in done:
+                pending.discard(task)
+                batch, responses = task.result()
+                refill()
+                for location, response in zip(batch, responses):
+                    yield location[0], response.Hourly()
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def collect_weather(locations: list, today: str, week_away: str, transform,
+                          openmeteo=None, **options) -> list[tuple]:
+    """Transforms each location as soon as it arrives, returning (city_id, block) pairs.
+    Uses the cached open-meteo client when given one, otherwise a pooled aiohttp session."""
+    start = time.monotonic()
+    blocks = []
+
+    async def consume(fetch):
+        async for city_id, hourly in stream_weather(locations, fetch, today,
+                                                    week_away, **options):
+            blocks.append((city_id, transform(hourly)))
+
+    if openmeteo is not None:
+        await consume(openmeteo_fetcher(openmeteo))
+    else:
+        async with create_session(options.get("concurrency", CONCURRENCY)) as session:
+            await consume(aiohttp_fetcher(session))
+
+    logging.info("Extracted weather for %s locations in %.2fs",
+                 len(blocks), time.monotonic() - start)
+    return blocks
+
+
+async def extract_weather(locations: list, today: str, week_away: str,
+                          openmeteo=None, **options) -> pd.DataFrame:
+    """Returns all of the weather as a dataframe."""
+    blocks = await collect_weather(locations, today, week_away, get_dataframe,
+                                   openmeteo, **options)
+    dataframes = []
+    for city_id, df in blocks:
+        df['city_id'] = city_id
+        dataframes.append(df)
+    return pd.concat(dataframes, ignore_index=True)
+
+
+async def extract_weather_columns(locations: list, today: str, week_away: str,
+                                  openmeteo=None, **options) -> dict:
+    """Returns all of the weather as numpy arrays keyed by weather_status column."""
+    blocks = await collect_weather(locations, today, week_away, get_weather_columns,
+                                   openmeteo, **options)
+    return combine_weather_columns([city_id for city_id, _ in blocks],
+                                   [block for _, block in blocks])
+
+
+def handle_locations_async(locations: list, today_str: str, week_str: str,
+                           openmeteo=None, **options) -> pd.DataFrame:
+    """Runs the asynchronous extraction from synchronous code."""
+    return asyncio.run(extract_weather(locations, today_str, week_str,
+                                       openmeteo, **options))
+
+
+def handle_locations_columns(locations: list, today_str: str, week_str: str,
+                             openmeteo=None, **options) -> dict:
+    """Runs the asynchronous extraction from synchronous code, returning numpy arrays."""
+    return asyncio.run(extract_weather_columns(locations, today_str, week_str,
+                                               openmeteo, **options))
@@ -1,12 +1,18 @@
 """Extracts, transforms and loads the occurences of aurora events from a to an RDS"""
+from datetime import datetime
 from xml.etree import ElementTree as ET
 from os import environ as ENV
 import requests
 import logging
 
 import psycopg2
+from psycopg2.extras import execute_values
 from dotenv import load_dotenv
 
+from instrumentation import timed, add_metric
+
+AURORA_URL = "https://aurorawatch-api.lancs.ac.uk/0.2/status/current-status.xml"
+
 
 def configure_logs():
     """Configure the logs for the whole project to refer to"""
@@ -54,6 +60,7 @@ def insert_db(conn, query: str, params: tuple) -> tuple:
 # Extract
 
 
+@timed("extract_countries", rows=len)
 def get_country_dict(conn):
     """Returns a dict of country names assigned to IDs"""
     query = "SELECT * from country;"
@@ -66,70 +73,183 @@ def get_country_dict(conn):
     return country_dict
 
 
-def get_current_aurora_data() -> dict:
-    """Fetch current aurora status and last update"""
-    logging.info("Retrieving Aurora data...")
-    response = requests.get(
-        "https://aurorawatch-api.lancs.ac.uk/0.2/status/current-status.xml", timeout=10)
-    root = ET.fromstring(response.text)
+def parse_aurora_data(text: str) -> dict:
+    """Returns the status and last update from an AuroraWatch XML document"""
+    root = ET.fromstring(text)
     last_update = root[0][0].text
     current_status = root[1].attrib["status_id"]
     return {"last_updated": last_update, "current_status": current_status}
 
 
+@timed("extract_aurora")
+def get_current_aurora_data() -> dict:
+    """Fetch current aurora status and last update"""
+    logging.info("Retrieving Aurora data...")
+    response = requests.get(AURORA_URL, timeout=10)
+    add_metric("bytes_fetched", len(response.text))
+    return parse_aurora_data(response.text)
+
+
+def get_fetch_state(conn) -> dict:
+    """Returns the validators saved from the last AuroraWatch response that was loaded"""
+    query = """
+            SELECT etag, last_modified, last_updated
+            FROM aurora_fetch_state
+            WHERE source_url = %s;
+            """
+    rows = query_db(conn, query, (AURORA_URL,))
+    if not rows:
+        return {}
+    return {"etag": rows[0][0], "last_modified": rows[0][1],
+            "last_updated": rows[0][2]}
+
+
+def save_fetch_state(conn, etag: str, last_modified: str, last_updated: datetime):
+    """Saves the validators of the AuroraWatch response that was just loaded"""
+    query = """
+            INSERT INTO aurora_fetch_state (
+                source_url, etag, last_modified, last_updated, checked_at)
+            VALUES
+                (%s, %s, %s, %s, NOW())
+            ON CONFLICT (source_url)
+            DO UPDATE SET
+                etag = EXCLUDED.etag,
+                last_modified = EXCLUDED.last_modified,
+                last_updated = EXCLUDED.last_updated,
+                checked_at = EXCLUDED.checked_at
+            """
+    insert_db(conn, query, (AURORA_URL, etag, last_modified, last_updated))
+
+
+def get_conditional_headers(state: dict) -> dict:
+    """Returns the headers that let AuroraWatch answer 304 when nothing has changed"""
+    headers = {}
+    if state.get("etag"):
+        headers["If-None-Match"] = state["etag"]
+    if state.get("last_modified"):
+        headers["If-Modified-Since"] = state["last_modified"]
+    return headers
+
+
+def parse_update_time(last_updated: str) -> datetime:
+    """Returns the <updated> datetime from AuroraWatch as an aware datetime"""
+    return datetime.strptime(last_updated, "%Y-%m-%dT%H:%M:%S%z")
+
+
+@timed("aurora_status")
+def update_aurora_status(conn, session=requests) -> dict:
+    """Loads the aurora status only if AuroraWatch has published a new one.
+    Unchanged responses skip the parse, the country lookup and the inserts."""
+    state = get_fetch_state(conn)
+    response = session.get(AURORA_URL, headers=get_conditional_headers(state),
+                           timeout=10)
+    if response.status_code == 304:
+        add_metric("skipped_unchanged")
+        logging.info("aurora_fetch skipped=unchanged reason=not_modified")
+        return {"skipped": True, "reason": "not_modified"}
+    response.raise_for_status()
+    add_metric("bytes_fetched", len(response.text))
+
+    status = parse_aurora_data(response.text)
+    last_updated = parse_update_time(status["last_updated"])
+    if state.get("last_updated") == last_updated:
+        add_metric("skipped_unchanged")
+        logging.info("aurora_fetch skipped=unchanged reason=same_update")
+        return {"skipped": True, "reason": "same_update"}
+
+    country_status = get_status_per_country(status, get_country_dict(conn),
+                                            get_visibility_rules(conn))
+    insert_values_to_db(conn, country_status)
+    save_fetch_state(conn, response.headers.get("ETag"),
+                     response.headers.get("Last-Modified"), last_updated)
+    logging.info("aurora_fetch skipped=none status=%s", status["current_status"])
+    return {"skipped": False, "reason": None, "status": status["current_status"]}
+
+
 # Transform
-def get_status_per_country(status: dict, countries: dict) -> list[tuple]:
+# (status, region): (camera_visibility, naked_eye_visibility), used until the
+# aurora_visibility_rule table has been seeded.
+DEFAULT_VISIBILITY_RULES = {
+    ("green", "Scotland"): (False, False),
+    ("green", "England"): (False, False),
+    ("green", "Wales"): (False, False),
+    ("green", "Northern Ireland"): (False, False),
+    ("yellow", "Scotland"): (True, True),
+    ("yellow", "England"): (True, False),
+    ("yellow", "Wales"): (False, False),
+    ("yellow", "Northern Ireland"): (True, False),
+    ("amber", "Scotland"): (True, True),
+    ("amber", "England"): (True, True),
+    ("amber", "Wales"): (True, False),
+    ("amber", "Northern Ireland"): (True, True),
+    ("red", "Scotland"): (True, True),
+    ("red", "England"): (True, True),
+    ("red", "Wales"): (True, True),
+    ("red", "Northern Ireland"): (True, True),
+}
+
+# Rules grouped by status, kept between warm lambda invocations.
+VISIBILITY_RULES = {}
+
+
+def group_rules(rules: dict) -> dict:
+    """Returns rules keyed by (status, region) grouped into {status: [(region, camera, naked_eye)]}"""
+    grouped = {}
+    for (status, region), (camera, naked_eye) in rules.items():
+        grouped.setdefault(status, []).append((region, camera, naked_eye))
+    return grouped
+
+
+def load_visibility_rules(conn) -> dict:
+    """Returns the visibility rules stored in the database keyed by (status, region)"""
+    query = """
+            SELECT r.status_colour, c.country_name,
+                   r.camera_visibility, r.naked_eye_visibility
+            FROM aurora_visibility_rule AS r
+            JOIN country AS c ON c.country_id = r.country_id
+            ORDER BY r.status_colour, c.country_id;
+            """
+    return {(row[0], row[1]): (row[2], row[3])
+            for row in query_db(conn, query, ())}
+
+
+def get_visibility_rules(conn, refresh: bool = False) -> dict:
+    """Returns the grouped visibility rules, only querying the database on a cold start"""
+    if refresh or not VISIBILITY_RULES:
+        rules = load_visibility_rules(conn)
+        if not rules:
+            logging.warning("No aurora visibility rules stored, using defaults")
+            rules = DEFAULT_VISIBILITY_RULES
+        VISIBILITY_RULES.clear()
+        VISIBILITY_RULES.update(group_rules(rules))
+    return VISIBILITY_RULES
+
+
+@timed("transform_aurora", rows=len)
+def get_status_per_country(status: dict, countries: dict, rules: dict = None) -> list[tuple]:
     """create a status database entry for each country"""
     # tuple order (country_id, status_at, camera_visibility, naked_eye_visibility)
-    if status["current_status"] == "green":
-        countries_status = [
-            (countries["Scotland"], status["last_updated"], False, False),
-            (countries["England"], status["last_updated"], False, False),
-            (countries["Wales"], status["last_updated"], False, False),
-            (countries["Northern Ireland"], status["last_updated"],
-             False, False)
-        ]
-    elif status["current_status"] == "yellow":
-        countries_status = [
-            (countries["Scotland"], status["last_updated"], True, True),
-            (countries["England"], status["last_updated"], True, False),
-            (countries["Wales"], status["last_updated"], False, False),
-            (countries["Northern Ireland"], status["last_updated"],
-             True, False)
-        ]
-    elif status["current_status"] == "amber":
-        countries_status = [
-            (countries["Scotland"], status["last_updated"], True, True),
-            (countries["England"], status["last_updated"], True, True),
-            (countries["Wales"], status["last_updated"], True, False),
-            (countries["Northern Ireland"], status["last_updated"],
-             True, True)
-        ]
-    elif status["current_status"] == "red":
-        countries_status = [
-            (countries["Scotland"], status["last_updated"], True, True),
-            (countries["England"], status["last_updated"], True, True),
-            (countries["Wales"], status["last_updated"], True, True),
-            (countries["Northern Ireland"], status["last_updated"],
-             True, True)
-        ]
-    else:
+    if rules is None:
+        rules = group_rules(DEFAULT_VISIBILITY_RULES)
+    if status["current_status"] not in rules:
         raise ValueError("Current status is unidentified")
-    return countries_status
+    return [(countries[region], status["last_updated"], camera, naked_eye)
+            for region, camera, naked_eye in rules[status["current_status"]]]
 
 # Load
 
 
-def insert_values_to_db(conn, country_status: list):
-    """Insert the current aurora status into aurora_status table"""
+@timed("load_aurora", rows=lambda inserted: inserted)
+def insert_values_to_db(conn, country_status: list) -> int:
+    """Insert the current aurora status into aurora_status table.
+    Every country is written in one statement and committed once."""
     query = """
             INSERT INTO aurora_status (
                 country_id, 
                 aurora_status_at, 
                 camera_visibility, 
                 naked_eye_visibility)
-            VALUES
-                (%s, %s, %s, %s)
+            VALUES %s
             ON CONFLICT (
                 country_id,
                 aurora_status_at,
@@ -137,8 +257,18 @@ def insert_values_to_db(conn, country_status: list):
                 naked_eye_visibility)
             DO NOTHING
             """
-    for row in country_status:
-        insert_db(conn, query, row)
+    if not country_status:
+        return 0
+    try:
+        with conn.cursor() as cursor:
+            execute_values(cursor, query, country_status,
+                           page_size=len(country_status))
+            inserted = cursor.rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return inserted
 
 
 if __name__ == "__main__":
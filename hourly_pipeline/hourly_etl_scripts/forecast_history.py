@@ -0,0 +1,178 @@
+"""Keeps every hourly forecast snapshot in weather_forecast_history, a table partitioned
+by issue time. Partitions are created ahead of time and dropped once past retention."""
+from datetime import datetime, date, timedelta, timezone
+import logging
+import re
+
+import numpy as np
+
+from bulk_load import copy_merge
+
+HISTORY_TABLE = "weather_forecast_history"
+HISTORY_COLUMNS = ["city_id", "issued_at", "valid_at",
+                   "temperature", "coverage", "visibility"]
+PARTITION_INTERVAL = "month"
+RETENTION_DAYS = 365
+# Open-meteo forecasts reach eight days ahead.
+FORECAST_HORIZON = timedelta(days=8)
+
+
+def get_issue_time() -> datetime:
+    """Returns the current hour in UTC, which identifies this run's snapshot."""
+    return datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0,
+                                              tzinfo=None)
+
+
+def partition_bounds(day: date, interval: str = PARTITION_INTERVAL) -> tuple[date, date]:
+    """Returns the start and end dates of the partition holding the given day."""
+    if interval == "month":
+        start = day.replace(day=1)
+        end = (start + timedelta(days=32)).replace(day=1)
+    elif interval == "week":
+        start = day - timedelta(days=day.weekday())
+        end = start + timedelta(days=7)
+    else:
+        raise ValueError(f"Unknown partition interval {interval}")
+    return start, end
+
+
+def partition_name(start: date) -> str:
+    """Returns the name of the partition starting on the given date."""
+    return f"{HISTORY_TABLE}_{start.strftime('%Y%m%d')}"
+
+
+def ensure_partitions(connection, issued_at: datetime, ahead: int = 1,
+                      interval: str = PARTITION_INTERVAL) -> list[str]:
+    """Creates the partition for the issue time and the next few, if they are missing."""
+    names = []
+    start, end = partition_bounds(issued_at.date(), interval)
+    curs = connection.cursor()
+    for _ in range(ahead + 1):
+        name = partition_name(start)
+        curs.execute(f"""
+            CREATE TABLE IF NOT EXISTS {name}
+            PARTITION OF {HISTORY_TABLE}
+            FOR VALUES FROM (%s) TO (%s);
+            """, (start, end))
+        names.append(name)
+        start, end = partition_bounds(end, interval)
+    connection.commit()
+    curs.close()
+    return names
+
+
+def get_partitions(connection) -> list[tuple[str, date]]:
+    """Returns each partition's name and start date."""
+    curs = connection.cursor()
+    curs.execute("""
+        SELECT child.relname
+        FROM pg_inherits
+        JOIN pg_class AS parent ON parent.oid = pg_inherits.inhparent
+        JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid
+        WHERE parent.relname = %s;
+        """, (HISTORY_TABLE,))
+    rows = curs.fetchall()
+    curs.close()
+
+    partitions = []
+    for row in rows:
+        name = row[0]
+        match = re.fullmatch(f"{HISTORY_TABLE}_(\\d{{8}})", name)
+        if match:
+            partitions.append(
+                (name, datetime.strptime(match.group(1), "%Y%m%d").date()))
+    return partitions
+
+
+def drop_expired_partitions(connection, now: datetime, retention_days: int = RETENTION_DAYS,
+                            interval: str = PARTITION_INTERVAL) -> list[str]:
+    """Drops partitions whose every snapshot is older than the retention period."""
+    cutoff = (now - timedelta(days=retention_days)).date()
+    expired = [name for name, start in get_partitions(connection)
+               if partition_bounds(start, interval)[1] <= cutoff]
+    curs = connection.cursor()
+    for name in expired:
+        curs.execute(f"DROP TABLE IF EXISTS {name};")
+        logging.info("Dropped expired forecast partition %s", name)
+    connection.commit()
+    curs.close()
+    return expired
+
+
+def maintain_partitions(connection, issued_at: datetime,
+                        retention_days: int = RETENTION_DAYS) -> None:
+    """Creates upcoming partitions and drops expired ones."""
+    ensure_partitions(connection, issued_at)
+    drop_expired_partitions(connection, issued_at, retention_days)
+
+
+def archive_forecast(columns: dict, connection, issued_at: datetime) -> dict:
+    """Adds the weather columns to the history as the snapshot issued at the given hour."""
+    history = {"city_id": columns["city_id"],
+               "issued_at": np.full(len(columns["status_at"]),
+                                    np.datetime64(issued_at, "s")),
+               "valid_at": columns["status_at"],
+               "temperature": columns["temperature"],
+               "coverage": columns["coverage"],
+               "visibility": columns["visibility"]}
+    curs = connection.cursor()
+    try:
+        stats = copy_merge(curs, HISTORY_TABLE, HISTORY_COLUMNS, history,
+                           conflict=["city_id", "issued_at", "valid_at"])
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        curs.close()
+    return stats
+
+
+def query_history(connection, query: str, params: tuple) -> list[tuple]:
+    """Runs a history query and returns its rows."""
+    curs = connection.cursor()
+    curs.execute(query, params)
+    rows = curs.fetchall()
+    curs.close()
+    return rows
+
+
+def get_forecasts_for_hour(connection, city_id: int, valid_at: datetime) -> list[tuple]:
+    """Returns every forecast made for one hour, oldest first.
+    Only partitions within the forecast horizon before the hour are scanned."""
+    return query_history(connection, f"""
+        SELECT issued_at, temperature, coverage, visibility
+        FROM {HISTORY_TABLE}
+        WHERE city_id = %s
+        AND valid_at = %s
+        AND issued_at >= %s
+        AND issued_at <= %s
+        ORDER BY issued_at;
+        """, (city_id, valid_at, valid_at - FORECAST_HORIZON, valid_at))
+
+
+def get_snapshot(connection, city_id: int, issued_at: datetime) -> list[tuple]:
+    """Returns the full forecast issued at one hour."""
+    return query_history(connection, f"""
+        SELECT valid_at, temperature, coverage, visibility
+        FROM {HISTORY_TABLE}
+        WHERE city_id = %s
+        AND issued_at = %s
+        ORDER BY valid_at;
+        """, (city_id, issued_at))
+
+
+def get_past_weather(connection, city_id: int, start: datetime, end: datetime) -> list[tuple]:
+    """Returns the most recent forecast for each hour between start and end,
+    the closest record of what the weather actually was."""
+    return query_history(connection, f"""
+        SELECT DISTINCT ON (valid_at) valid_at, temperature, coverage, visibility
+        FROM {HISTORY_TABLE}
+        WHERE city_id = %s
+        AND valid_at >= %s
+        AND valid_at < %s
+        AND issued_at >= %s
+        AND issued_at < %s
+        AND issued_at <= valid_at
+        ORDER BY valid_at, issued_at DESC;
+        """, (city_id, start, end, start - FORECAST_HORIZON, end))
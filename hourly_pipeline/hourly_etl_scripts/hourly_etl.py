@@ -1,11 +1,38 @@
 """Script to extract, transform and load weather data and aurora updates"""
-from dotenv import load_dotenv
+from os import environ as ENV
+from concurrent.futures import ThreadPoolExecutor
 import logging
 import sys
+import time
+
+from boto3 import client
+from botocore.config import Config
+from dotenv import load_dotenv
+
+from aurora_status import get_connection, update_aurora_status
+
+from weather_extract import get_openmeteo, get_locations, get_dates, BATCH_SIZE
+
+from async_extract import CONCURRENCY, DEADLINE
+
+from weather_stream import handle_locations_streaming, FLUSH_ROWS
+
+from forecast_history import get_issue_time, maintain_partitions, RETENTION_DAYS
 
-from aurora_status import get_connection, get_country_dict, get_current_aurora_data, get_status_per_country, insert_values_to_db
+from lambda_resources import (start_invocation, reuse_connection, get_session, get_resource,
+                              get_client)
 
-from weather_extract import get_openmeteo, get_locations, get_dates, handle_locations, clear_weather_table, insert_into_db
+from instrumentation import reset_records, format_summary
+
+from night_summary import refresh_night_windows, refresh_missing_nights
+
+from shards import (run_sharded, run_shard, retry_failed_shards, lambda_dispatcher,
+                    process_pool_dispatcher, COUNT_KEYS)
+
+# Seconds kept back from the lambda timeout for loading into the database.
+LOAD_MARGIN = 90
+# The worker lambda's timeout in seconds, as set in terraform.
+WORKER_TIMEOUT = 600
 
 
 def configure_logs():
@@ -24,36 +51,145 @@ def configure_logs():
     )
 
 
-def lambda_handler(event, context):
-    load_dotenv()
-    conn = get_connection()
+def get_extract_deadline(context) -> float:
+    """Returns the seconds the weather extract may run for in this invocation."""
+    if context is None:
+        return DEADLINE
+    return max(context.get_remaining_time_in_millis() / 1000 - LOAD_MARGIN, 1)
 
-    # Aurora data
-    status_dict = get_current_aurora_data()
-    logging.info("Aurora data retrieved")
 
-    country_list = get_country_dict(conn)
-    country_status_list = get_status_per_country(status_dict, country_list)
-    logging.info("Aurora status linked to country")
+def run_stage(name: str, stage) -> dict:
+    """Runs one stage on its own database connection, timing it and catching failures.
+    The connection is kept for the same stage in the next warm invocation."""
+    start = time.monotonic()
+    try:
+        conn = reuse_connection(get_connection, name)
+        result = stage(conn)
+        report = {"status": "succeeded", "result": result}
+    except Exception as err:
+        logging.exception("Stage %s failed", name)
+        report = {"status": "failed", "error": str(err)}
+    report["seconds"] = round(time.monotonic() - start, 3)
+    logging.info("Stage %s %s in %.2fs", name, report["status"], report["seconds"])
+    return report
 
-    insert_values_to_db(conn, country_status_list)
-    logging.info("Aurora status data uploaded to database")
 
-    # Weather data
-    open_meteo = get_openmeteo()
-    logging.info("Weather data retrieved")
-    locations = get_locations(conn)
+def run_stages(stages: dict) -> dict:
+    """Runs independent stages concurrently and returns a combined status.
+    Each stage is a function taking a connection, keyed by its name."""
+    with ThreadPoolExecutor(max_workers=len(stages)) as executor:
+        futures = {name: executor.submit(run_stage, name, stage)
+                   for name, stage in stages.items()}
+        reports = {name: future.result() for name, future in futures.items()}
+    failed = any(report["status"] == "failed" for report in reports.values())
+    return {"statusCode": 500 if failed else 200, "stages": reports}
+
+
+def aurora_stage(conn) -> dict:
+    """Loads the current aurora status if AuroraWatch has a new one."""
+    aurora = update_aurora_status(conn, get_session("aurora"))
+    if aurora["skipped"]:
+        logging.info("Aurora status unchanged, skipped loading")
+    else:
+        logging.info("Aurora status data uploaded to database")
+    return aurora
+
+
+def get_weather_options() -> dict:
+    """Returns the extract and load settings shared by every weather worker."""
+    return {"flush_rows": int(ENV.get("WEATHER_FLUSH_ROWS", FLUSH_ROWS)),
+            "batch_size": int(ENV.get("WEATHER_BATCH_SIZE", BATCH_SIZE)),
+            "concurrency": int(ENV.get("WEATHER_CONCURRENCY", CONCURRENCY))}
+
+
+def get_shard_dispatcher(context):
+    """Returns a dispatcher invoking worker lambdas, or a local process pool outside lambda."""
+    if context is None:
+        return process_pool_dispatcher()
+    # Wait as long as a worker can run and never retry the invoke, so a slow shard
+    # is not started a second time while the first is still loading.
+    config = Config(read_timeout=int(ENV.get("WEATHER_WORKER_TIMEOUT", WORKER_TIMEOUT)),
+                    retries={"max_attempts": 0})
+    lambda_client = get_client("lambda", lambda: client("lambda", config=config))
+    return lambda_dispatcher(lambda_client,
+                             ENV.get("WEATHER_WORKER_FUNCTION", context.function_name))
+
+
+def sharded_weather_stage(conn, context, shard_count: int, issued_at, today_str: str,
+                          week_str: str) -> dict:
+    """Fans the weather out to parallel workers, one shard of cities each.
+    Workers are given an extract deadline inside the coordinator's remaining time,
+    and shards that fail are retried once before the stage fails."""
+    dispatch = get_shard_dispatcher(context)
+    options = {**get_weather_options(), "deadline": get_extract_deadline(context)}
+    counts = run_sharded(conn, dispatch, shard_count, issued_at, today_str, week_str,
+                         ENV.get("WEATHER_SHARD_STRATEGY", "range"), options)
+    if counts["failed_shards"]:
+        logging.warning("Retrying weather shards %s", counts["failed_shards"])
+        options["deadline"] = get_extract_deadline(context)
+        retried = retry_failed_shards(conn, dispatch, issued_at, today_str, week_str, options)
+        for key in COUNT_KEYS:
+            counts[key] += retried[key]
+        counts["failed_shards"], counts["pruned"] = retried["failed_shards"], retried["pruned"]
+        counts["retried_shards"] = retried["shards"]
+    if counts["failed_shards"]:
+        raise RuntimeError(f"Weather shards {counts['failed_shards']} failed")
+    return counts
+
+
+def weather_stage(conn, context) -> dict:
+    """Streams the week's weather for every city into the database."""
     today_str, week_str = get_dates()
-    data = handle_locations(locations, open_meteo, today_str, week_str)
-    logging.info("Weather status linked to location")
-    clear_weather_table(conn)
-    insert_into_db(data, conn)
-    logging.info("Weather data uploaded to database")
+    issued_at = get_issue_time()
+    maintain_partitions(conn, issued_at,
+                        int(ENV.get("FORECAST_RETENTION_DAYS", RETENTION_DAYS)))
+    refresh_night_windows(conn, today_str)
+    shard_count = int(ENV.get("WEATHER_SHARDS", 1))
+    if shard_count > 1:
+        counts = sharded_weather_stage(conn, context, shard_count, issued_at,
+                                       today_str, week_str)
+        counts["nights_added"] = refresh_missing_nights(conn, today_str)
+        logging.info("Weather data uploaded by %s shards: %s inserted, %s updated, "
+                     "%s unchanged, %s pruned",
+                     counts["shards"], counts["inserted"], counts["updated"],
+                     counts["unchanged"], counts["pruned"])
+        return counts
+
+    open_meteo = (get_resource("openmeteo", get_openmeteo)
+                  if ENV.get("WEATHER_CACHE") == "true" else None)
+    locations = get_locations(conn)
+    counts = handle_locations_streaming(
+        locations, conn, today_str, week_str, open_meteo,
+        issued_at=issued_at, deadline=get_extract_deadline(context),
+        **get_weather_options())
+    counts["nights_added"] = refresh_missing_nights(conn, today_str)
+    logging.info("Weather data uploaded to database: %s inserted, %s updated, %s unchanged, "
+                 "%s pruned, %s archived",
+                 counts["inserted"], counts["updated"], counts["unchanged"], counts["pruned"],
+                 counts["archived"])
+    return counts
 
-    conn.close()
-    return {"statusCode": 200}
+
+def lambda_handler(event, context):
+    """Runs one shard when invoked as a weather worker, otherwise the aurora and weather
+    stages side by side, returning their combined status."""
+    load_dotenv()
+    invocation = start_invocation()
+    reset_records()
+    if event and "shard" in event:
+        # A worker invoked by a sharded coordinator.
+        result = run_shard(event, get_extract_deadline(context))
+        result.update(invocation)
+        return result
+    result = run_stages({"aurora": aurora_stage,
+                         "weather": lambda conn: weather_stage(conn, context)})
+    result.update(invocation)
+    if ENV.get("METRICS_SUMMARY") == "true":
+        logging.info("Stage summary\n%s", format_summary())
+    return result
 
 
 if __name__ == "__main__":
     configure_logs()
     lambda_handler(None, None)
+    print(format_summary())
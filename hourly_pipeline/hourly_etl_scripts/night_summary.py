@@ -0,0 +1,110 @@
+"""Keeps night_summary, one row per city and night with the minimum, mean and maximum
+weather over the dark window from sunset to the next sunrise. Only nights whose hours
+changed are recomputed, so readers never have to aggregate weather_status themselves.
+Each night's dark window is stored as a range in night_window, so every weather hour
+maps to at most one night through a GiST index rather than a join on city_id alone."""
+from os import environ as ENV
+
+from stargazing_score import TIMEZONE
+
+SUMMARY_TABLE = "night_summary"
+WINDOW_TABLE = "night_window"
+SUMMARY_METRICS = ["coverage", "visibility", "temperature"]
+
+
+def refresh_night_windows(connection, window_start: str) -> int:
+    """Stores the dark window of every night from the day before the window start,
+    from that day's sunset to the next day's sunrise, returning how many were written.
+    Without the next day's sunrise yet, the night ends a day after that day's sunrise.
+    Sun times are stored in local time, so the window is converted to UTC to match
+    the weather hours it is compared with."""
+    curs = connection.cursor()
+    curs.execute(f"""
+        INSERT INTO {WINDOW_TABLE} (city_id, night_date, dark)
+        SELECT dusk.city_id, dusk.status_date,
+            TSRANGE(dusk.sunset AT TIME ZONE %(zone)s AT TIME ZONE 'UTC',
+                    COALESCE(dawn.sunrise, dusk.sunrise + INTERVAL '1 day')
+                    AT TIME ZONE %(zone)s AT TIME ZONE 'UTC', '[)')
+        FROM (
+            SELECT DISTINCT ON (city_id, status_date) city_id, status_date, sunrise, sunset
+            FROM stargazing_status
+            WHERE status_date >= %(window_start)s::date - 1
+            ORDER BY city_id, status_date, stargazing_status_id DESC) AS dusk
+        LEFT JOIN LATERAL (
+            SELECT sunrise FROM stargazing_status
+            WHERE city_id = dusk.city_id AND status_date = dusk.status_date + 1
+            ORDER BY stargazing_status_id DESC LIMIT 1) AS dawn ON TRUE
+        ON CONFLICT (city_id, night_date)
+        DO UPDATE SET dark = EXCLUDED.dark
+        WHERE {WINDOW_TABLE}.dark IS DISTINCT FROM EXCLUDED.dark;
+        """, {"zone": ENV.get("SUN_TIMEZONE", TIMEZONE), "window_start": window_start})
+    written = curs.rowcount
+    connection.commit()
+    curs.close()
+    return written
+
+
+def summary_query(source: str) -> str:
+    """Returns a statement recomputing the nights selected by source,
+    a query returning city_id and night_date."""
+    aggregates = ",\n            ".join(
+        f"MIN(w.{metric}), AVG(w.{metric}), MAX(w.{metric})" for metric in SUMMARY_METRICS)
+    columns = ", ".join(f"min_{metric}, avg_{metric}, max_{metric}" for metric in SUMMARY_METRICS)
+    updates = ",\n            ".join(
+        f"{prefix}_{metric} = EXCLUDED.{prefix}_{metric}"
+        for metric in SUMMARY_METRICS for prefix in ("min", "avg", "max"))
+    return f"""
+        INSERT INTO {SUMMARY_TABLE} (
+            city_id, night_date, dusk, dawn, hours, {columns}, updated_at)
+        SELECT nw.city_id, nw.night_date, LOWER(nw.dark), UPPER(nw.dark), COUNT(*),
+            {aggregates},
+            NOW()
+        FROM ({source}) AS n
+        JOIN {WINDOW_TABLE} AS nw
+        ON nw.city_id = n.city_id AND nw.night_date = n.night_date
+        JOIN weather_status AS w
+        ON w.city_id = nw.city_id AND nw.dark @> w.status_at
+        GROUP BY nw.city_id, nw.night_date, nw.dark
+        HAVING MIN(w.status_at) < LOWER(nw.dark) + INTERVAL '1 hour'
+        ON CONFLICT (city_id, night_date)
+        DO UPDATE SET
+            dusk = EXCLUDED.dusk,
+            dawn = EXCLUDED.dawn,
+            hours = EXCLUDED.hours,
+            {updates},
+            updated_at = EXCLUDED.updated_at;
+        """
+
+
+def refresh_nights(curs, written: list) -> int:
+    """Recomputes, without committing, the summaries of the nights holding the given
+    (city_id, status_at) hours, returning how many were written. Daylight hours and
+    nights with no window yet are skipped, and nights whose first hours have already
+    been pruned are left as they were."""
+    if not written:
+        return 0
+    curs.execute(summary_query(f"""
+            SELECT DISTINCT nw.city_id, nw.night_date
+            FROM UNNEST(%s::smallint[], %s::timestamp[]) AS h(city_id, status_at)
+            JOIN {WINDOW_TABLE} AS nw
+            ON nw.city_id = h.city_id AND nw.dark @> h.status_at"""),
+        ([row[0] for row in written], [row[1] for row in written]))
+    return curs.rowcount
+
+
+def refresh_missing_nights(connection, window_start: str) -> int:
+    """Summarises nights from the window start whose window was stored after
+    their weather last changed, so they are not left out until their hours change again."""
+    curs = connection.cursor()
+    curs.execute(summary_query(f"""
+            SELECT nw.city_id, nw.night_date
+            FROM {WINDOW_TABLE} AS nw
+            WHERE nw.night_date >= %s
+            AND NOT EXISTS (
+                SELECT 1 FROM {SUMMARY_TABLE} AS s
+                WHERE s.city_id = nw.city_id AND s.night_date = nw.night_date)"""),
+        (window_start,))
+    refreshed = curs.rowcount
+    connection.commit()
+    curs.close()
+    return refreshed
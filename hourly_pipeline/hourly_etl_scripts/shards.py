@@ -0,0 +1,225 @@
+"""Splits the city table into shards so the weather stage can fan out to parallel workers.
+Workers are a local process pool or separate lambda invocations, and each shard's outcome
+is recorded in weather_shard_run so failed shards can be retried."""
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+import json
+import logging
+import multiprocessing
+
+from aurora_status import get_connection
+from lambda_resources import reuse_connection
+from weather_stream import handle_locations_streaming
+from weather_extract import prune_weather
+
+SHARD_STRATEGIES = ("range", "hash")
+COUNT_KEYS = ("inserted", "updated", "unchanged", "archived", "nights", "batches")
+
+
+def make_shards(city_ids: list[int], count: int, strategy: str = "range") -> list[dict]:
+    """Splits cities into shards, either by contiguous city_id ranges or by city_id modulo count."""
+    if count < 1:
+        raise ValueError("Shard count must be at least 1")
+    if strategy not in SHARD_STRATEGIES:
+        raise ValueError(f"Unknown shard strategy {strategy}")
+    if strategy == "hash":
+        return [{"index": i, "count": count, "strategy": strategy,
+                 "first_id": None, "last_id": None} for i in range(count)]
+
+    ids = sorted(city_ids)
+    size, extra = divmod(len(ids), count)
+    shards, start = [], 0
+    for i in range(count):
+        end = start + size + (1 if i < extra else 0)
+        if end > start:
+            shards.append({"index": len(shards), "count": count, "strategy": strategy,
+                           "first_id": ids[start], "last_id": ids[end - 1]})
+        start = end
+    for shard in shards:
+        shard["count"] = len(shards)
+    return shards
+
+
+def get_city_ids(connection) -> list[int]:
+    """Returns every city_id."""
+    curs = connection.cursor()
+    curs.execute("SELECT city_id FROM city ORDER BY city_id;")
+    ids = [row[0] for row in curs.fetchall()]
+    curs.close()
+    return ids
+
+
+def get_shard_locations(connection, shard: dict) -> list:
+    """Returns the city rows belonging to a shard."""
+    curs = connection.cursor()
+    if shard["strategy"] == "hash":
+        curs.execute("SELECT * FROM city WHERE city_id %% %s = %s ORDER BY city_id;",
+                     (shard["count"], shard["index"]))
+    else:
+        curs.execute("SELECT * FROM city WHERE city_id BETWEEN %s AND %s ORDER BY city_id;",
+                     (shard["first_id"], shard["last_id"]))
+    locations = curs.fetchall()
+    curs.close()
+    return locations
+
+
+def record_shards(connection, issued_at: datetime, shards: list[dict]) -> None:
+    """Marks each shard of a run as pending, counting another attempt if it ran before."""
+    curs = connection.cursor()
+    for shard in shards:
+        curs.execute("""
+            INSERT INTO weather_shard_run (
+                issued_at, shard_index, shard_count, strategy, first_id, last_id,
+                status, attempts, updated_at)
+            VALUES (%s, %s, %s, %s, %s, %s, 'pending', 1, NOW())
+            ON CONFLICT (issued_at, shard_index)
+            DO UPDATE SET
+                status = 'pending',
+                attempts = weather_shard_run.attempts + 1,
+                error = NULL,
+                updated_at = NOW();
+            """, (issued_at, shard["index"], shard["count"], shard["strategy"],
+                  shard["first_id"], shard["last_id"]))
+    connection.commit()
+    curs.close()
+
+
+def set_shard_status(connection, issued_at: datetime, index: int, status: str,
+                     error: str = None) -> None:
+    """Records whether a shard succeeded or failed."""
+    curs = connection.cursor()
+    curs.execute("""
+        UPDATE weather_shard_run
+        SET status = %s, error = %s, updated_at = NOW()
+        WHERE issued_at = %s AND shard_index = %s;
+        """, (status, error, issued_at, index))
+    connection.commit()
+    curs.close()
+
+
+def get_failed_shards(connection, issued_at: datetime) -> list[dict]:
+    """Returns the shards of a run that failed or never reported back."""
+    curs = connection.cursor()
+    curs.execute("""
+        SELECT shard_index, shard_count, strategy, first_id, last_id
+        FROM weather_shard_run
+        WHERE issued_at = %s AND status <> 'succeeded'
+        ORDER BY shard_index;
+        """, (issued_at,))
+    shards = [{"index": row[0], "count": row[1], "strategy": row[2],
+               "first_id": row[3], "last_id": row[4]} for row in curs.fetchall()]
+    curs.close()
+    return shards
+
+
+def make_payload(shard: dict, issued_at: datetime, today: str, week_away: str,
+                 options: dict) -> dict:
+    """Returns the JSON event a worker needs to load one shard."""
+    return {"shard": shard, "issued_at": issued_at.isoformat(),
+            "today": today, "week_away": week_away, "options": options}
+
+
+def run_shard(payload: dict, deadline: float = None) -> dict:
+    """Loads the weather for one shard. Old hours are left for the coordinator to prune.
+    The extract deadline is the shorter of the coordinator's and the worker's own, so
+    the worker finishes while the coordinator is still waiting for it.
+    Never raises, so a failure is reported back to the coordinator instead."""
+    shard = payload["shard"]
+    try:
+        conn = reuse_connection(get_connection, "weather")
+        locations = get_shard_locations(conn, shard)
+        options = dict(payload.get("options", {}))
+        if deadline is not None:
+            options["deadline"] = min(deadline, options.get("deadline", deadline))
+        counts = handle_locations_streaming(
+            locations, conn, payload["today"], payload["week_away"],
+            issued_at=datetime.fromisoformat(payload["issued_at"]), prune=False, **options)
+        return {"index": shard["index"], "status": "succeeded",
+                "locations": len(locations), "counts": counts}
+    except Exception as err:
+        logging.exception("Weather shard %s failed", shard["index"])
+        return {"index": shard["index"], "status": "failed", "error": str(err)}
+
+
+def process_pool_dispatcher(max_workers: int = None):
+    """Returns a dispatcher that runs each shard in a local worker process.
+    Workers are spawned rather than forked so none inherit an open connection."""
+    def dispatch(payloads: list[dict]) -> list[dict]:
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=max_workers or len(payloads),
+                                 mp_context=context) as executor:
+            return list(executor.map(run_shard, payloads))
+    return dispatch
+
+
+def lambda_dispatcher(lambda_client, function_name: str):
+    """Returns a dispatcher that invokes a worker lambda for each shard and waits for them all."""
+    def invoke(payload: dict) -> dict:
+        try:
+            response = lambda_client.invoke(FunctionName=function_name,
+                                            InvocationType="RequestResponse",
+                                            Payload=json.dumps(payload).encode("utf-8"))
+            result = json.loads(response["Payload"].read())
+            if "FunctionError" in response:
+                return {"index": payload["shard"]["index"], "status": "failed",
+                        "error": result.get("errorMessage", response["FunctionError"])}
+            return result
+        except Exception as err:
+            logging.exception("Could not invoke weather shard %s", payload["shard"]["index"])
+            return {"index": payload["shard"]["index"], "status": "failed", "error": str(err)}
+
+    def dispatch(payloads: list[dict]) -> list[dict]:
+        with ThreadPoolExecutor(max_workers=len(payloads)) as executor:
+            return list(executor.map(invoke, payloads))
+    return dispatch
+
+
+def merge_results(connection, issued_at: datetime, results: list[dict]) -> dict:
+    """Records each shard's outcome and sums the counts of those that succeeded."""
+    totals = {key: 0 for key in COUNT_KEYS}
+    totals["failed_shards"] = []
+    for result in results:
+        set_shard_status(connection, issued_at, result["index"], result["status"],
+                         result.get("error"))
+        if result["status"] != "succeeded":
+            totals["failed_shards"].append(result["index"])
+            continue
+        for key in COUNT_KEYS:
+            totals[key] += result["counts"].get(key, 0)
+    return totals
+
+
+def dispatch_shards(connection, dispatch, shards: list[dict], issued_at: datetime,
+                    today: str, week_away: str, options: dict) -> dict:
+    """Dispatches shards, merges their results and prunes old hours once all have loaded."""
+    if not shards:
+        return {**{key: 0 for key in COUNT_KEYS}, "failed_shards": [], "shards": 0,
+                "pruned": 0}
+    record_shards(connection, issued_at, shards)
+    results = dispatch([make_payload(shard, issued_at, today, week_away, options)
+                        for shard in shards])
+    totals = merge_results(connection, issued_at, results)
+    totals["shards"] = len(shards)
+    totals["pruned"] = 0
+    if not totals["failed_shards"]:
+        totals["pruned"] = prune_weather(connection, today)
+    else:
+        logging.warning("Weather shards %s failed, old hours were not pruned",
+                        totals["failed_shards"])
+    return totals
+
+
+def run_sharded(connection, dispatch, count: int, issued_at: datetime, today: str,
+                week_away: str, strategy: str = "range", options: dict = None) -> dict:
+    """Splits the cities into shards and loads them in parallel.
+    Upserts are idempotent, so a shard that is retried never duplicates rows."""
+    shards = make_shards(get_city_ids(connection), count, strategy)
+    return dispatch_shards(connection, dispatch, shards, issued_at, today, week_away,
+                           options or {})
+
+
+def retry_failed_shards(connection, dispatch, issued_at: datetime, today: str,
+                        week_away: str, options: dict = None) -> dict:
+    """Runs the shards of an earlier run that did not succeed again."""
+    return dispatch_shards(connection, dispatch, get_failed_shards(connection, issued_at),
+                           issued_at, today, week_away, options or {})
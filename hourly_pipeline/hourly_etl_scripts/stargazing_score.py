@@ -0,0 +1,181 @@
+"""Scores how good every forecast hour is for stargazing, from 0 (hopeless) to 100.
+The score is computed once per run with numpy and stored in weather_status, so readers
+look it up instead of re-deriving it from coverage and visibility."""
+from datetime import datetime
+from os import environ as ENV
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+SCORE_COLUMN = "stargazing_score"
+# Sunrise and sunset are stored in the cities' local time, and weather hours in UTC.
+TIMEZONE = "Europe/London"
+# Visibility, in metres, beyond which haze no longer matters.
+CLEAR_VISIBILITY = 20000
+# Minutes after sunset or before sunrise until the sky is fully dark.
+TWILIGHT_MINUTES = 90
+# Darkness used for hours with no sunrise and sunset loaded yet.
+UNKNOWN_DARKNESS = 0.5
+# How much a full moon takes off the score.
+MOON_WEIGHT = 0.5
+# How much an aurora visible to the naked eye adds to the score.
+AURORA_WEIGHT = 0.5
+AURORA_LEVELS = {"naked_eye": 1.0, "camera": 0.5}
+# Hours either side of an aurora status for which it still counts.
+AURORA_HOURS = 3
+SYNODIC_MONTH_DAYS = 29.530588853
+KNOWN_NEW_MOON = np.datetime64("2000-01-06T18:14", "s")
+
+
+def get_moon_illumination(status_at: np.ndarray) -> np.ndarray:
+    """Returns the lit fraction of the moon at each time, from its mean synodic phase.
+    Only used for days loaded before the daily pipeline stored the moon's illumination."""
+    days = (status_at.astype("datetime64[s]") - KNOWN_NEW_MOON).astype(np.float64) / 86400
+    phase = 2 * np.pi * (days % SYNODIC_MONTH_DAYS) / SYNODIC_MONTH_DAYS
+    return (1 - np.cos(phase)) / 2
+
+
+def to_utc(times: np.ndarray, days: np.ndarray, timezone: str = None) -> np.ndarray:
+    """Shifts naive local times to naive UTC, using each day's offset at noon."""
+    zone = ZoneInfo(timezone or ENV.get("SUN_TIMEZONE", TIMEZONE))
+    days = days.astype("datetime64[D]")
+    offsets = {day: int(zone.utcoffset(datetime.fromisoformat(f"{day}T12:00")).total_seconds())
+               for day in np.unique(days)}
+    shift = np.array([offsets[day] for day in days], dtype=np.int64)
+    return times.astype("datetime64[s]") - shift.astype("timedelta64[s]")
+
+
+def get_day_keys(city_ids: np.ndarray, days: np.ndarray) -> np.ndarray:
+    """Returns one sortable integer per city and day."""
+    return city_ids.astype(np.int64) * 100000 + days.astype("datetime64[D]").astype(np.int64)
+
+
+def find_days(status_at: np.ndarray, city_ids: np.ndarray, sun_times: dict) -> tuple:
+    """Returns the order that sorts the sun times, the position of each hour's city
+    and day in that order, and whether that day was found at all."""
+    sun_keys = get_day_keys(sun_times["city_id"], sun_times["status_date"])
+    order = np.argsort(sun_keys)
+    sun_keys = sun_keys[order]
+    keys = get_day_keys(city_ids, status_at)
+    index = np.minimum(np.searchsorted(sun_keys, keys), len(sun_keys) - 1)
+    return order, index, sun_keys[index] == keys
+
+
+def get_darkness(status_at: np.ndarray, city_ids: np.ndarray, sun_times: dict) -> np.ndarray:
+    """Returns 0 in daylight, rising to 1 once twilight has ended after sunset
+    or before it begins ahead of sunrise. The local sun times are compared in UTC."""
+    status_at = status_at.astype("datetime64[s]")
+    darkness = np.full(len(status_at), UNKNOWN_DARKNESS)
+    if not sun_times["city_id"].size or not status_at.size:
+        return darkness
+
+    order, index, found = find_days(status_at, city_ids, sun_times)
+    sunrise = to_utc(sun_times["sunrise"], sun_times["status_date"])[order][index]
+    sunset = to_utc(sun_times["sunset"], sun_times["status_date"])[order][index]
+    night = np.maximum(sunrise - status_at, status_at - sunset).astype(np.float64) / 60
+    return np.where(found, np.clip(night / TWILIGHT_MINUTES, 0, 1), darkness)
+
+
+def get_moonlight(status_at: np.ndarray, city_ids: np.ndarray, sun_times: dict) -> np.ndarray:
+    """Returns the moon's stored illumination while it is above the horizon and 0 while
+    it is below. Days without a moonrise or moonset count the moon as up all day, and
+    days with no illumination stored fall back to the mean synodic phase."""
+    status_at = status_at.astype("datetime64[s]")
+    moonlight = get_moon_illumination(status_at)
+    if not sun_times["city_id"].size or not status_at.size:
+        return moonlight
+
+    order, index, found = find_days(status_at, city_ids, sun_times)
+    illumination = sun_times["moon_illumination"][order][index]
+    moonrise = to_utc(sun_times["moonrise"], sun_times["status_date"])[order][index]
+    moonset = to_utc(sun_times["moonset"], sun_times["status_date"])[order][index]
+    has_rise, has_set = ~np.isnat(moonrise), ~np.isnat(moonset)
+    risen, not_set = status_at >= moonrise, status_at < moonset
+    # When the moon sets before it rises it is up at both ends of the day.
+    up = np.where(has_rise & has_set,
+                  np.where(moonrise < moonset, risen & not_set, risen | not_set),
+                  np.where(has_rise, risen, np.where(has_set, not_set, True)))
+    return np.where(found & ~np.isnan(illumination), illumination * up, moonlight)
+
+
+def get_aurora(status_at: np.ndarray, city_ids: np.ndarray, aurora: dict) -> np.ndarray:
+    """Returns each city's latest aurora level for the hours close to when it was observed."""
+    level = np.zeros(len(status_at))
+    for city_id, (observed_at, city_level) in aurora.items():
+        near = np.abs(status_at.astype("datetime64[s]") - np.datetime64(observed_at, "s"))
+        level[(city_ids == city_id) & (near <= np.timedelta64(AURORA_HOURS, "h"))] = city_level
+    return level
+
+
+def compute_scores(columns: dict, sun_times: dict, aurora: dict) -> np.ndarray:
+    """Returns the stargazing score of every hour.
+    Clear, dark hours with the moon down or dim score highest, and a visible aurora
+    raises the score."""
+    status_at = np.asarray(columns["status_at"]).astype("datetime64[s]")
+    city_ids = np.asarray(columns["city_id"])
+    coverage = np.nan_to_num(np.asarray(columns["coverage"], dtype=np.float64), nan=100)
+    visibility = np.nan_to_num(np.asarray(columns["visibility"], dtype=np.float64))
+
+    clear = np.clip(1 - coverage / 100, 0, 1)
+    clarity = np.clip(visibility / CLEAR_VISIBILITY, 0, 1)
+    sky = clear * clarity * get_darkness(status_at, city_ids, sun_times)
+    moon = 1 - MOON_WEIGHT * get_moonlight(status_at, city_ids, sun_times)
+    score = 100 * sky * (moon + AURORA_WEIGHT * get_aurora(status_at, city_ids, aurora))
+    return np.round(np.clip(score, 0, 100), 1).astype(np.float32)
+
+
+def get_sun_times(connection, city_ids: list[int], first_day, last_day) -> dict:
+    """Returns the sunrise, sunset, moon illumination, moonrise and moonset of each city
+    and day as numpy arrays. Missing moon values are NaN or NaT."""
+    curs = connection.cursor()
+    curs.execute("""
+        SELECT DISTINCT ON (city_id, status_date) city_id, status_date, sunrise, sunset,
+            moon_illumination, moonrise, moonset
+        FROM stargazing_status
+        WHERE city_id = ANY(%s) AND status_date BETWEEN %s AND %s
+        ORDER BY city_id, status_date, stargazing_status_id DESC;
+        """, (city_ids, first_day, last_day))
+    rows = curs.fetchall()
+    curs.close()
+    return {"city_id": np.array([row[0] for row in rows], dtype=np.int64),
+            "status_date": np.array([row[1] for row in rows], dtype="datetime64[D]"),
+            "sunrise": np.array([row[2] for row in rows], dtype="datetime64[s]"),
+            "sunset": np.array([row[3] for row in rows], dtype="datetime64[s]"),
+            "moon_illumination": np.array([row[4] for row in rows], dtype=np.float64),
+            "moonrise": np.array([row[5] for row in rows], dtype="datetime64[s]"),
+            "moonset": np.array([row[6] for row in rows], dtype="datetime64[s]")}
+
+
+def get_aurora_levels(connection, city_ids: list[int]) -> dict:
+    """Returns each city's latest aurora status time and level, leaving out cities with none."""
+    curs = connection.cursor()
+    curs.execute("""
+        SELECT DISTINCT ON (c.city_id)
+            c.city_id, a.aurora_status_at, a.naked_eye_visibility, a.camera_visibility
+        FROM aurora_status AS a
+        JOIN city AS c ON c.country_id = a.country_id
+        WHERE c.city_id = ANY(%s)
+        ORDER BY c.city_id, a.aurora_status_at DESC;
+        """, (city_ids,))
+    rows = curs.fetchall()
+    curs.close()
+    levels = {}
+    for city_id, observed_at, naked_eye, camera in rows:
+        if naked_eye:
+            levels[city_id] = (observed_at, AURORA_LEVELS["naked_eye"])
+        elif camera:
+            levels[city_id] = (observed_at, AURORA_LEVELS["camera"])
+    return levels
+
+
+def add_scores(columns: dict, connection) -> dict:
+    """Returns the columns with the stargazing score of every hour added."""
+    status_at = np.asarray(columns["status_at"]).astype("datetime64[s]")
+    if not status_at.size:
+        return {**columns, SCORE_COLUMN: np.array([], dtype=np.float32)}
+    city_ids = np.unique(np.asarray(columns["city_id"])).tolist()
+    days = status_at.astype("datetime64[D]")
+    sun_times = get_sun_times(connection, city_ids,
+                              str(days.min()), str(days.max()))
+    aurora = get_aurora_levels(connection, city_ids)
+    return {**columns, SCORE_COLUMN: compute_scores(columns, sun_times, aurora)}
@@ -0,0 +1,170 @@
+# pylint: skip-file
+import asyncio
+import unittest
+from unittest.mock import patch, MagicMock
+
+import numpy as np
+import pandas as pd
+
+from async_extract import get_params, decode_responses, fetch_with_retries, stream_weather, extract_weather, extract_weather_columns, RetryableStatusError
+
+LOCATIONS = [(1, 'a', 1, 50.1, -1.1), (2, 'b', 1, 52.2, -2.2),
+             (3, 'c', 2, 55.3, -3.3)]
+
+
+def fake_response(city_id):
+    response = MagicMock()
+    response.Hourly.return_value = city_id
+    return response
+
+
+def fake_fetcher(calls=None):
+    async def fetch(params):
+        if calls is not None:
+            calls.append(params)
+        return [fake_response(float(lat)) for lat in params["latitude"].split(",")]
+    return fetch
+
+
+class TestGetParams(unittest.TestCase):
+    def test_get_params(self):
+        params = get_params("2025-02-10", "2025-02-17", LOCATIONS[:2])
+        self.assertEqual(params["latitude"], "50.1,52.2")
+        self.assertEqual(params["longitude"], "-1.1,-2.2")
+        self.assertEqual(params["hourly"],
+                         "temperature_2m,cloud_cover,visibility")
+        self.assertEqual(params["format"], "flatbuffers")
+
+
+class TestDecodeResponses(unittest.TestCase):
+    def test_decode_empty(self):
+        self.assertEqual(decode_responses(b""), [])
+
+    def test_decode_stream_error(self):
+        with self.assertRaises(ValueError):
+            decode_responses(b"Unexpected error while streaming")
+
+
+class TestFetchWithRetries(unittest.IsolatedAsyncioTestCase):
+    async def test_retries_then_succeeds(self):
+        attempts = []
+
+        async def flaky(params):
+            attempts.append(params)
+            if len(attempts) < 3:
+                raise RetryableStatusError("429")
+            return ["ok"]
+
+        result = await fetch_with_retries(flaky, {}, asyncio.Semaphore(1),
+                                          retries=3, backoff=0)
+        self.assertEqual(result, ["ok"])
+        self.assertEqual(len(attempts), 3)
+
+    async def test_gives_up_after_retries(self):
+        async def failing(params):
+            raise RetryableStatusError("503")
+
+        with self.assertRaises(RetryableStatusError):
+            await fetch_with_retries(failing, {}, asyncio.Semaphore(1),
+                                     retries=2, backoff=0)
+
+    async def test_does_not_retry_other_errors(self):
+        attempts = []
+
+        async def broken(params):
+            attempts.append(params)
+            raise KeyError("bad")
+
+        with self.assertRaises(KeyError):
+            await fetch_with_retries(broken, {}, asyncio.Semaphore(1),
+                                     retries=2, backoff=0)
+        self.assertEqual(len(attempts), 1)
+
+
+class TestStreamWeather(unittest.IsolatedAsyncioTestCase):
+    async def test_streams_every_location(self):
+        calls = []
+        results = [item async for item in stream_weather(
+            LOCATIONS, fake_fetcher(calls), "2025-02-10", "2025-02-17", batch_size=2)]
+
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(sorted(results),
+                         [(1, 50.1), (2, 52.2), (3, 55.3)])
+
+    async def test_outstanding_batches_are_bounded(self):
+        locations = [(i, 'x', 1, 50.0 + i / 100, -1.0) for i in range(40)]
+        outstanding, peak = [0], [0]
+
+        async def fetch(params):
+            outstanding[0] += 1
+            peak[0] = max(peak[0], outstanding[0])
+            await asyncio.sleep(0)
+            return [fake_response(0) for _ in params["latitude"].split(",")]
+
+        count = 0
+        async for _ in stream_weather(locations, fetch, "2025-02-10", "2025-02-17",
+                                      batch_size=2, concurrency=3):
+            count += 1
+            if count % 2 == 0:
+                # A batch is only finished with once all its locations are consumed.
+                outstanding[0] -= 1
+            await asyncio.sleep(0.001)
+
+        self.assertEqual(count, 40)
+        self.assertLessEqual(peak[0], 4)
+
+    async def test_deadline_exceeded(self):
+        async def slow(params):
+            await asyncio.sleep(1)
+            return []
+
+        with self.assertRaises(TimeoutError):
+            async for _ in stream_weather(LOCATIONS, slow, "2025-02-10",
+                                          "2025-02-17", deadline=0.01):
+                pass
+
+
+class TestExtractWeather(unittest.IsolatedAsyncioTestCase):
+    @patch("async_extract.get_dataframe")
+    @patch("async_extract.asyncio.to_thread")
+    async def test_extract_with_openmeteo_client(self, mock_to_thread, mock_get_dataframe):
+        async def to_thread(func, url, params):
+            return func(url, params=params)
+        mock_to_thread.side_effect = to_thread
+        openmeteo = MagicMock()
+        openmeteo.weather_api.side_effect = lambda url, params: [
+            fake_response(1) for _ in params["latitude"].split(",")]
+        mock_get_dataframe.side_effect = lambda hourly: pd.DataFrame(
+            {'temperature_2m': [1.0, 2.0]})
+
+        df = await extract_weather(LOCATIONS, "2025-02-10", "2025-02-17",
+                                   openmeteo, batch_size=2)
+
+        self.assertEqual(openmeteo.weather_api.call_count, 2)
+        self.assertEqual(sorted(df['city_id'].unique()), [1, 2, 3])
+        self.assertEqual(len(df), 6)
+
+    @patch("async_extract.get_weather_columns")
+    @patch("async_extract.asyncio.to_thread")
+    async def test_extract_weather_columns(self, mock_to_thread, mock_get_columns):
+        async def to_thread(func, url, params):
+            return func(url, params=params)
+        mock_to_thread.side_effect = to_thread
+        openmeteo = MagicMock()
+        openmeteo.weather_api.side_effect = lambda url, params: [
+            fake_response(float(lat)) for lat in params["latitude"].split(",")]
+        mock_get_columns.side_effect = lambda hourly: {
+            "status_at": np.array([0, 3600], dtype="datetime64[s]"),
+            "coverage": np.array([hourly, hourly])}
+
+        columns = await extract_weather_columns(LOCATIONS, "2025-02-10", "2025-02-17",
+                                                openmeteo, batch_size=2)
+
+        self.assertEqual(len(columns["city_id"]), 6)
+        by_city = dict(zip(columns["city_id"].tolist(),
+                           columns["coverage"].tolist()))
+        self.assertEqual(by_city, {1: 50.1, 2: 52.2, 3: 55.3})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,8 +1,9 @@
 # pylint: skip-file
 import unittest
+from datetime import datetime, timezone
 from unittest.mock import patch, MagicMock
 
-from aurora_status import get_status_per_country, get_current_aurora_data
+from aurora_status import get_status_per_country, get_current_aurora_data, update_aurora_status, get_conditional_headers, insert_values_to_db, get_visibility_rules, VISIBILITY_RULES
 
 SAMPLE_STATUS_GREEN = {'last_updated': '2025-02-12T10:24:32+0000',
                        'current_status': 'green'}
@@ -72,3 +73,124 @@ class TestAurora_status(unittest.TestCase):
         self.assertEqual(response, SAMPLE_STATUS_RED)
         mock_get.assert_called_once_with(
             "https://aurorawatch-api.lancs.ac.uk/0.2/status/current-status.xml", timeout=10)
+
+
+def aurora_response(status_code=200, text=SAMPLE_AURORA_XML_GREEN):
+    response = MagicMock()
+    response.status_code = status_code
+    response.text = text
+    response.headers = {"ETag": '"abc"',
+                        "Last-Modified": "Wed, 12 Feb 2025 10:24:32 GMT"}
+    return response
+
+
+@patch("aurora_status.insert_values_to_db")
+@patch("aurora_status.save_fetch_state")
+@patch("aurora_status.get_visibility_rules", return_value=None)
+@patch("aurora_status.get_country_dict", return_value=SAMPLE_COUNTRY)
+@patch("aurora_status.get_fetch_state")
+@patch("aurora_status.requests.get")
+class TestUpdateAuroraStatus(unittest.TestCase):
+    def test_not_modified_skips(self, mock_get, mock_state, mock_countries, mock_rules, mock_save, mock_insert):
+        mock_state.return_value = {"etag": '"abc"', "last_modified": None,
+                                   "last_updated": None}
+        mock_get.return_value = aurora_response(304, "")
+
+        result = update_aurora_status(MagicMock())
+
+        self.assertEqual(result, {"skipped": True, "reason": "not_modified"})
+        self.assertEqual(mock_get.call_args.kwargs["headers"], {"If-None-Match": '"abc"'})
+        mock_countries.assert_not_called()
+        mock_insert.assert_not_called()
+
+    def test_same_update_skips(self, mock_get, mock_state, mock_countries, mock_rules, mock_save, mock_insert):
+        mock_state.return_value = {
+            "etag": None, "last_modified": None,
+            "last_updated": datetime(2025, 2, 12, 10, 24, 32, tzinfo=timezone.utc)}
+        mock_get.return_value = aurora_response()
+
+        result = update_aurora_status(MagicMock())
+
+        self.assertEqual(result["reason"], "same_update")
+        mock_insert.assert_not_called()
+        mock_save.assert_not_called()
+
+    def test_new_update_loads(self, mock_get, mock_state, mock_countries, mock_rules, mock_save, mock_insert):
+        mock_state.return_value = {}
+        mock_get.return_value = aurora_response()
+        conn = MagicMock()
+
+        result = update_aurora_status(conn)
+
+        self.assertFalse(result["skipped"])
+        mock_insert.assert_called_once_with(conn, SAMPLE_OUTPUT_GREEN)
+        mock_save.assert_called_once_with(
+            conn, '"abc"', "Wed, 12 Feb 2025 10:24:32 GMT",
+            datetime(2025, 2, 12, 10, 24, 32, tzinfo=timezone.utc))
+
+
+class TestConditionalHeaders(unittest.TestCase):
+    def test_no_state(self):
+        self.assertEqual(get_conditional_headers({}), {})
+
+
+
+@patch("aurora_status.execute_values")
+class TestInsertValuesToDb(unittest.TestCase):
+    def test_one_statement_one_commit(self, mock_execute_values):
+        conn = MagicMock()
+        insert_values_to_db(conn, SAMPLE_OUTPUT_GREEN)
+
+        mock_execute_values.assert_called_once()
+        self.assertEqual(mock_execute_values.call_args.args[2], SAMPLE_OUTPUT_GREEN)
+        self.assertEqual(mock_execute_values.call_args.kwargs["page_size"], 4)
+        conn.commit.assert_called_once()
+
+    def test_rolls_back(self, mock_execute_values):
+        mock_execute_values.side_effect = Exception("failed")
+        conn = MagicMock()
+        with self.assertRaises(Exception):
+            insert_values_to_db(conn, SAMPLE_OUTPUT_GREEN)
+        conn.rollback.assert_called_once()
+        conn.commit.assert_not_called()
+
+    def test_nothing_to_insert(self, mock_execute_values):
+        conn = MagicMock()
+        self.assertEqual(insert_values_to_db(conn, []), 0)
+        conn.commit.assert_not_called()
+
+
+class TestVisibilityRules(unittest.TestCase):
+    def setUp(self):
+        VISIBILITY_RULES.clear()
+
+    def tearDown(self):
+        VISIBILITY_RULES.clear()
+
+    @patch("aurora_status.query_db")
+    def test_loaded_once(self, mock_query):
+        mock_query.return_value = [("green", "England", False, False),
+                                   ("green", "Cornwall", True, False)]
+        conn = MagicMock()
+
+        get_visibility_rules(conn)
+        rules = get_visibility_rules(conn)
+
+        mock_query.assert_called_once()
+        self.assertEqual(rules, {"green": [("England", False, False),
+                                           ("Cornwall", True, False)]})
+
+    @patch("aurora_status.query_db", return_value=[])
+    def test_defaults_when_unseeded(self, mock_query):
+        rules = get_visibility_rules(MagicMock())
+        self.assertEqual(len(rules["amber"]), 4)
+
+    def test_new_region_without_code(self):
+        rules = {"red": [("Highlands", True, True)]}
+        self.assertEqual(get_status_per_country(SAMPLE_STATUS_RED, {"Highlands": 9}, rules),
+                         [(9, '2025-02-12T10:24:32+0000', True, True)])
+
+    def test_unknown_status(self):
+        with self.assertRaises(ValueError):
+            get_status_per_country({"last_updated": "", "current_status": "blue"},
+                                   SAMPLE_COUNTRY)
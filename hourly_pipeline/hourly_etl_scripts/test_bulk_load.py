@@ -0,0 +1,162 @@
+# pylint: skip-file
+import struct
+import unittest
+from datetime import datetime, timezone
+from pathlib import Path
+from unittest.mock import MagicMock
+
+import numpy as np
+
+from bulk_load import RowStream, format_text_value, encode_text_rows, encode_binary_rows, merge_query, copy_merge, bulk_load, encode_binary_columns, BINARY_HEADER
+
+
+class TestRowStream(unittest.TestCase):
+    def test_read_in_sizes(self):
+        stream = RowStream([b"abc", b"defg", b"h"])
+        self.assertEqual(stream.read(2), b"ab")
+        self.assertEqual(stream.read(4), b"cdef")
+        self.assertEqual(stream.read(), b"gh")
+        self.assertEqual(stream.read(5), b"")
+        self.assertEqual(stream.bytes_read, 8)
+
+
+class TestFormatTextValue(unittest.TestCase):
+    def test_null_and_bool(self):
+        self.assertEqual(format_text_value(None), "\\N")
+        self.assertEqual(format_text_value(True), "t")
+
+    def test_escapes(self):
+        self.assertEqual(format_text_value("a\tb\nc\\"), "a\\tb\\nc\\\\")
+
+    def test_aware_datetime_is_utc(self):
+        value = datetime(2025, 2, 10, 12, tzinfo=timezone.utc)
+        self.assertEqual(format_text_value(value), "2025-02-10 12:00:00")
+
+
+class TestEncodeRows(unittest.TestCase):
+    def test_encode_text_rows(self):
+        counter = [0]
+        chunks = list(encode_text_rows([(1, "a"), (2, None)], counter))
+        self.assertEqual(b"".join(chunks), b"1\ta\n2\t\\N\n")
+        self.assertEqual(counter, [2])
+
+    def test_encode_binary_rows(self):
+        counter = [0]
+        data = b"".join(encode_binary_rows(
+            [(3, 1.5, None)], ["smallint", "double precision", "text"], counter))
+        expected = (BINARY_HEADER + struct.pack(">h", 3)
+                    + struct.pack(">i", 2) + struct.pack(">h", 3)
+                    + struct.pack(">i", 8) + struct.pack(">d", 1.5)
+                    + struct.pack(">i", -1) + struct.pack(">h", -1))
+        self.assertEqual(data, expected)
+        self.assertEqual(counter, [1])
+
+    def test_encode_binary_timestamp(self):
+        data = b"".join(encode_binary_rows(
+            [(datetime(2000, 1, 2),)], ["timestamp without time zone"], [0]))
+        self.assertIn(struct.pack(">q", 86400 * 1000000), data)
+
+    def test_encode_binary_unsupported_type(self):
+        with self.assertRaises(ValueError):
+            list(encode_binary_rows([(1,)], ["json"], [0]))
+
+
+class TestEncodeBinaryColumns(unittest.TestCase):
+    def test_matches_row_encoding(self):
+        types = ["timestamp without time zone", "double precision", "smallint"]
+        columns = {"status_at": np.array(["2025-02-10T01:00", "2025-02-10T02:00"],
+                                         dtype="datetime64[s]"),
+                   "coverage": np.array([10.5, 20.0], dtype=np.float32),
+                   "city_id": np.array([3, 4], dtype=np.int16)}
+        rows = [(datetime(2025, 2, 10, 1), 10.5, 3),
+                (datetime(2025, 2, 10, 2), 20.0, 4)]
+        counter = [0]
+
+        columnar = b"".join(encode_binary_columns(
+            columns, ["status_at", "coverage", "city_id"], types, counter))
+
+        self.assertEqual(columnar, b"".join(encode_binary_rows(rows, types, [0])))
+        self.assertEqual(counter, [2])
+
+    def test_rejects_variable_width_types(self):
+        with self.assertRaises(ValueError):
+            list(encode_binary_columns({"name": np.array(["a"])}, ["name"],
+                                       ["text"], [0]))
+
+
+class TestMergeQuery(unittest.TestCase):
+    def test_plain_insert(self):
+        query = merge_query("city", "city_staging", ["city_name"])
+        self.assertNotIn("ON CONFLICT", query)
+
+    def test_do_nothing(self):
+        query = merge_query("aurora_status", "aurora_status_staging",
+                            ["country_id"], conflict=["country_id"])
+        self.assertIn("DO NOTHING", query)
+
+    def test_update_when_changed(self):
+        query = merge_query("weather_status", "weather_status_staging",
+                            ["city_id", "status_at", "coverage"],
+                            conflict=["city_id", "status_at"], update=["coverage"])
+        self.assertIn("coverage = EXCLUDED.coverage", query)
+        self.assertIn("IS DISTINCT FROM", query)
+
+    def test_returning_columns(self):
+        query = merge_query("weather_status", "weather_status_staging",
+                            ["city_id", "status_at"], returning=["city_id", "status_at"])
+        self.assertIn("RETURNING (xmax = 0) AS inserted, city_id, status_at;", query)
+
+
+class TestCopyMerge(unittest.TestCase):
+    def test_copy_merge_stats(self):
+        curs = MagicMock()
+        received = []
+        curs.copy_expert.side_effect = lambda sql, stream: received.append(
+            stream.read())
+        curs.fetchall.return_value = [(True,), (False,)]
+
+        stats = copy_merge(curs, "weather_status", ["city_id", "coverage"],
+                           [(1, 10.0), (2, 20.0), (3, 30.0)],
+                           conflict=["city_id"], update=["coverage"])
+
+        self.assertEqual(received, [b"1\t10.0\n2\t20.0\n3\t30.0\n"])
+        self.assertEqual(stats["rows"], 3)
+        self.assertEqual(stats["inserted"], 1)
+        self.assertEqual(stats["updated"], 1)
+        self.assertEqual(stats["unchanged"], 1)
+        self.assertEqual(stats["bytes"], len(received[0]))
+        self.assertNotIn("written", stats)
+
+    def test_copy_merge_returns_written_rows(self):
+        curs = MagicMock()
+        curs.fetchall.return_value = [(True, 1), (False, 2)]
+
+        stats = copy_merge(curs, "weather_status", ["city_id", "coverage"],
+                           [(1, 10.0), (2, 20.0)], conflict=["city_id"],
+                           update=["coverage"], returning=["city_id"])
+
+        self.assertEqual(stats["written"], [(1,), (2,)])
+        self.assertEqual(stats["inserted"], 1)
+
+    def test_bulk_load_rolls_back(self):
+        conn = MagicMock()
+        conn.cursor.return_value.copy_expert.side_effect = Exception("failed")
+        with self.assertRaises(Exception):
+            bulk_load(conn, "city", ["city_name"], [("London",)])
+        conn.rollback.assert_called_once()
+        conn.commit.assert_not_called()
+        conn.cursor.return_value.close.assert_called_once()
+
+
+
+class TestCopies(unittest.TestCase):
+    def test_copies_are_identical(self):
+        root = Path(__file__).resolve().parents[2]
+        source = Path(__file__).with_name("bulk_load.py").read_bytes()
+        for copy in ("daily_pipeline", "database/db_scripts"):
+            self.assertEqual((root / copy / "bulk_load.py").read_bytes(), source,
+                             f"{copy}/bulk_load.py differs from the hourly copy")
+
+
+if __name__ == "__main__":
+    unittest.main()
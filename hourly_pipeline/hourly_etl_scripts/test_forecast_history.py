@@ -0,0 +1,92 @@
+# pylint: skip-file
+import unittest
+from datetime import date, datetime
+from unittest.mock import patch, MagicMock
+
+import numpy as np
+
+from forecast_history import partition_bounds, partition_name, ensure_partitions, drop_expired_partitions, archive_forecast, get_forecasts_for_hour
+
+
+class TestPartitionBounds(unittest.TestCase):
+    def test_month(self):
+        self.assertEqual(partition_bounds(date(2025, 12, 15)),
+                         (date(2025, 12, 1), date(2026, 1, 1)))
+
+    def test_week(self):
+        self.assertEqual(partition_bounds(date(2025, 2, 12), "week"),
+                         (date(2025, 2, 10), date(2025, 2, 17)))
+
+    def test_unknown_interval(self):
+        with self.assertRaises(ValueError):
+            partition_bounds(date(2025, 2, 12), "year")
+
+
+class TestEnsurePartitions(unittest.TestCase):
+    def test_creates_current_and_next(self):
+        conn = MagicMock()
+        names = ensure_partitions(conn, datetime(2025, 1, 31, 23))
+
+        self.assertEqual(names, ["weather_forecast_history_20250101",
+                                 "weather_forecast_history_20250201"])
+        params = [call.args[1] for call in conn.cursor.return_value.execute.call_args_list]
+        self.assertEqual(params, [(date(2025, 1, 1), date(2025, 2, 1)),
+                                  (date(2025, 2, 1), date(2025, 3, 1))])
+        conn.commit.assert_called_once()
+
+
+class TestDropExpiredPartitions(unittest.TestCase):
+    def test_drops_only_expired(self):
+        conn = MagicMock()
+        conn.cursor.return_value.fetchall.return_value = [
+            (partition_name(date(2024, 1, 1)),),
+            (partition_name(date(2024, 2, 1)),),
+            (partition_name(date(2024, 3, 1)),),
+            ("weather_forecast_history_default",)]
+
+        dropped = drop_expired_partitions(conn, datetime(2024, 4, 15), retention_days=60)
+
+        self.assertEqual(dropped, ["weather_forecast_history_20240101"])
+
+
+@patch("forecast_history.copy_merge", return_value={"inserted": 2})
+class TestArchiveForecast(unittest.TestCase):
+    def test_adds_issue_time(self, mock_copy_merge):
+        columns = {"status_at": np.array(["2025-02-10T01", "2025-02-10T02"],
+                                         dtype="datetime64[s]"),
+                   "temperature": np.zeros(2), "coverage": np.zeros(2),
+                   "visibility": np.zeros(2), "city_id": np.array([3, 3])}
+        conn = MagicMock()
+
+        archive_forecast(columns, conn, datetime(2025, 2, 10, 0))
+
+        history = mock_copy_merge.call_args.args[3]
+        self.assertEqual(list(history["issued_at"]),
+                         [np.datetime64("2025-02-10T00:00:00")] * 2)
+        self.assertIs(history["valid_at"], columns["status_at"])
+        self.assertEqual(mock_copy_merge.call_args.kwargs["conflict"],
+                         ["city_id", "issued_at", "valid_at"])
+        conn.commit.assert_called_once()
+
+    def test_rolls_back(self, mock_copy_merge):
+        mock_copy_merge.side_effect = Exception("failed")
+        conn = MagicMock()
+        with self.assertRaises(Exception):
+            archive_forecast({"status_at": np.array([], dtype="datetime64[s]"),
+                              "temperature": [], "coverage": [], "visibility": [],
+                              "city_id": []}, conn, datetime(2025, 2, 10))
+        conn.rollback.assert_called_once()
+
+
+class TestQueries(unittest.TestCase):
+    def test_forecasts_for_hour_bound_issue_time(self):
+        conn = MagicMock()
+        get_forecasts_for_hour(conn, 3, datetime(2025, 2, 10, 21))
+
+        params = conn.cursor.return_value.execute.call_args.args[1]
+        self.assertEqual(params, (3, datetime(2025, 2, 10, 21), datetime(2025, 2, 2, 21),
+                                  datetime(2025, 2, 10, 21)))
+
+
+if __name__ == "__main__":
+    unittest.main()
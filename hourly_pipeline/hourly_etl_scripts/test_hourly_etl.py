@@ -0,0 +1,126 @@
+# pylint: skip-file
+import threading
+import unittest
+from unittest.mock import patch, MagicMock
+
+from hourly_etl import run_stages, get_extract_deadline, get_shard_dispatcher, sharded_weather_stage, DEADLINE, WORKER_TIMEOUT
+from lambda_resources import RESOURCES
+
+
+@patch("hourly_etl.get_connection")
+class TestRunStages(unittest.TestCase):
+    def setUp(self):
+        RESOURCES.clear()
+
+    def tearDown(self):
+        RESOURCES.clear()
+
+    def test_stages_overlap(self, mock_connection):
+        barrier = threading.Barrier(2, timeout=5)
+
+        def stage(conn):
+            barrier.wait()
+            return "done"
+
+        result = run_stages({"aurora": stage, "weather": stage})
+
+        self.assertEqual(result["statusCode"], 200)
+        self.assertEqual(result["stages"]["aurora"]["result"], "done")
+        self.assertIn("seconds", result["stages"]["weather"])
+
+    def test_separate_connections_reused_when_warm(self, mock_connection):
+        mock_connection.side_effect = lambda: MagicMock(closed=0)
+        seen = {"aurora": [], "weather": []}
+        stages = {"aurora": seen["aurora"].append, "weather": seen["weather"].append}
+
+        run_stages(stages)
+        run_stages(stages)
+
+        self.assertIsNot(seen["aurora"][0], seen["weather"][0])
+        self.assertIs(seen["aurora"][0], seen["aurora"][1])
+        self.assertEqual(mock_connection.call_count, 2)
+        seen["aurora"][0].close.assert_not_called()
+
+    def test_failure_reported(self, mock_connection):
+        def broken(conn):
+            raise ValueError("no weather")
+
+        result = run_stages({"aurora": lambda conn: None, "weather": broken})
+
+        self.assertEqual(result["statusCode"], 500)
+        self.assertEqual(result["stages"]["aurora"]["status"], "succeeded")
+        self.assertEqual(result["stages"]["weather"],
+                         {"status": "failed", "error": "no weather",
+                          "seconds": result["stages"]["weather"]["seconds"]})
+
+
+class TestGetExtractDeadline(unittest.TestCase):
+    def test_without_context(self):
+        self.assertEqual(get_extract_deadline(None), DEADLINE)
+
+    def test_leaves_load_margin(self):
+        context = MagicMock()
+        context.get_remaining_time_in_millis.return_value = 300000
+        self.assertEqual(get_extract_deadline(context), 210)
+
+
+
+class TestGetShardDispatcher(unittest.TestCase):
+    def setUp(self):
+        RESOURCES.clear()
+
+    def tearDown(self):
+        RESOURCES.clear()
+
+    @patch("hourly_etl.client")
+    def test_waits_for_worker_without_retrying(self, mock_client):
+        get_shard_dispatcher(MagicMock())
+
+        config = mock_client.call_args.kwargs["config"]
+        self.assertEqual(config.read_timeout, WORKER_TIMEOUT)
+        self.assertEqual(config.retries, {"max_attempts": 0})
+
+
+def shard_totals(failed, inserted=10):
+    return {"inserted": inserted, "updated": 0, "unchanged": 0, "archived": 0, "nights": 0,
+            "batches": 1, "failed_shards": failed, "shards": 2, "pruned": 0 if failed else 5}
+
+
+@patch("hourly_etl.get_shard_dispatcher")
+@patch("hourly_etl.retry_failed_shards")
+@patch("hourly_etl.run_sharded")
+class TestShardedWeatherStage(unittest.TestCase):
+    def setUp(self):
+        self.context = MagicMock()
+        self.context.get_remaining_time_in_millis.return_value = 300000
+
+    def test_workers_finish_before_coordinator(self, mock_run, mock_retry, mock_dispatcher):
+        mock_run.return_value = shard_totals([])
+
+        sharded_weather_stage(MagicMock(), self.context, 2, None, "", "")
+
+        self.assertEqual(mock_run.call_args.args[-1]["deadline"], 210)
+        mock_retry.assert_not_called()
+
+    def test_retries_failed_shards_once(self, mock_run, mock_retry, mock_dispatcher):
+        mock_run.return_value = shard_totals([1])
+        mock_retry.return_value = {**shard_totals([], inserted=4), "shards": 1}
+
+        counts = sharded_weather_stage(MagicMock(), self.context, 2, None, "", "")
+
+        mock_retry.assert_called_once()
+        self.assertEqual(counts["inserted"], 14)
+        self.assertEqual(counts["failed_shards"], [])
+        self.assertEqual(counts["pruned"], 5)
+
+    def test_raises_when_retry_fails(self, mock_run, mock_retry, mock_dispatcher):
+        mock_run.return_value = shard_totals([1])
+        mock_retry.return_value = {**shard_totals([1], inserted=0), "shards": 1}
+
+        with self.assertRaises(RuntimeError):
+            sharded_weather_stage(MagicMock(), self.context, 2, None, "", "")
+        mock_retry.assert_called_once()
+
+
+if __name__ == "__main__":
+    unittest.main()
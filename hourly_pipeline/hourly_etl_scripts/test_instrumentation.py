@@ -0,0 +1,88 @@
+# pylint: skip-file
+import asyncio
+import json
+import unittest
+from pathlib import Path
+
+from instrumentation import stage, timed, add_metric, reset_records, format_summary, RECORDS
+
+
+class TestStage(unittest.TestCase):
+    def setUp(self):
+        reset_records()
+
+    def test_records_counts(self):
+        with self.assertLogs(level="INFO") as logs:
+            with stage("load_weather") as metrics:
+                metrics["rows"] = 10
+                add_metric("retries")
+                add_metric("retries")
+
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record["stage"], "load_weather")
+        self.assertEqual(record["status"], "succeeded")
+        self.assertEqual(record["retries"], 2)
+        self.assertIn("rows_per_second", record)
+        self.assertGreater(record["peak_rss_mb"], 0)
+
+    def test_records_failures(self):
+        with self.assertRaises(ValueError):
+            with stage("extract_weather"):
+                raise ValueError("no weather")
+        self.assertEqual(RECORDS[0]["status"], "failed")
+
+    def test_metric_outside_stage_ignored(self):
+        add_metric("retries")
+        self.assertEqual(RECORDS, [])
+
+    def test_nested_stages(self):
+        with stage("outer"):
+            with stage("inner"):
+                add_metric("bytes_fetched", 5)
+            add_metric("bytes_fetched", 1)
+        self.assertEqual([(r["stage"], r["bytes_fetched"]) for r in RECORDS],
+                         [("inner", 5), ("outer", 1)])
+
+
+class TestTimed(unittest.TestCase):
+    def setUp(self):
+        reset_records()
+
+    def test_counts_rows_of_result(self):
+        @timed(rows=len)
+        def get_cities():
+            return ["London", "York"]
+
+        self.assertEqual(get_cities(), ["London", "York"])
+        self.assertEqual(RECORDS[0]["stage"], "get_cities")
+        self.assertEqual(RECORDS[0]["rows"], 2)
+
+    def test_coroutines(self):
+        @timed("gather")
+        async def gather():
+            add_metric("retries")
+            return 1
+
+        self.assertEqual(asyncio.run(gather()), 1)
+        self.assertEqual(RECORDS[0]["retries"], 1)
+
+    def test_summary_table(self):
+        with stage("load_weather") as metrics:
+            metrics["rows"] = 3
+        lines = format_summary().splitlines()
+        self.assertTrue(lines[0].startswith("stage"))
+        self.assertTrue(lines[1].startswith("load_weather"))
+
+
+
+class TestCopies(unittest.TestCase):
+    def test_copies_are_identical(self):
+        root = Path(__file__).resolve().parents[2]
+        source = Path(__file__).with_name("instrumentation.py").read_bytes()
+        for copy in ("daily_pipeline", "weekly-report"):
+            self.assertEqual((root / copy / "instrumentation.py").read_bytes(), source,
+                             f"{copy}/instrumentation.py differs from the hourly copy")
+
+
+if __name__ == "__main__":
+    unittest.main()
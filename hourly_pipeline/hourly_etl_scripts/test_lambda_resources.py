@@ -0,0 +1,90 @@
+# pylint: skip-file
+import unittest
+from pathlib import Path
+from unittest.mock import MagicMock
+
+import psycopg2
+
+from lambda_resources import start_invocation, reuse_connection, get_session, get_client, clear_resources, is_connection_alive, RESOURCES, INVOCATIONS
+
+
+class TestStartInvocation(unittest.TestCase):
+    def setUp(self):
+        INVOCATIONS[0] = 0
+
+    def test_cold_then_warm(self):
+        self.assertEqual(start_invocation(), {"cold_start": True, "invocation": 1})
+        self.assertEqual(start_invocation(), {"cold_start": False, "invocation": 2})
+
+
+class TestReuseConnection(unittest.TestCase):
+    def setUp(self):
+        RESOURCES.clear()
+
+    def tearDown(self):
+        RESOURCES.clear()
+
+    def test_reuses_live_connection(self):
+        connect = MagicMock(return_value=MagicMock(closed=0))
+        first = reuse_connection(connect)
+        second = reuse_connection(connect)
+
+        self.assertIs(first, second)
+        connect.assert_called_once()
+        first.cursor.return_value.__enter__.return_value.execute.assert_called_once_with(
+            "SELECT 1;")
+
+    def test_reconnects_when_ping_fails(self):
+        dead = MagicMock(closed=0)
+        dead.cursor.return_value.__enter__.return_value.execute.side_effect = \
+            psycopg2.OperationalError("server closed the connection")
+        fresh = MagicMock(closed=0)
+        connect = MagicMock(side_effect=[dead, fresh])
+
+        reuse_connection(connect)
+        self.assertIs(reuse_connection(connect), fresh)
+        dead.close.assert_called_once()
+
+    def test_reconnects_when_closed(self):
+        connect = MagicMock(side_effect=[MagicMock(closed=1), MagicMock(closed=0)])
+        first = reuse_connection(connect)
+        self.assertIsNot(reuse_connection(connect), first)
+
+    def test_names_are_separate(self):
+        connect = MagicMock(side_effect=lambda: MagicMock(closed=0))
+        self.assertIsNot(reuse_connection(connect, "aurora"),
+                         reuse_connection(connect, "weather"))
+
+    def test_dead_if_closed(self):
+        self.assertFalse(is_connection_alive(MagicMock(closed=2)))
+
+
+class TestClients(unittest.TestCase):
+    def setUp(self):
+        RESOURCES.clear()
+
+    def test_session_and_client_cached(self):
+        self.assertIs(get_session(), get_session())
+        factory = MagicMock()
+        self.assertIs(get_client("sns", factory), get_client("sns", factory))
+        factory.assert_called_once()
+
+    def test_clear_resources(self):
+        session = get_session()
+        clear_resources()
+        self.assertIsNot(get_session(), session)
+        clear_resources()
+
+
+
+class TestCopies(unittest.TestCase):
+    def test_copies_are_identical(self):
+        root = Path(__file__).resolve().parents[2]
+        source = Path(__file__).with_name("lambda_resources.py").read_bytes()
+        for copy in ("daily_pipeline", "weekly-report"):
+            self.assertEqual((root / copy / "lambda_resources.py").read_bytes(), source,
+                             f"{copy}/lambda_resources.py differs from the hourly copy")
+
+
+if __name__ == "__main__":
+    unittest.main()
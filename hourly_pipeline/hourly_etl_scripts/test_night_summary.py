@@ -0,0 +1,61 @@
+"""Tests for the night windows and nightly weather summaries."""
+import unittest
+from datetime import datetime
+from unittest.mock import MagicMock
+
+from night_summary import summary_query, refresh_night_windows, refresh_nights, refresh_missing_nights
+
+
+class TestNightWindows(unittest.TestCase):
+    def test_refresh_night_windows(self):
+        conn = MagicMock()
+        curs = conn.cursor.return_value
+        curs.rowcount = 3
+        self.assertEqual(refresh_night_windows(conn, "2025-02-10"), 3)
+        query, params = curs.execute.call_args.args
+        self.assertIn("TSRANGE(dusk.sunset AT TIME ZONE %(zone)s AT TIME ZONE 'UTC'", query)
+        self.assertIn("ON CONFLICT (city_id, night_date)", query)
+        self.assertEqual(params, {"zone": "Europe/London", "window_start": "2025-02-10"})
+        conn.commit.assert_called_once()
+        curs.close.assert_called_once()
+
+
+class TestSummaryQuery(unittest.TestCase):
+    def test_aggregates_every_metric(self):
+        query = summary_query("SELECT 1 AS city_id, CURRENT_DATE AS night_date")
+        for metric in ("coverage", "visibility", "temperature"):
+            self.assertIn(f"MIN(w.{metric}), AVG(w.{metric}), MAX(w.{metric})", query)
+            self.assertIn(f"max_{metric} = EXCLUDED.max_{metric}", query)
+        self.assertIn("ON CONFLICT (city_id, night_date)", query)
+        self.assertIn("HAVING MIN(w.status_at) < LOWER(nw.dark)", query)
+
+    def test_hours_join_the_window_holding_them(self):
+        query = summary_query("SELECT 1 AS city_id, CURRENT_DATE AS night_date")
+        self.assertIn("nw.dark @> w.status_at", query)
+        self.assertNotIn("stargazing_status", query)
+
+
+class TestRefreshNights(unittest.TestCase):
+    def test_refresh_nights(self):
+        curs = MagicMock()
+        curs.rowcount = 2
+        written = [(1, datetime(2025, 2, 10, 22)), (2, datetime(2025, 2, 11, 3))]
+        self.assertEqual(refresh_nights(curs, written), 2)
+        query, params = curs.execute.call_args.args
+        self.assertIn("nw.dark @> h.status_at", query)
+        self.assertEqual(params, ([1, 2], [datetime(2025, 2, 10, 22), datetime(2025, 2, 11, 3)]))
+
+    def test_nothing_to_refresh(self):
+        curs = MagicMock()
+        self.assertEqual(refresh_nights(curs, []), 0)
+        curs.execute.assert_not_called()
+
+    def test_refresh_missing_nights(self):
+        conn = MagicMock()
+        curs = conn.cursor.return_value
+        curs.rowcount = 5
+        self.assertEqual(refresh_missing_nights(conn, "2025-02-10"), 5)
+        self.assertEqual(curs.execute.call_args.args[1], ("2025-02-10",))
+        self.assertIn("NOT EXISTS", curs.execute.call_args.args[0])
+        conn.commit.assert_called_once()
+        curs.close.assert_called_once()
@@ -0,0 +1,133 @@
+# pylint: skip-file
+import io
+import json
+import unittest
+from datetime import datetime
+from unittest.mock import patch, MagicMock
+
+from shards import make_shards, run_sharded, retry_failed_shards, run_shard, lambda_dispatcher, make_payload
+
+ISSUED_AT = datetime(2025, 2, 10, 9)
+
+
+def succeeded(payload):
+    return {"index": payload["shard"]["index"], "status": "succeeded",
+            "counts": {"inserted": 10, "updated": 1, "unchanged": 0, "archived": 11,
+                       "batches": 1}}
+
+
+class TestMakeShards(unittest.TestCase):
+    def test_range_covers_every_city(self):
+        shards = make_shards([7, 1, 3, 9, 4], 2)
+        self.assertEqual([(s["first_id"], s["last_id"]) for s in shards], [(1, 4), (7, 9)])
+
+    def test_more_shards_than_cities(self):
+        shards = make_shards([1, 2], 4)
+        self.assertEqual(len(shards), 2)
+        self.assertEqual({s["count"] for s in shards}, {2})
+
+    def test_hash(self):
+        shards = make_shards([1, 2, 3], 3, "hash")
+        self.assertEqual([s["index"] for s in shards], [0, 1, 2])
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            make_shards([1], 0)
+        with self.assertRaises(ValueError):
+            make_shards([1], 2, "random")
+
+
+@patch("shards.prune_weather", return_value=5)
+@patch("shards.set_shard_status")
+@patch("shards.record_shards")
+@patch("shards.get_city_ids", return_value=list(range(1, 11)))
+class TestRunSharded(unittest.TestCase):
+    def test_merges_counts_and_prunes_once(self, mock_ids, mock_record, mock_status, mock_prune):
+        dispatch = MagicMock(side_effect=lambda payloads: [succeeded(p) for p in payloads])
+
+        totals = run_sharded(MagicMock(), dispatch, 3, ISSUED_AT, "2025-02-10", "2025-02-17")
+
+        self.assertEqual(len(dispatch.call_args.args[0]), 3)
+        self.assertEqual(totals["inserted"], 30)
+        self.assertEqual(totals["failed_shards"], [])
+        self.assertEqual(totals["pruned"], 5)
+        mock_prune.assert_called_once()
+
+    def test_tracks_failed_shards(self, mock_ids, mock_record, mock_status, mock_prune):
+        def dispatch(payloads):
+            return [succeeded(payloads[0]),
+                    {"index": 1, "status": "failed", "error": "timed out"}]
+
+        totals = run_sharded(MagicMock(), dispatch, 2, ISSUED_AT, "2025-02-10", "2025-02-17")
+
+        self.assertEqual(totals["failed_shards"], [1])
+        self.assertEqual(totals["inserted"], 10)
+        mock_status.assert_any_call(unittest.mock.ANY, ISSUED_AT, 1, "failed", "timed out")
+        mock_prune.assert_not_called()
+
+    @patch("shards.get_failed_shards")
+    def test_retry_only_failed(self, mock_failed, mock_ids, mock_record, mock_status, mock_prune):
+        mock_failed.return_value = [{"index": 1, "count": 2, "strategy": "range",
+                                     "first_id": 6, "last_id": 10}]
+        dispatch = MagicMock(side_effect=lambda payloads: [succeeded(p) for p in payloads])
+
+        totals = retry_failed_shards(MagicMock(), dispatch, ISSUED_AT, "2025-02-10", "2025-02-17")
+
+        self.assertEqual([p["shard"]["index"] for p in dispatch.call_args.args[0]], [1])
+        self.assertEqual(totals["failed_shards"], [])
+        mock_prune.assert_called_once()
+
+
+class TestRunShard(unittest.TestCase):
+    @patch("shards.handle_locations_streaming", return_value={"inserted": 3})
+    @patch("shards.get_shard_locations", return_value=[(1,), (2,)])
+    @patch("shards.reuse_connection")
+    def test_worker_does_not_prune(self, mock_conn, mock_locations, mock_stream):
+        payload = make_payload(make_shards([1, 2], 1)[0], ISSUED_AT, "2025-02-10",
+                               "2025-02-17", {"batch_size": 10})
+
+        result = run_shard(json.loads(json.dumps(payload)), deadline=100)
+
+        self.assertEqual(result["status"], "succeeded")
+        kwargs = mock_stream.call_args.kwargs
+        self.assertFalse(kwargs["prune"])
+        self.assertEqual(kwargs["issued_at"], ISSUED_AT)
+        self.assertEqual(kwargs["deadline"], 100)
+        self.assertEqual(kwargs["batch_size"], 10)
+
+    @patch("shards.handle_locations_streaming", return_value={"inserted": 3})
+    @patch("shards.get_shard_locations", return_value=[(1,)])
+    @patch("shards.reuse_connection")
+    def test_coordinator_deadline_is_kept_when_shorter(self, mock_conn, mock_locations,
+                                                       mock_stream):
+        payload = make_payload(make_shards([1], 1)[0], ISSUED_AT, "2025-02-10",
+                               "2025-02-17", {"deadline": 60})
+
+        run_shard(payload, deadline=500)
+
+        self.assertEqual(mock_stream.call_args.kwargs["deadline"], 60)
+
+    @patch("shards.reuse_connection", side_effect=Exception("no database"))
+    def test_failure_reported(self, mock_conn):
+        payload = make_payload(make_shards([1], 1)[0], ISSUED_AT, "", "", {})
+        self.assertEqual(run_shard(payload),
+                         {"index": 0, "status": "failed", "error": "no database"})
+
+
+class TestLambdaDispatcher(unittest.TestCase):
+    def test_function_error(self):
+        lambda_client = MagicMock()
+        lambda_client.invoke.return_value = {
+            "FunctionError": "Unhandled",
+            "Payload": io.BytesIO(b'{"errorMessage": "Task timed out"}')}
+        payload = make_payload(make_shards([1], 1)[0], ISSUED_AT, "", "", {})
+
+        results = lambda_dispatcher(lambda_client, "hourly")([payload])
+
+        self.assertEqual(results, [{"index": 0, "status": "failed", "error": "Task timed out"}])
+        self.assertEqual(lambda_client.invoke.call_args.kwargs["InvocationType"],
+                         "RequestResponse")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,169 @@
+"""Tests for the stargazing score."""
+import unittest
+from datetime import datetime, date
+from unittest.mock import MagicMock
+
+import numpy as np
+
+from stargazing_score import get_moon_illumination, get_moonlight, get_darkness, get_aurora, compute_scores, get_aurora_levels, add_scores, UNKNOWN_DARKNESS
+
+
+def sun_times(city_ids, days, sunrises, sunsets, illumination=None, moonrises=None,
+              moonsets=None):
+    missing = [None] * len(city_ids)
+    return {"city_id": np.array(city_ids, dtype=np.int64),
+            "status_date": np.array(days, dtype="datetime64[D]"),
+            "sunrise": np.array(sunrises, dtype="datetime64[s]"),
+            "sunset": np.array(sunsets, dtype="datetime64[s]"),
+            "moon_illumination": np.array(illumination or missing, dtype=np.float64),
+            "moonrise": np.array(moonrises or missing, dtype="datetime64[s]"),
+            "moonset": np.array(moonsets or missing, dtype="datetime64[s]")}
+
+
+LONDON = sun_times([1], ["2025-02-10"], ["2025-02-10T07:30"], ["2025-02-10T17:00"])
+
+
+class TestMoonIllumination(unittest.TestCase):
+    def test_new_and_full_moon(self):
+        new = np.datetime64("2025-01-29T12:36")
+        full = np.datetime64("2025-02-12T13:53")
+        illumination = get_moon_illumination(np.array([new, full]))
+        self.assertLess(illumination[0], 0.05)
+        self.assertGreater(illumination[1], 0.95)
+
+
+class TestMoonlight(unittest.TestCase):
+    def hours(self, *times):
+        return np.array([f"2025-02-10T{time}" for time in times], dtype="datetime64[s]")
+
+    def test_only_while_up(self):
+        moon = sun_times([1], ["2025-02-10"], ["2025-02-10T07:30"], ["2025-02-10T17:00"],
+                         [0.9], ["2025-02-10T13:00"], ["2025-02-10T05:00"])
+        moonlight = get_moonlight(self.hours("03:00", "09:00", "22:00"), np.ones(3), moon)
+        np.testing.assert_allclose(moonlight, [0.9, 0, 0.9])
+
+    def test_rises_and_sets_same_day(self):
+        moon = sun_times([1], ["2025-02-10"], ["2025-02-10T07:30"], ["2025-02-10T17:00"],
+                         [0.4], ["2025-02-10T06:00"], ["2025-02-10T15:00"])
+        moonlight = get_moonlight(self.hours("03:00", "09:00", "22:00"), np.ones(3), moon)
+        np.testing.assert_allclose(moonlight, [0, 0.4, 0])
+
+    def test_no_moonset(self):
+        moon = sun_times([1], ["2025-02-10"], ["2025-02-10T07:30"], ["2025-02-10T17:00"],
+                         [0.6], ["2025-02-10T20:00"], None)
+        moonlight = get_moonlight(self.hours("19:00", "21:00"), np.ones(2), moon)
+        np.testing.assert_allclose(moonlight, [0, 0.6])
+
+    def test_summer_moonrise_in_utc(self):
+        moon = sun_times([1], ["2025-06-21"], ["2025-06-21T04:43"], ["2025-06-21T21:21"],
+                         [0.3], ["2025-06-21T22:30"], None)
+        status_at = np.array(["2025-06-21T21:45"], dtype="datetime64[s]")
+        np.testing.assert_allclose(get_moonlight(status_at, np.ones(1), moon), [0.3])
+
+    def test_falls_back_without_moon_data(self):
+        status_at = self.hours("22:00")
+        np.testing.assert_allclose(get_moonlight(status_at, np.ones(1), LONDON),
+                                   get_moon_illumination(status_at))
+
+
+class TestDarkness(unittest.TestCase):
+    def test_day_twilight_and_night(self):
+        status_at = np.array(["2025-02-10T12:00", "2025-02-10T17:45",
+                              "2025-02-10T22:00", "2025-02-10T03:00"], dtype="datetime64[s]")
+        darkness = get_darkness(status_at, np.array([1, 1, 1, 1]), LONDON)
+        np.testing.assert_allclose(darkness, [0, 0.5, 1, 1])
+
+    def test_summer_time(self):
+        # Sunrise and sunset are in British Summer Time, an hour ahead of the UTC hours.
+        summer = sun_times([1], ["2025-06-21"], ["2025-06-21T04:43"], ["2025-06-21T21:21"])
+        status_at = np.array(["2025-06-21T12:00", "2025-06-21T21:00",
+                              "2025-06-21T03:00"], dtype="datetime64[s]")
+        darkness = get_darkness(status_at, np.array([1, 1, 1]), summer)
+        np.testing.assert_allclose(darkness, [0, 39 / 90, 43 / 90])
+
+    def test_unknown_days(self):
+        status_at = np.array(["2025-02-11T22:00", "2025-02-10T22:00"], dtype="datetime64[s]")
+        darkness = get_darkness(status_at, np.array([1, 2]), LONDON)
+        np.testing.assert_allclose(darkness, [UNKNOWN_DARKNESS, UNKNOWN_DARKNESS])
+
+
+class TestAurora(unittest.TestCase):
+    def test_only_near_observation(self):
+        status_at = np.array(["2025-02-10T21:00", "2025-02-11T06:00", "2025-02-10T21:00"],
+                             dtype="datetime64[s]")
+        level = get_aurora(status_at, np.array([1, 1, 2]),
+                           {1: (datetime(2025, 2, 10, 20), 1.0)})
+        np.testing.assert_allclose(level, [1.0, 0, 0])
+
+
+class TestComputeScores(unittest.TestCase):
+    def columns(self, coverage, visibility, hours):
+        return {"status_at": np.array(hours, dtype="datetime64[s]"),
+                "city_id": np.ones(len(hours), dtype=np.int16),
+                "coverage": np.array(coverage, dtype=np.float32),
+                "visibility": np.array(visibility, dtype=np.float32)}
+
+    def test_clear_night_beats_cloud_and_day(self):
+        columns = self.columns([0, 90, 0], [24000, 24000, 24000],
+                               ["2025-02-10T22:00", "2025-02-10T22:00", "2025-02-10T12:00"])
+        scores = compute_scores(columns, LONDON, {})
+        self.assertGreater(scores[0], scores[1])
+        self.assertEqual(scores[2], 0)
+        self.assertEqual(scores.dtype, np.float32)
+
+    def test_aurora_raises_score(self):
+        columns = self.columns([0], [24000], ["2025-02-10T22:00"])
+        plain = compute_scores(columns, LONDON, {})
+        aurora = compute_scores(columns, LONDON, {1: (datetime(2025, 2, 10, 22), 1.0)})
+        self.assertGreater(aurora[0], plain[0])
+        self.assertLessEqual(aurora[0], 100)
+
+    def test_moon_below_horizon_scores_higher(self):
+        columns = self.columns([0], [24000], ["2025-02-10T22:00"])
+        up = sun_times([1], ["2025-02-10"], ["2025-02-10T07:30"], ["2025-02-10T17:00"],
+                       [1.0], ["2025-02-10T18:00"], None)
+        down = sun_times([1], ["2025-02-10"], ["2025-02-10T07:30"], ["2025-02-10T17:00"],
+                         [1.0], None, ["2025-02-10T18:00"])
+        self.assertEqual(compute_scores(columns, up, {})[0], 50)
+        self.assertEqual(compute_scores(columns, down, {})[0], 100)
+
+    def test_missing_values_score_zero(self):
+        columns = self.columns([np.nan], [np.nan], ["2025-02-10T22:00"])
+        self.assertEqual(compute_scores(columns, LONDON, {})[0], 0)
+
+
+class TestQueries(unittest.TestCase):
+    def test_aurora_levels(self):
+        conn = MagicMock()
+        observed = datetime(2025, 2, 10, 20)
+        conn.cursor.return_value.fetchall.return_value = [
+            (1, observed, True, True), (2, observed, False, True), (3, observed, False, False)]
+        self.assertEqual(get_aurora_levels(conn, [1, 2, 3]),
+                         {1: (observed, 1.0), 2: (observed, 0.5)})
+
+    def test_add_scores(self):
+        conn = MagicMock()
+        cursor = conn.cursor.return_value
+        cursor.fetchall.side_effect = [
+            [(1, date(2025, 2, 10), datetime(2025, 2, 10, 7, 30), datetime(2025, 2, 10, 17),
+              0.5, datetime(2025, 2, 10, 12), None)],
+            []]
+        columns = {"status_at": np.array(["2025-02-10T22:00", "2025-02-11T01:00"],
+                                         dtype="datetime64[s]"),
+                   "city_id": np.array([1, 1], dtype=np.int16),
+                   "coverage": np.array([0, 0], dtype=np.float32),
+                   "visibility": np.array([24000, 24000], dtype=np.float32)}
+
+        scored = add_scores(columns, conn)
+
+        self.assertEqual(len(scored["stargazing_score"]), 2)
+        self.assertNotIn("stargazing_score", columns)
+        self.assertEqual(cursor.execute.call_args_list[0].args[1],
+                         ([1], "2025-02-10", "2025-02-11"))
+
+    def test_add_scores_empty(self):
+        conn = MagicMock()
+        columns = {"status_at": np.array([], dtype="datetime64[s]"),
+                   "city_id": np.array([], dtype=np.int16)}
+        self.assertEqual(len(add_scores(columns, conn)["stargazing_score"]), 0)
+        conn.cursor.assert_not_called()
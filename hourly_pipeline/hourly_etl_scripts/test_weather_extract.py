@@ -2,9 +2,10 @@
 import unittest
 from datetime import datetime, timedelta
 from unittest.mock import patch, MagicMock
+import numpy as np
 import pandas as pd
 
-from weather_extract import get_dates, convert_df_to_list, get_locations, clear_weather_table, insert_into_db, get_weather_for_location, handle_locations, make_requests
+from weather_extract import get_dates, convert_df_to_list, get_locations, clear_weather_table, insert_into_db, get_weather_for_location, handle_locations, make_requests, chunk_locations, handle_locations_batched, get_weather_for_batch, upsert_weather, get_weather_columns, combine_weather_columns, score_dataframe
 
 
 class TestGetDates(unittest.TestCase):
@@ -59,8 +60,9 @@ class TestClearWeatherTable(unittest.TestCase):
 
 
 class TestInsertIntoDb(unittest.TestCase):
-    @patch('weather_extract.execute_values')
-    def test_insert_into_db(self, mock_execute_values):
+    @patch('weather_extract.score_dataframe', side_effect=lambda df, conn: df)
+    @patch('weather_extract.copy_merge')
+    def test_insert_into_db(self, mock_copy_merge, mock_score):
         mock_conn = MagicMock()
         mock_cursor = MagicMock()
 
@@ -116,5 +118,166 @@ class TestMakeRequests(unittest.TestCase):
         self.assertEqual(responses, True)
 
 
+class TestChunkLocations(unittest.TestCase):
+    def test_chunk_locations(self):
+        locations = list(range(7))
+        self.assertEqual(chunk_locations(locations, 3),
+                         [[0, 1, 2], [3, 4, 5], [6]])
+
+    def test_chunk_locations_invalid_size(self):
+        with self.assertRaises(ValueError):
+            chunk_locations([1, 2], 0)
+
+
+class TestGetWeatherForBatch(unittest.TestCase):
+    @patch("weather_extract.get_dataframe")
+    def test_get_weather_for_batch(self, mock_get_dataframe):
+        openmeteo = MagicMock()
+        openmeteo.weather_api.return_value = [MagicMock(), MagicMock()]
+        mock_get_dataframe.side_effect = [
+            pd.DataFrame({'temperature_2m': [1, 2]}),
+            pd.DataFrame({'temperature_2m': [3, 4]})]
+        batch = [(7, 'a', 1, 50.1, -1.1), (9, 'b', 1, 52.2, -2.2)]
+
+        df = get_weather_for_batch("2025-2-3", "2025-2-9", batch, openmeteo)
+
+        params = openmeteo.weather_api.call_args.kwargs["params"]
+        self.assertEqual(params["latitude"], [50.1, 52.2])
+        self.assertEqual(params["longitude"], [-1.1, -2.2])
+        self.assertEqual(list(df['city_id']), [7, 7, 9, 9])
+        self.assertEqual(list(df['temperature_2m']), [1, 2, 3, 4])
+
+    def test_get_weather_for_batch_missing_response(self):
+        openmeteo = MagicMock()
+        openmeteo.weather_api.return_value = [MagicMock()]
+        batch = [(7, 'a', 1, 50.1, -1.1), (9, 'b', 1, 52.2, -2.2)]
+        with self.assertRaises(ValueError):
+            get_weather_for_batch("2025-2-3", "2025-2-9", batch, openmeteo)
+
+
+class TestHandleLocationsBatched(unittest.TestCase):
+    @patch("weather_extract.get_weather_for_batch")
+    def test_handle_locations_batched(self, mock_get_batch):
+        openmeteo = MagicMock()
+        mock_get_batch.side_effect = lambda today, week, batch, om: pd.DataFrame(
+            {'city_id': [location[0] for location in batch]})
+        locations = [(i, 1, 2, 3, 4) for i in range(5)]
+
+        df = handle_locations_batched(
+            locations, openmeteo, "2025-2-3", "2025-2-9", batch_size=2)
+
+        self.assertEqual(mock_get_batch.call_count, 3)
+        self.assertEqual(list(df['city_id']), [0, 1, 2, 3, 4])
+
+
+def fake_add_scores(columns, connection):
+    return {**columns, "stargazing_score": np.zeros(len(columns["status_at"]))}
+
+
+class TestScoreDataframe(unittest.TestCase):
+    @patch('weather_extract.add_scores', side_effect=fake_add_scores)
+    def test_score_appended_last(self, mock_add_scores):
+        df = pd.DataFrame({'date': pd.to_datetime([1739145600], unit='s', utc=True),
+                           'temperature_2m': [1.0], 'cloud_cover': [20.0],
+                           'visibility': [24000.0], 'city_id': [3]})
+
+        scored = score_dataframe(df, MagicMock())
+
+        self.assertEqual(list(scored.columns)[-1], "stargazing_score")
+        columns = mock_add_scores.call_args.args[0]
+        self.assertEqual(columns["coverage"][0], 20.0)
+        self.assertEqual(columns["status_at"][0], np.datetime64("2025-02-10T00:00"))
+
+
+class TestUpsertWeather(unittest.TestCase):
+    @patch('weather_extract.add_scores', side_effect=fake_add_scores)
+    @patch('weather_extract.copy_merge')
+    def test_upsert_weather_counts(self, mock_copy_merge, mock_add_scores):
+        mock_conn = MagicMock()
+        mock_cursor = MagicMock()
+        mock_conn.cursor.return_value = mock_cursor
+        mock_copy_merge.return_value = {"rows": 5, "inserted": 2, "updated": 1,
+                                        "unchanged": 2, "bytes": 100, "written": []}
+        mock_cursor.rowcount = 4
+        df = pd.DataFrame({'date': [1, 2, 3, 4, 5], 'temperature_2m': [1] * 5,
+                           'cloud_cover': [1] * 5, 'visibility': [1] * 5,
+                           'city_id': [1] * 5})
+
+        counts = upsert_weather(df, mock_conn, "2025-02-10")
+
+        self.assertEqual(counts, {"inserted": 2, "updated": 1,
+                                  "unchanged": 2, "nights": 0, "pruned": 4})
+        self.assertEqual(mock_copy_merge.call_args.kwargs["conflict"],
+                         ["city_id", "status_at"])
+        mock_cursor.execute.assert_called_once_with(
+            "DELETE FROM weather_status WHERE status_at < %s;", ("2025-02-10",))
+        mock_conn.commit.assert_called_once()
+        mock_cursor.close.assert_called_once()
+
+    @patch('weather_extract.refresh_nights', return_value=1)
+    @patch('weather_extract.add_scores', side_effect=fake_add_scores)
+    @patch('weather_extract.copy_merge')
+    def test_upsert_weather_refreshes_changed_nights(self, mock_copy_merge, mock_add_scores,
+                                                     mock_refresh):
+        mock_conn = MagicMock()
+        mock_copy_merge.return_value = {"rows": 2, "inserted": 2, "updated": 0, "unchanged": 0,
+                                        "bytes": 50,
+                                        "written": [(1, datetime(2025, 2, 10, 22)),
+                                                    (1, datetime(2025, 2, 11, 2))]}
+        df = pd.DataFrame({'date': [1, 2], 'temperature_2m': [1] * 2,
+                           'cloud_cover': [1] * 2, 'visibility': [1] * 2, 'city_id': [1] * 2})
+
+        counts = upsert_weather(df, mock_conn, "2025-02-10")
+
+        self.assertEqual(counts["nights"], 1)
+        self.assertEqual(mock_copy_merge.call_args.kwargs["returning"], ["city_id", "status_at"])
+        self.assertEqual(mock_refresh.call_args.args[1],
+                         mock_copy_merge.return_value["written"])
+
+    @patch('weather_extract.copy_merge')
+    def test_upsert_weather_rolls_back(self, mock_copy_merge):
+        mock_conn = MagicMock()
+        mock_cursor = MagicMock()
+        mock_conn.cursor.return_value = mock_cursor
+        mock_copy_merge.side_effect = Exception("failed")
+        df = pd.DataFrame({'date': [1], 'temperature_2m': [1],
+                           'cloud_cover': [1], 'visibility': [1], 'city_id': [1]})
+
+        with self.assertRaises(Exception):
+            upsert_weather(df, mock_conn, "2025-02-10")
+        mock_conn.rollback.assert_called_once()
+        mock_conn.commit.assert_not_called()
+
+
+def fake_hourly(hours, start=1739145600):
+    hourly = MagicMock()
+    hourly.Time.return_value = start
+    hourly.TimeEnd.return_value = start + hours * 3600
+    hourly.Interval.return_value = 3600
+    hourly.Variables.return_value.ValuesAsNumpy.return_value = np.arange(
+        hours, dtype=np.float32)
+    return hourly
+
+
+class TestWeatherColumns(unittest.TestCase):
+    def test_get_weather_columns(self):
+        columns = get_weather_columns(fake_hourly(3))
+        self.assertEqual(list(columns['status_at'].astype(str)),
+                         ['2025-02-10T00:00:00', '2025-02-10T01:00:00',
+                          '2025-02-10T02:00:00'])
+        self.assertEqual(list(columns['coverage']), [0, 1, 2])
+
+    def test_combine_weather_columns_follows_forecast_length(self):
+        blocks = [get_weather_columns(fake_hourly(2)),
+                  get_weather_columns(fake_hourly(3))]
+        columns = combine_weather_columns([5, 8], blocks)
+        self.assertEqual(list(columns['city_id']), [5, 5, 8, 8, 8])
+        self.assertEqual(len(columns['status_at']), 5)
+
+    def test_combine_weather_columns_empty(self):
+        columns = combine_weather_columns([], [])
+        self.assertEqual(len(columns['city_id']), 0)
+
+
 if __name__ == "__main__":
     unittest.main()
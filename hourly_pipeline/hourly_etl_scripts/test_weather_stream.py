@@ -0,0 +1,124 @@
+# pylint: skip-file
+import unittest
+from datetime import datetime
+from unittest.mock import patch, MagicMock
+
+import numpy as np
+
+from async_extract import RetryableStatusError
+from instrumentation import add_metric, reset_records, RECORDS
+from weather_stream import micro_batches, stream_weather_to_db
+
+LOCATIONS = [(i, 'city', 1, 50.0 + i, -1.0) for i in range(1, 6)]
+
+
+def block(hours):
+    return {"status_at": np.arange(hours).astype("datetime64[h]"),
+            "temperature": np.zeros(hours, dtype=np.float32),
+            "coverage": np.zeros(hours, dtype=np.float32),
+            "visibility": np.zeros(hours, dtype=np.float32)}
+
+
+async def blocks(items):
+    for item in items:
+        yield item
+
+
+def fake_openmeteo(fail_after=None):
+    openmeteo = MagicMock()
+    calls = []
+
+    def weather_api(url, params):
+        calls.append(params)
+        if fail_after is not None and len(calls) > fail_after:
+            raise KeyError("broken response")
+        return [MagicMock() for _ in params["latitude"].split(",")]
+    openmeteo.weather_api.side_effect = weather_api
+    return openmeteo
+
+
+async def to_thread(func, *args, **kwargs):
+    return func(*args, **kwargs)
+
+
+class TestMicroBatches(unittest.IsolatedAsyncioTestCase):
+    async def test_flushes_when_full(self):
+        items = [(1, block(3)), (2, block(3)), (3, block(3))]
+        batches = [batch async for batch in micro_batches(blocks(items), flush_rows=5)]
+
+        self.assertEqual([list(batch["city_id"]) for batch in batches],
+                         [[1, 1, 1, 2, 2, 2], [3, 3, 3]])
+
+    async def test_no_batches_when_empty(self):
+        batches = [batch async for batch in micro_batches(blocks([]))]
+        self.assertEqual(batches, [])
+
+
+@patch("weather_stream.asyncio.to_thread", side_effect=to_thread)
+@patch("async_extract.asyncio.to_thread", side_effect=to_thread)
+@patch("weather_stream.get_weather_columns", side_effect=lambda hourly: block(4))
+@patch("weather_stream.archive_forecast", return_value={"inserted": 4})
+@patch("weather_stream.prune_weather", return_value=7)
+@patch("weather_stream.upsert_weather_columns")
+class TestStreamWeatherToDb(unittest.IsolatedAsyncioTestCase):
+    async def test_loads_in_micro_batches(self, mock_upsert, mock_prune, *_):
+        mock_upsert.return_value = {"inserted": 1, "updated": 2, "unchanged": 3, "nights": 1}
+        conn = MagicMock()
+
+        totals = await stream_weather_to_db(LOCATIONS, conn, "2025-02-10", "2025-02-17",
+                                            fake_openmeteo(), flush_rows=8, batch_size=1)
+
+        self.assertEqual(mock_upsert.call_count, 3)
+        self.assertEqual(totals, {"inserted": 3, "updated": 6, "unchanged": 9,
+                                  "archived": 0, "nights": 3, "batches": 3, "pruned": 7})
+        mock_prune.assert_called_once_with(conn, "2025-02-10")
+
+    async def test_archives_when_issued(self, mock_upsert, mock_prune, mock_archive, *_):
+        mock_upsert.return_value = {"inserted": 1, "updated": 0, "unchanged": 0}
+        issued_at = datetime(2025, 2, 10, 9)
+
+        totals = await stream_weather_to_db(LOCATIONS, MagicMock(), "2025-02-10", "2025-02-17",
+                                            fake_openmeteo(), flush_rows=8, batch_size=1,
+                                            issued_at=issued_at)
+
+        self.assertEqual(mock_archive.call_count, 3)
+        self.assertEqual(mock_archive.call_args.args[2], issued_at)
+        self.assertEqual(totals["archived"], 12)
+
+    async def test_records_extract_metrics(self, mock_upsert, *_):
+        mock_upsert.return_value = {"inserted": 4, "updated": 0, "unchanged": 0}
+        reset_records()
+
+        async def flaky(params):
+            flaky.calls += 1
+            if flaky.calls == 1:
+                raise RetryableStatusError("429")
+            add_metric("bytes_fetched", 100)
+            return [MagicMock() for _ in params["latitude"].split(",")]
+        flaky.calls = 0
+
+        with patch("weather_stream.openmeteo_fetcher", return_value=flaky):
+            await stream_weather_to_db(LOCATIONS, MagicMock(), "2025-02-10", "2025-02-17",
+                                       MagicMock(), flush_rows=8, batch_size=1, backoff=0)
+
+        records = {record["stage"]: record for record in RECORDS}
+        self.assertEqual(records["extract_weather"]["bytes_fetched"], 500)
+        self.assertEqual(records["extract_weather"]["retries"], 1)
+        self.assertEqual(records["extract_weather"]["rows"], 12)
+        self.assertEqual(records["transform_weather"]["rows"], 20)
+        self.assertEqual(records["transform_weather"]["status"], "succeeded")
+
+    async def test_keeps_committed_batches_on_failure(self, mock_upsert, mock_prune, *_):
+        mock_upsert.return_value = {"inserted": 1, "updated": 0, "unchanged": 0}
+
+        with self.assertRaises(KeyError):
+            await stream_weather_to_db(LOCATIONS, MagicMock(), "2025-02-10", "2025-02-17",
+                                       fake_openmeteo(fail_after=2), flush_rows=8,
+                                       batch_size=1, concurrency=1)
+
+        mock_upsert.assert_called_once()
+        mock_prune.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
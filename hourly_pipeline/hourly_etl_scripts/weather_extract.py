@@ -5,12 +5,21 @@ from os import environ as ENV
 import openmeteo_requests
 
 import requests_cache
+import numpy as np
 import pandas as pd
 import psycopg2
-from psycopg2.extras import execute_values
 from retry_requests import retry
 from dotenv import load_dotenv
 
+from bulk_load import copy_merge
+from instrumentation import timed, add_metric
+from stargazing_score import add_scores, SCORE_COLUMN
+from night_summary import refresh_nights
+
+BATCH_SIZE = 50
+WEATHER_COLUMNS = ["status_at", "temperature", "coverage", "visibility", "city_id",
+                   SCORE_COLUMN]
+
 
 def get_connection():
     """Returns psycopg2 connection object."""
@@ -53,6 +62,22 @@ def make_requests(today: str, week_away: str, lat: float, long: float, openmeteo
     return responses
 
 
+def make_batch_requests(today: str, week_away: str,
+                        lats: list[float], longs: list[float], openmeteo):
+    """Make a single multi-location request to open-meteo.
+    One response is returned per location, in the order they were requested."""
+    url = "https://api.open-meteo.com/v1/forecast"
+    params = {
+        "latitude": lats,
+        "longitude": longs,
+        "hourly": ["temperature_2m", "cloud_cover", "visibility"],
+        "start_date": today,
+        "end_date": week_away
+    }
+    responses = openmeteo.weather_api(url, params=params)
+    return responses
+
+
 def get_dataframe(hourly) -> pd.DataFrame:
     """Returns dataframe of weather."""
     hourly_temperature_2m = hourly.Variables(0).ValuesAsNumpy()
@@ -74,6 +99,31 @@ def get_dataframe(hourly) -> pd.DataFrame:
     return hourly_dataframe
 
 
+def get_weather_columns(hourly) -> dict:
+    """Returns the weather as numpy arrays keyed by weather_status column."""
+    status_at = np.arange(hourly.Time(), hourly.TimeEnd(),
+                          hourly.Interval(), dtype=np.int64).astype("datetime64[s]")
+    return {"status_at": status_at,
+            "temperature": hourly.Variables(0).ValuesAsNumpy(),
+            "coverage": hourly.Variables(1).ValuesAsNumpy(),
+            "visibility": hourly.Variables(2).ValuesAsNumpy()}
+
+
+def combine_weather_columns(city_ids: list, blocks: list[dict]) -> dict:
+    """Concatenates each location's arrays, repeating its city_id to the length of its forecast."""
+    if not blocks:
+        return {"status_at": np.array([], dtype="datetime64[s]"),
+                "temperature": np.array([], dtype=np.float32),
+                "coverage": np.array([], dtype=np.float32),
+                "visibility": np.array([], dtype=np.float32),
+                "city_id": np.array([], dtype=np.int16)}
+    columns = {name: np.concatenate([block[name] for block in blocks])
+               for name in blocks[0]}
+    columns["city_id"] = np.repeat(np.asarray(city_ids, dtype=np.int16),
+                                   [len(block["status_at"]) for block in blocks])
+    return columns
+
+
 def get_weather_for_location(today: str, week_away: str,
                              lat: float, long: float,
                              openmeteo
@@ -86,6 +136,7 @@ def get_weather_for_location(today: str, week_away: str,
     return hourly_dataframe
 
 
+@timed("extract_locations", rows=len)
 def get_locations(connection) -> list:
     """Fetches list of locations from the database."""
     curs = connection.cursor()
@@ -95,6 +146,7 @@ def get_locations(connection) -> list:
     return results
 
 
+@timed("extract_weather", rows=len)
 def handle_locations(locations: list, openmeteo, today_str: str, week_str: str) -> pd.DataFrame:
     """Makes requests for every location in the list."""
     dataframes = []
@@ -102,8 +154,44 @@ def handle_locations(locations: list, openmeteo, today_str: str, week_str: str)
     for location in locations:
         df = get_weather_for_location(
             today_str, week_str, location[3], location[4], openmeteo)
-        df['city_id'] = pd.Series([location[0]]*192)
+        df['city_id'] = location[0]
+        dataframes.append(df)
+
+    all_weather_df = pd.concat(dataframes, ignore_index=True)
+    return all_weather_df
+
+
+def chunk_locations(locations: list, batch_size: int = BATCH_SIZE) -> list[list]:
+    """Splits the locations into batches for multi-location requests."""
+    if batch_size < 1:
+        raise ValueError("Batch size must be at least 1")
+    return [locations[i:i + batch_size] for i in range(0, len(locations), batch_size)]
+
+
+def get_weather_for_batch(today: str, week_away: str, batch: list, openmeteo) -> pd.DataFrame:
+    """Returns dataframe of weather for a batch of locations, tagged with city_id."""
+    responses = make_batch_requests(today, week_away,
+                                    [location[3] for location in batch],
+                                    [location[4] for location in batch],
+                                    openmeteo)
+    if len(responses) != len(batch):
+        raise ValueError(
+            f"Expected {len(batch)} responses from open-meteo, got {len(responses)}")
+
+    dataframes = []
+    for location, response in zip(batch, responses):
+        df = get_dataframe(response.Hourly())
+        df['city_id'] = location[0]
         dataframes.append(df)
+    return pd.concat(dataframes, ignore_index=True)
+
+
+@timed("extract_weather", rows=len)
+def handle_locations_batched(locations: list, openmeteo, today_str: str, week_str: str,
+                             batch_size: int = BATCH_SIZE) -> pd.DataFrame:
+    """Makes one request per batch of locations rather than one per location."""
+    dataframes = [get_weather_for_batch(today_str, week_str, batch, openmeteo)
+                  for batch in chunk_locations(locations, batch_size)]
 
     all_weather_df = pd.concat(dataframes, ignore_index=True)
     return all_weather_df
@@ -117,23 +205,94 @@ def clear_weather_table(connection) -> None:
     curs.close()
 
 
+@timed("transform_weather", rows=len)
 def convert_df_to_list(df: pd.DataFrame):
     """Converts a dataframe to a list of tuples."""
     tuple_list = [tuple(row) for row in df.itertuples(index=False)]
     return tuple_list
 
 
-def insert_into_db(all_weather_df: pd.DataFrame, connection) -> None:
+def score_dataframe(df: pd.DataFrame, connection) -> pd.DataFrame:
+    """Returns the dataframe with the stargazing score of every hour as its last column.
+    The columns are taken in the order of WEATHER_COLUMNS, whatever they are named."""
+    columns = dict(zip(WEATHER_COLUMNS, (df[name].to_numpy() for name in df.columns)))
+    columns["status_at"] = pd.to_datetime(df.iloc[:, 0], utc=True).dt.tz_localize(None).to_numpy()
+    return df.assign(**{SCORE_COLUMN: add_scores(columns, connection)[SCORE_COLUMN]})
+
+
+@timed("load_weather")
+def insert_into_db(all_weather_df: pd.DataFrame, connection, binary: bool = False) -> None:
     """Inserts the weather into the database."""
-    tuple_list = convert_df_to_list(all_weather_df)
+    tuple_list = convert_df_to_list(score_dataframe(all_weather_df, connection))
+    curs = connection.cursor()
+    stats = copy_merge(curs, "weather_status", WEATHER_COLUMNS, tuple_list, binary=binary)
+    add_metric("rows", stats["rows"])
+    add_metric("bytes_loaded", stats["bytes"])
+    connection.commit()
+    curs.close()
+
+
+def upsert_weather(all_weather_df: pd.DataFrame, connection, window_start: str,
+                   binary: bool = False) -> dict:
+    """Merges the weather into the database in a single transaction.
+    Only hours whose values changed are updated, new hours are inserted and hours
+    before the start of the window are removed. Returns counts of each."""
+    scored = score_dataframe(all_weather_df, connection)
+    return merge_weather(convert_df_to_list(scored), connection, window_start, binary)
+
+
+def upsert_weather_columns(columns: dict, connection, window_start: str = None) -> dict:
+    """Merges weather given as numpy arrays, without building a Python object per row.
+    Hours before the window are only pruned when a window start is given."""
+    return merge_weather(add_scores(columns, connection), connection, window_start,
+                         binary=True)
+
+
+@timed("load_weather")
+def merge_weather(rows, connection, window_start: str, binary: bool) -> dict:
+    """Merges rows or columns into weather_status, refreshes the summaries of nights
+    whose hours changed and prunes hours before the window."""
+    curs = connection.cursor()
+    try:
+        stats = copy_merge(curs, "weather_status", WEATHER_COLUMNS, rows,
+                           conflict=["city_id", "status_at"],
+                           update=["temperature", "coverage", "visibility", SCORE_COLUMN],
+                           binary=binary, returning=["city_id", "status_at"])
+        add_metric("rows", stats["rows"])
+        add_metric("bytes_loaded", stats["bytes"])
+        nights = refresh_nights(curs, stats["written"])
+        add_metric("nights_refreshed", nights)
+        pruned = 0
+        if window_start is not None:
+            pruned = delete_before(curs, window_start)
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        curs.close()
+
+    return {"inserted": stats["inserted"],
+            "updated": stats["updated"],
+            "unchanged": stats["unchanged"],
+            "nights": nights,
+            "pruned": pruned}
+
+
+def delete_before(curs, window_start: str) -> int:
+    """Deletes weather hours before the start of the window, returning how many."""
+    curs.execute("DELETE FROM weather_status WHERE status_at < %s;",
+                 (window_start,))
+    return curs.rowcount
+
+
+def prune_weather(connection, window_start: str) -> int:
+    """Removes weather hours before the start of the window."""
     curs = connection.cursor()
-    query = """
-            INSERT INTO weather_status (status_at, temperature, coverage, visibility, city_id)
-            VALUES %s
-            """
-    execute_values(curs, query, tuple_list)
+    pruned = delete_before(curs, window_start)
     connection.commit()
     curs.close()
+    return pruned
 
 
 def lambda_handler(event, context):
@@ -146,7 +305,7 @@ if __name__ == "__main__":
     open_meteo = get_openmeteo()
     locations = get_locations(conn)
     today_str, week_str = get_dates()
-    data = handle_locations(locations, open_meteo, today_str, week_str)
-    clear_weather_table(conn)
-    insert_into_db(data, conn)
+    data = handle_locations_batched(
+        locations, open_meteo, today_str, week_str)
+    upsert_weather(data, conn, today_str)
     conn.close()
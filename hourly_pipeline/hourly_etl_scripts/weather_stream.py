@@ -0,0 +1,102 @@
+"""Streams weather from extract to load in micro-batches, so memory stays flat as cities grow."""
+import asyncio
+import logging
+import time
+
+from weather_extract import (get_weather_columns, combine_weather_columns, upsert_weather_columns,
+                             prune_weather)
+from async_extract import (stream_weather, create_session, aiohttp_fetcher, openmeteo_fetcher,
+                           CONCURRENCY)
+from forecast_history import archive_forecast
+from instrumentation import stage, emit_stage
+
+FLUSH_ROWS = 5000
+
+
+async def transform_weather(weather_stream):
+    """Yields (city_id, columns) for each location in the stream.
+    Only the time spent transforming is counted, and it is emitted as one
+    transform_weather stage when the stream ends."""
+    metrics = {"stage": "transform_weather", "status": "failed", "rows": 0}
+    seconds = 0.0
+    try:
+        async for city_id, hourly in weather_stream:
+            start = time.perf_counter()
+            columns = get_weather_columns(hourly)
+            seconds += time.perf_counter() - start
+            metrics["rows"] += len(columns["status_at"])
+            yield city_id, columns
+        metrics["status"] = "succeeded"
+    finally:
+        emit_stage(metrics, seconds)
+
+
+async def micro_batches(blocks, flush_rows: int = FLUSH_ROWS):
+    """Yields combined columns once at least flush_rows hours have been buffered."""
+    city_ids, buffered, rows = [], [], 0
+    async for city_id, block in blocks:
+        city_ids.append(city_id)
+        buffered.append(block)
+        rows += len(block["status_at"])
+        if rows >= flush_rows:
+            yield combine_weather_columns(city_ids, buffered)
+            city_ids, buffered, rows = [], [], 0
+    if buffered:
+        yield combine_weather_columns(city_ids, buffered)
+
+
+def load_batch(columns: dict, connection, issued_at=None) -> dict:
+    """Upserts one micro-batch and, when given an issue time, archives it as a snapshot."""
+    counts = upsert_weather_columns(columns, connection)
+    if issued_at is not None:
+        counts["archived"] = archive_forecast(columns, connection, issued_at)["inserted"]
+    return counts
+
+
+async def load_weather(batches, connection, issued_at=None) -> dict:
+    """Commits each micro-batch as it arrives, returning the summed counts.
+    Batches are written in a worker thread so requests keep arriving meanwhile."""
+    totals = {"inserted": 0, "updated": 0, "unchanged": 0, "archived": 0, "nights": 0,
+              "batches": 0}
+    async for columns in batches:
+        counts = await asyncio.to_thread(load_batch, columns, connection, issued_at)
+        for key in ("inserted", "updated", "unchanged", "archived", "nights"):
+            totals[key] += counts.get(key, 0)
+        totals["batches"] += 1
+        logging.info("Flushed %s weather rows to the database",
+                     len(columns["status_at"]))
+    return totals
+
+
+async def stream_weather_to_db(locations: list, connection, today: str, week_away: str,
+                               openmeteo=None, flush_rows: int = FLUSH_ROWS,
+                               issued_at=None, prune: bool = True, **options) -> dict:
+    """Chains extract, transform and load for every location.
+    Batches already committed are kept if the run fails part way through,
+    and old hours are only pruned once every batch has been loaded.
+    Each batch is also archived to the forecast history when issued_at is given.
+    Sharded workers skip the prune and leave it to their coordinator.
+    The extract_weather stage is opened before any request starts, so the bytes fetched
+    and retries counted by the request tasks are recorded against it."""
+    async def run(fetch):
+        weather = stream_weather(locations, fetch, today, week_away, **options)
+        return await load_weather(
+            micro_batches(transform_weather(weather), flush_rows), connection, issued_at)
+
+    with stage("extract_weather") as metrics:
+        if openmeteo is not None:
+            totals = await run(openmeteo_fetcher(openmeteo))
+        else:
+            async with create_session(options.get("concurrency", CONCURRENCY)) as session:
+                totals = await run(aiohttp_fetcher(session))
+        metrics["rows"] = totals["inserted"] + totals["updated"] + totals["unchanged"]
+
+    totals["pruned"] = prune_weather(connection, today) if prune else 0
+    return totals
+
+
+def handle_locations_streaming(locations: list, connection, today_str: str, week_str: str,
+                               openmeteo=None, **options) -> dict:
+    """Runs the streaming pipeline from synchronous code."""
+    return asyncio.run(stream_weather_to_db(locations, connection, today_str, week_str,
+                                            openmeteo, **options))
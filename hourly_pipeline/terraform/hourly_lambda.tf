@@ -34,6 +34,13 @@ data "aws_iam_policy_document" "lambda-role-permissions-policy-doc" {
     ]
     resources = [ "arn:aws:logs:eu-west-2:129033205317:*" ]
   }
+  statement {
+    effect = "Allow"
+    actions = [ 
+        "lambda:InvokeFunction" 
+    ]
+    resources = [ "arn:aws:lambda:eu-west-2:129033205317:function:${var.WEATHER_WORKER_FUNCTION}" ]
+  }
 }
 
 # Role
@@ -68,6 +75,7 @@ resource "aws_lambda_function" "pipeline-lambda" {
         DB_USER = var.DB_USER
         DB_PASSWORD = var.DB_PASSWORD
         DB_PORT = var.DB_PORT
+        WEATHER_WORKER_FUNCTION = var.WEATHER_WORKER_FUNCTION
         }
     }
 }
\ No newline at end of file
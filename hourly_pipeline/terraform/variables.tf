@@ -27,4 +27,9 @@ variable "AWS_SECRET_ACCESS_KEY" {
 
 variable "AWS_REGION" {
     type = string
-}
\ No newline at end of file
+}
+
+variable "WEATHER_WORKER_FUNCTION" {
+  type = string
+  default = "c15-star-watch-hourly"
+}
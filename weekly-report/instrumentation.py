@@ -0,0 +1,107 @@
+"""Times pipeline stages and logs each one as a JSON line that CloudWatch can parse."""
+from contextlib import contextmanager
+from contextvars import ContextVar
+import functools
+import inspect
+import json
+import logging
+import resource
+import sys
+import time
+
+# Every record from this invocation, for the summary table.
+RECORDS = []
+SUMMARY_FIELDS = ["stage", "status", "seconds", "rows", "rows_per_second",
+                  "bytes_fetched", "retries", "peak_rss_mb"]
+
+CURRENT_STAGE = ContextVar("current_stage", default=None)
+
+
+def get_peak_rss_mb() -> float:
+    """Returns the peak resident memory of this process in megabytes."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes and macOS reports bytes.
+    if sys.platform == "darwin":
+        return round(peak / 1024 / 1024, 1)
+    return round(peak / 1024, 1)
+
+
+def add_metric(name: str, value: float = 1) -> None:
+    """Adds to a count on the innermost running stage, if there is one."""
+    metrics = CURRENT_STAGE.get()
+    if metrics is not None:
+        metrics[name] = metrics.get(name, 0) + value
+
+
+def emit(record: dict) -> None:
+    """Logs a record as one JSON line and keeps it for the summary."""
+    RECORDS.append(record)
+    logging.info(json.dumps(record, default=str))
+
+
+@contextmanager
+def stage(name: str, **fields):
+    """Times the block, yielding a dict for rows, bytes_fetched or other counts.
+    The record is emitted when the block exits, even if it raises."""
+    metrics = {"stage": name, **fields}
+    token = CURRENT_STAGE.set(metrics)
+    start = time.perf_counter()
+    metrics["status"] = "failed"
+    try:
+        yield metrics
+        metrics["status"] = "succeeded"
+    finally:
+        CURRENT_STAGE.reset(token)
+        emit_stage(metrics, time.perf_counter() - start)
+
+
+def emit_stage(metrics: dict, seconds: float) -> None:
+    """Emits a stage record for work that took the given seconds in total.
+    Used directly for work spread across a stream, which no single block can time."""
+    metrics["seconds"] = round(seconds, 4)
+    if metrics.get("rows") is not None and seconds > 0:
+        metrics["rows_per_second"] = round(metrics["rows"] / seconds, 1)
+    metrics["peak_rss_mb"] = get_peak_rss_mb()
+    emit({"metric": "pipeline_stage", **metrics})
+
+
+def timed(name: str = None, rows=None):
+    """Decorates a function so every call is recorded as a stage.
+    rows is an optional function of the result returning how many rows it holds."""
+    def decorator(func):
+        stage_name = name or func.__name__
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with stage(stage_name) as metrics:
+                    result = await func(*args, **kwargs)
+                    if rows is not None:
+                        metrics["rows"] = rows(result)
+                    return result
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(stage_name) as metrics:
+                result = func(*args, **kwargs)
+                if rows is not None:
+                    metrics["rows"] = rows(result)
+                return result
+        return wrapper
+    return decorator
+
+
+def reset_records() -> None:
+    """Forgets the records of earlier invocations."""
+    RECORDS.clear()
+
+
+def format_summary(records: list = None) -> str:
+    """Returns the records as a plain text table."""
+    records = RECORDS if records is None else records
+    table = [SUMMARY_FIELDS] + [[str(record.get(field, "")) for field in SUMMARY_FIELDS]
+                                for record in records]
+    widths = [max(len(row[i]) for row in table) for i in range(len(SUMMARY_FIELDS))]
+    return "\n".join("  ".join(value.ljust(width) for value, width in zip(row, widths))
+                     for row in table)
@@ -0,0 +1,80 @@
+"""Keeps database connections, HTTP sessions and AWS clients alive between warm
+lambda invocations."""
+import logging
+
+import psycopg2
+import requests
+
+# Everything here lives at module level, which lambda keeps between warm invocations.
+RESOURCES = {}
+INVOCATIONS = [0]
+
+
+def start_invocation() -> dict:
+    """Counts an invocation, returning whether it is the first in this container."""
+    INVOCATIONS[0] += 1
+    cold_start = INVOCATIONS[0] == 1
+    logging.info("%s start, invocation %s of this container",
+                 "Cold" if cold_start else "Warm", INVOCATIONS[0])
+    return {"cold_start": cold_start, "invocation": INVOCATIONS[0]}
+
+
+def get_resource(key, factory):
+    """Returns the resource stored under key, creating it with factory the first time."""
+    if key not in RESOURCES:
+        RESOURCES[key] = factory()
+    return RESOURCES[key]
+
+
+def is_connection_alive(connection) -> bool:
+    """Pings the database, returning False if the connection can no longer be used."""
+    if connection.closed:
+        return False
+    try:
+        # Clears anything a failed invocation left open before pinging.
+        connection.rollback()
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1;")
+            cursor.fetchone()
+        connection.rollback()
+        return True
+    except psycopg2.Error as err:
+        logging.warning("Database connection is dead (%s), reconnecting", err)
+        return False
+
+
+def reuse_connection(connect, name: str = "db"):
+    """Returns a live connection from a previous invocation, or a new one from connect."""
+    connection = RESOURCES.get(("connection", name))
+    if connection is not None and is_connection_alive(connection):
+        return connection
+    if connection is not None:
+        try:
+            connection.close()
+        except psycopg2.Error:
+            pass
+    connection = connect()
+    RESOURCES[("connection", name)] = connection
+    return connection
+
+
+def get_session(name: str = "http") -> requests.Session:
+    """Returns a requests session whose pooled connections are kept between invocations."""
+    return get_resource(("session", name), requests.Session)
+
+
+def get_client(service: str, factory):
+    """Returns the AWS client for a service, creating it with factory the first time."""
+    return get_resource(("client", service), factory)
+
+
+def clear_resources() -> None:
+    """Closes and forgets every kept resource."""
+    for resource in RESOURCES.values():
+        close = getattr(resource, "close", None)
+        if close is not None:
+            try:
+                close()
+            except Exception:
+                pass
+    RESOURCES.clear()
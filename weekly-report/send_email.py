@@ -10,6 +10,8 @@ from boto3 import client
 
 
 from weekly_report_generator import write_email, get_all_cities, get_connection
+from lambda_resources import start_invocation, reuse_connection, get_client
+from instrumentation import timed, reset_records, format_summary
 
 
 def list_all_topics(sns: client):
@@ -49,6 +51,7 @@ def get_emails(sns: client, topic_arn: str):
     return emails
 
 
+@timed("load_email")
 def send_email(ses: client, emails: list, html: str):
     """Sends an email using boto3."""
 
@@ -97,7 +100,8 @@ def clean_city_list(city_list: list):
     return clean_cities
 
 
-def send_all_cities(city_list: list, sns: client, ses: client):
+@timed("send_all_cities")
+def send_all_cities(city_list: list, sns: client, ses: client, conn=None):
     """Sends an email to all emails subscribed to cities in the database."""
     city_list = clean_city_list(city_list)
     for city in city_list:
@@ -108,7 +112,7 @@ def send_all_cities(city_list: list, sns: client, ses: client):
         if emails == []:
             print(f"No emails subscribed to {city}")
         else:
-            html = write_email(city)
+            html = write_email(city, conn)
             send_email(ses, emails, html)
             print(f"Email sent for {city}")
 
@@ -118,17 +122,22 @@ def send_all_cities(city_list: list, sns: client, ses: client):
 def handler(event, context):
     """Lambda handler"""
     load_dotenv()
-    sns = client('sns',
-                 aws_access_key_id=environ["AWS_ACCESS_KEY"],
-                 aws_secret_access_key=environ["AWS_SECRET_ACCESS_KEY"],
-                 region_name=environ["REGION"])
-    ses = client('ses',
-                 aws_access_key_id=environ["AWS_ACCESS_KEY"],
-                 aws_secret_access_key=environ["AWS_SECRET_ACCESS_KEY"],
-                 region_name=environ["REGION"])
-    conn = get_connection()
+    invocation = start_invocation()
+    reset_records()
+    sns = get_client('sns', lambda: client('sns',
+                                           aws_access_key_id=environ["AWS_ACCESS_KEY"],
+                                           aws_secret_access_key=environ["AWS_SECRET_ACCESS_KEY"],
+                                           region_name=environ["REGION"]))
+    ses = get_client('ses', lambda: client('ses',
+                                           aws_access_key_id=environ["AWS_ACCESS_KEY"],
+                                           aws_secret_access_key=environ["AWS_SECRET_ACCESS_KEY"],
+                                           region_name=environ["REGION"]))
+    conn = reuse_connection(get_connection)
     city_list = get_all_cities(conn)
-    send_all_cities(city_list, sns, ses)
+    send_all_cities(city_list, sns, ses, conn)
+    if environ.get("METRICS_SUMMARY") == "true":
+        print(format_summary())
+    return {"statusCode": 200, **invocation}
 
 
 if __name__ == "__main__":
@@ -98,15 +98,12 @@ def test_best_stargazing_day(inp, out):
 
 def test_format_weather_query():
     assert format_weather_query("visibility", "London") == """
-        SELECT ROUND(avg(visibility)) AS visibility, TO_CHAR(w.status_at, 'Day') AS date
-        FROM stargazing_status ss
-        JOIN weather_status AS w 
-        ON w.city_id = ss.city_id
+        SELECT ROUND(n.avg_visibility) AS visibility, TO_CHAR(n.night_date, 'Day') AS date
+        FROM night_summary AS n
         JOIN city AS c
-        ON w.city_id = c.city_id
+        ON n.city_id = c.city_id
         WHERE c.city_name = 'London'
-        AND w.status_at > sunset
-        GROUP BY TO_CHAR(w.status_at, 'Day')
+        AND n.night_date BETWEEN current_date AND current_date + 6
         ORDER BY visibility ASC 
         LIMIT 1
     """
@@ -118,3 +115,15 @@ def test_format_meteor_query():
         FROM meteor_shower
         WHERE current_date >= peak - INTERVAL '7 days';
     """
+
+
+def test_best_stargazing_day_averages_each_night():
+    conn = MagicMock()
+    cur = conn.cursor()
+    cur.fetchone.return_value = {"date": "Fri", "score": 81.5, "visibility": 24000.0, "coverage": 5.0}
+    assert best_stargazing_day(conn, "London") == {"day": "Fri", "visibility": 24000, "coverage": 5}
+    query, params = cur.execute.call_args.args
+    assert "AVG(d.stargazing_score) AS score" in query
+    assert "GROUP BY d.night_date" in query
+    assert "ORDER BY score DESC, d.night_date ASC" in query
+    assert params == ("London",)
@@ -9,6 +9,8 @@ import pandas as pd
 from psycopg2.extras import RealDictCursor
 import altair as alt
 
+from instrumentation import timed
+
 
 def get_connection():
     """Gets a connection to the database"""
@@ -21,6 +23,7 @@ def get_connection():
     return connection
 
 
+@timed("extract_cities", rows=len)
 def get_all_cities(conn):
     """Returns all cities from database."""
     q = """
@@ -44,17 +47,14 @@ def format_meteor_query(meteor_info: str):
 
 
 def format_weather_query(metric: str, city: str):
-    """Formats weather query."""
+    """Formats weather query, reading the nightly summaries kept by the hourly pipeline."""
     q = """
-        SELECT ROUND(avg(%s)) AS %s, TO_CHAR(w.status_at, 'Day') AS date
-        FROM stargazing_status ss
-        JOIN weather_status AS w 
-        ON w.city_id = ss.city_id
+        SELECT ROUND(n.avg_%s) AS %s, TO_CHAR(n.night_date, 'Day') AS date
+        FROM night_summary AS n
         JOIN city AS c
-        ON w.city_id = c.city_id
+        ON n.city_id = c.city_id
         WHERE c.city_name = '%s'
-        AND w.status_at > sunset
-        GROUP BY TO_CHAR(w.status_at, 'Day')
+        AND n.night_date BETWEEN current_date AND current_date + 6
         ORDER BY %s ASC 
         LIMIT 1
     """ % (metric, metric, city, metric)
@@ -107,6 +107,7 @@ def combine_meteor_info(peak: list, start: list, end: list) -> list:
     return all_info
 
 
+@timed("extract_sunrise_set", rows=len)
 def sunrise_set_df(conn, city):
     """Returns a dataframe of sunrise and sunset information this week."""
     q = """
@@ -131,18 +132,16 @@ def sunrise_set_df(conn, city):
     return sunrise_set_df
 
 
+@timed("transform_coverage_graph")
 def average_coverage_graph(conn, city):
     """Returns a line graph showing average coverage per day."""
     q = """
-    SELECT ROUND(avg(coverage)) AS coverage, TO_CHAR(w.status_at, 'Day') AS date, CAST(EXTRACT(ISODOW FROM w.status_at) AS integer) AS day_number
-    FROM stargazing_status ss
-    JOIN weather_status AS w 
-    ON w.city_id = ss.city_id
+    SELECT ROUND(n.avg_coverage) AS coverage, TO_CHAR(n.night_date, 'Day') AS date, CAST(EXTRACT(ISODOW FROM n.night_date) AS integer) AS day_number
+    FROM night_summary AS n
     JOIN city AS c
-    ON w.city_id = c.city_id
+    ON n.city_id = c.city_id
     WHERE c.city_name = '%s'
-    AND w.status_at > sunset
-    GROUP BY TO_CHAR(w.status_at, 'Day'), day_number
+    AND n.night_date BETWEEN current_date AND current_date + 6
     ORDER BY day_number;
 
     """ % (city)
@@ -157,18 +156,16 @@ def average_coverage_graph(conn, city):
         graph.save(f, format="png", ppi=100)
 
 
+@timed("transform_visibility_graph")
 def average_visibility_graph(conn, city):
     """Returns a line graph showing average coverage per day."""
     q = """
-    SELECT ROUND(avg(visibility)) AS visibility, TO_CHAR(w.status_at, 'Day') AS date, CAST(EXTRACT(ISODOW FROM w.status_at) AS integer) AS day_number
-    FROM stargazing_status ss
-    JOIN weather_status AS w 
-    ON w.city_id = ss.city_id
+    SELECT ROUND(n.avg_visibility) AS visibility, TO_CHAR(n.night_date, 'Day') AS date, CAST(EXTRACT(ISODOW FROM n.night_date) AS integer) AS day_number
+    FROM night_summary AS n
     JOIN city AS c
-    ON w.city_id = c.city_id
+    ON n.city_id = c.city_id
     WHERE c.city_name = '%s'
-    AND w.status_at > sunset
-    GROUP BY TO_CHAR(w.status_at, 'Day'), day_number
+    AND n.night_date BETWEEN current_date AND current_date + 6
     ORDER BY day_number;
 
     """ % (city)
@@ -208,47 +205,30 @@ def highest_visibility_day(conn, city):
 
 
 def best_stargazing_day(conn, city):
-    """Returns the best day to go stargazing with visibility and coverage information."""
+    """Returns the night with the city's best average stargazing score this week, with
+    that night's average visibility and coverage. Ties go to the earliest night.
+    Hours are matched to nights through the dark_hours view."""
     q = """
-        WITH coverage_rank as(
-    SELECT ROUND(avg(w.coverage)) AS coverage, TO_CHAR(w.status_at, 'Day') AS date, RANK() OVER (ORDER BY AVG(w.coverage) ASC) AS c_rank
-    FROM stargazing_status ss
-    JOIN weather_status AS w 
-    ON w.city_id = ss.city_id
-    JOIN city AS c
-    ON w.city_id = c.city_id
-    WHERE c.city_name = '%s'
-    AND w.status_at > sunset
-    GROUP BY TO_CHAR(w.status_at, 'Day')
-    ORDER BY coverage ASC 
-    ),
-    visibility_rank AS (
-    SELECT ROUND(avg(w.visibility)) AS visibility, TO_CHAR(w.status_at, 'Day') AS date, RANK() OVER (ORDER BY AVG(w.visibility) desc) AS v_rank
-    FROM stargazing_status ss
-    JOIN weather_status AS w 
-    ON w.city_id = ss.city_id
-    JOIN city AS c
-    ON w.city_id = c.city_id
-    WHERE c.city_name = '%s'
-    AND w.status_at > sunset
-    GROUP BY TO_CHAR(w.status_at, 'Day')
-    ORDER BY visibility ASC 
-    )
-    SELECT c.c_rank * v.v_rank AS RANK ,c.coverage, v.visibility, c.date
-    FROM coverage_rank AS c
-    JOIN visibility_rank AS v
-    ON v.date = c.date
-    ORDER BY RANK ASC
-    LIMIT 1;
-    """ % (city, city)
+        SELECT TO_CHAR(d.night_date, 'Day') AS date, AVG(d.stargazing_score) AS score,
+        AVG(d.coverage) AS coverage, AVG(d.visibility) AS visibility
+        FROM dark_hours AS d
+        JOIN city AS c
+        ON d.city_id = c.city_id
+        WHERE c.city_name = %s
+        AND d.night_date BETWEEN current_date AND current_date + 6
+        GROUP BY d.night_date
+        ORDER BY score DESC, d.night_date ASC
+        LIMIT 1;
+    """
     cur = conn.cursor()
-    cur.execute(q)
+    cur.execute(q, (city,))
     rows = cur.fetchone()
     if rows is None:
         return {"day": "", "visibility": "", "coverage": ""}
     return {"day": rows["date"], "visibility": int(rows["visibility"]), "coverage": int(rows["coverage"])}
 
 
+@timed("transform_report")
 def format_template(conn, city):
     """Returns the formatted template."""
     environment = Environment(loader=FileSystemLoader("."))
@@ -280,8 +260,10 @@ def format_template(conn, city):
     return template.render(context)
 
 
-def write_email(city):
-    """Returns html of the report."""
+def write_email(city, conn=None):
+    """Returns html of the report, using the given connection if there is one."""
+    if conn is not None:
+        return format_template(conn, city)
     load_dotenv()
     conn = get_connection()
     html = format_template(conn, city)